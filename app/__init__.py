@@ -25,9 +25,19 @@ def create_app(config_class=Config):
     with app.app_context():
         from app.auth import auth_bp
         from app.routes import main_bp
+        from app.availability import availability
+        from app.cli import occupancy_cli, rollup_cli
+        from app.scheduler import scheduler
+        from app.mailer import dispatcher
+        from app import jobs
         
         app.register_blueprint(auth_bp)
         app.register_blueprint(main_bp)
+        availability.init_app(app)
+        scheduler.init_app(app)
+        dispatcher.init_app(app)
+        app.cli.add_command(occupancy_cli)
+        app.cli.add_command(rollup_cli)
 
     return app
 
@@ -0,0 +1,179 @@
+"""
+Допуск нового бронирования: все проверки и вставка в одной транзакции.
+
+Транзакция сначала берёт блокировку, сериализующую конкурентные заявки на
+ту же аудиторию и дату (и того же пользователя на ту же дату):
+- SQLite: BEGIN IMMEDIATE - сразу блокировка записи на всю базу; потоки
+  одного процесса дополнительно выстраиваются на threading.Lock, чтобы ждать
+  друг друга без busy-цикла SQLite (он спит до 100 мс за попытку);
+- Postgres: pg_advisory_xact_lock по (аудитория, дата) и (пользователь, дата),
+  снимаются автоматически при COMMIT/ROLLBACK.
+Затем одним SELECT проверяются пересечение по аудитории (включая чужие
+удержания слота из очереди), пересечение по пользователю, дневная квота
+студента и число ожидающих в очереди, после чего бронирование (или запись в
+очереди) вставляется в той же транзакции. Двойное бронирование одного слота
+при одновременных заявках невозможно.
+
+Ту же блокировку берут все, кто меняет удержания (app/waitlist.py): отмена
+бронирования и задача expire_queue_holds.
+"""
+import threading
+from collections import namedtuple
+from contextlib import nullcontext
+from datetime import datetime
+
+from sqlalchemy import func, select, text
+
+from app import db, occupancy, rollup, waitlist
+from app.availability import ACTIVE_STATUSES
+from app.models import Booking
+
+OK = 'ok'
+ROOM_CONFLICT = 'room_conflict'
+USER_CONFLICT = 'user_conflict'
+QUOTA = 'quota'
+QUEUED = 'queued'
+HOLD_EXPIRED = 'hold_expired'
+
+# Сколько действующих бронирований в день может иметь студент
+STUDENT_DAILY_LIMIT = 2
+
+# status - одна из констант выше; booking - созданное бронирование (OK),
+# queue_entry и position - запись в очереди и её номер (QUEUED),
+# conflict_id - id мешающего бронирования
+Admission = namedtuple('Admission', ['status', 'booking', 'queue_entry', 'position', 'conflict_id'],
+                       defaults=(None, None, None, None))
+
+_sqlite_writer = threading.Lock()
+
+
+def writer():
+    """Контекст, выстраивающий пишущие транзакции этого процесса в очередь (только SQLite)"""
+    return _sqlite_writer if db.session.get_bind().dialect.name == 'sqlite' else nullcontext()
+
+
+def lock(classroom_id=None, day=None, user_id=None):
+    """
+    Берёт блокировку на (аудитория, дата) и, если задан user_id, на
+    (пользователь, дата) до конца транзакции. На SQLite блокируется вся база,
+    аргументы не нужны
+    """
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        # pysqlite открывает транзакцию лениво, перед первой записью; если её
+        # ещё нет, открываем сами сразу с блокировкой записи
+        if not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+    elif dialect == 'postgresql' and classroom_id is not None:
+        # Двухключевая форма: (id, дата); id пользователя со знаком минус,
+        # чтобы не совпадать с ключами аудиторий. Порядок всегда одинаковый
+        ordinal = day.toordinal()
+        connection.execute(text('SELECT pg_advisory_xact_lock(:a, :b)'), {'a': classroom_id, 'b': ordinal})
+        if user_id is not None:
+            connection.execute(text('SELECT pg_advisory_xact_lock(:a, :b)'), {'a': -user_id, 'b': ordinal})
+
+
+def lock_all(keys):
+    """
+    Берёт блокировки на все пары (аудитория, дата) из keys одним запросом, в
+    том же постоянном порядке, что и последовательные lock(). Для пачек: число
+    запросов не зависит от числа пар
+    """
+    connection = db.session.connection()
+    keys = sorted(set(keys))
+    if connection.dialect.name != 'postgresql':
+        lock()
+    elif keys:
+        # Подзапрос упорядочен по ordinality, поэтому блокировки берутся по порядку,
+        # как если бы lock() вызывали для каждой пары
+        connection.execute(text(
+            'SELECT pg_advisory_xact_lock(k.a, k.b) FROM ('
+            'SELECT a, b FROM unnest(CAST(:a AS integer[]), CAST(:b AS integer[])) '
+            'WITH ORDINALITY AS u(a, b, n) ORDER BY n) AS k'
+        ), {'a': [classroom_id for classroom_id, _ in keys], 'b': [day.toordinal() for _, day in keys]})
+
+
+def _checks(user_id, classroom_id, day, start, end, now):
+    """
+    Все проверки одним запросом: (конфликт аудитории, чужое удержание,
+    конфликт пользователя, число броней, ожидающие)
+    """
+    room_conflict = select(Booking.id).where(
+        Booking.classroom_id == classroom_id,
+        Booking.booking_date == day,
+        Booking.status.in_(ACTIVE_STATUSES),
+        Booking.overlaps(start, end)
+    ).limit(1).scalar_subquery()
+    user_conflict = select(Booking.id).where(
+        Booking.user_id == user_id,
+        Booking.booking_date == day,
+        Booking.status.in_(ACTIVE_STATUSES),
+        Booking.overlaps(start, end)
+    ).limit(1).scalar_subquery()
+    user_count = select(func.count(Booking.id)).where(
+        Booking.user_id == user_id,
+        Booking.booking_date == day,
+        Booking.status.in_(ACTIVE_STATUSES)
+    ).scalar_subquery()
+    held = waitlist.held_by_other(user_id, classroom_id, day, start, end, now)
+    waiting = waitlist.waiting_count(classroom_id, day, start, end)
+    return db.session.execute(select(room_conflict, held, user_conflict, user_count, waiting)).one()
+
+
+def admit(user, classroom_id, day, start, end, purpose, enqueue=True, hold=None):
+    """
+    Проверяет и создаёт бронирование в одной транзакции, фиксирует её и
+    возвращает Admission. Если аудитория занята и enqueue=True, пользователь
+    ставится в очередь ожидания. hold - запись очереди с удержанием слота,
+    которое подтверждается этим бронированием (HOLD_EXPIRED, если оно истекло)
+    """
+    with writer():
+        return _admit(user, classroom_id, day, start, end, purpose, enqueue and hold is None, hold)
+
+
+def _admit(user, classroom_id, day, start, end, purpose, enqueue, hold):
+    now = datetime.now()
+    try:
+        lock(classroom_id, day, user.id)
+        if hold is not None and not waitlist.claim(hold, now):
+            db.session.rollback()
+            return Admission(HOLD_EXPIRED)
+        room_conflict, held, user_conflict, user_count, waiting = _checks(
+            user.id, classroom_id, day, start, end, now
+        )
+
+        if room_conflict is not None or held is not None:
+            if not enqueue:
+                db.session.rollback()
+                return Admission(ROOM_CONFLICT, conflict_id=room_conflict)
+            entry = waitlist.enqueue(user.id, classroom_id, day, start, end)
+            waitlist.notify_queued(entry, user, waiting + 1)
+            db.session.commit()
+            return Admission(QUEUED, queue_entry=entry, position=waiting + 1, conflict_id=room_conflict)
+
+        if user_conflict is not None:
+            db.session.rollback()
+            return Admission(USER_CONFLICT, conflict_id=user_conflict)
+
+        if user.role == 'student' and user_count >= STUDENT_DAILY_LIMIT:
+            db.session.rollback()
+            return Admission(QUOTA)
+
+        booking = Booking(
+            user_id=user.id,
+            classroom_id=classroom_id,
+            booking_date=day,
+            start_time=start,
+            end_time=end,
+            purpose=purpose,
+            status='approved' if user.role == 'teacher' else 'pending'
+        )
+        db.session.add(booking)
+        occupancy.mark(booking)
+        rollup.record(booking, None, booking.status)
+        db.session.commit()
+        return Admission(OK, booking=booking)
+    except Exception:
+        db.session.rollback()
+        raise
@@ -0,0 +1,171 @@
+"""
+Индекс занятости аудиторий.
+
+Для каждой пары (аудитория, дата) хранится отсортированный по началу список
+активных (pending/approved) бронирований. Проверка "пересекается ли [start, end)
+с чем-нибудь" выполняется бинарным поиском по этому списку, без запроса к БД.
+
+Индекс заполняется лениво: при первом обращении к (аудитория, дата) бронирования
+загружаются одним запросом. Маршруты, изменяющие бронирования, обновляют индекс
+после коммита. Записи устаревают через AVAILABILITY_INDEX_TTL секунд, чтобы
+изменения, сделанные другими воркерами gunicorn, тоже попадали в индекс.
+
+version(classroom_id) меняется при каждом изменении бронирований аудитории
+в этом процессе - по нему другие кэши (например, предпросмотр регулярных
+бронирований) понимают, что их данные устарели.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple
+
+from app import db
+from app.models import Booking
+
+ACTIVE_STATUSES = ('pending', 'approved')
+
+# Сколько раз перечитать дату, если аудиторию меняли во время загрузки
+LOAD_ATTEMPTS = 3
+
+Slot = namedtuple('Slot', ['start', 'end', 'booking_id'])
+
+
+class RoomDay:
+    """Интервалы бронирований одной аудитории на одну дату"""
+
+    def __init__(self, slots=()):
+        self.slots = sorted(slots)
+        self._reindex()
+
+    def _reindex(self):
+        # starts - начала интервалов для бинарного поиска,
+        # max_end[i] - индекс интервала с наибольшим концом среди slots[0..i]
+        self.starts = [slot.start for slot in self.slots]
+        self.max_end = []
+        best = None
+        for i, slot in enumerate(self.slots):
+            if best is None or slot.end > self.slots[best].end:
+                best = i
+            self.max_end.append(best)
+
+    def add(self, slot):
+        insort(self.slots, slot)
+        self._reindex()
+
+    def discard(self, booking_id):
+        slots = [slot for slot in self.slots if slot.booking_id != booking_id]
+        if len(slots) != len(self.slots):
+            self.slots = slots
+            self._reindex()
+
+    def find_overlap(self, start, end):
+        """Возвращает интервал, пересекающийся с [start, end), или None"""
+        # Та же логика, что и Booking.overlaps: кандидаты - все интервалы,
+        # начинающиеся раньше end; пересечение есть, если хоть один из них
+        # заканчивается позже start
+        idx = bisect_left(self.starts, end)
+        if idx == 0:
+            return None
+        candidate = self.slots[self.max_end[idx - 1]]
+        return candidate if candidate.end > start else None
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class AvailabilityIndex:
+    """Кэш занятости аудиторий по датам"""
+
+    def __init__(self, app=None):
+        self.ttl = 30
+        self._days = {}
+        self._generation = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('AVAILABILITY_INDEX_TTL', 30)
+        self.clear()
+        app.extensions['availability'] = self
+
+    def clear(self):
+        with self._lock:
+            self._days.clear()
+            self._generation += 1
+
+    def version(self, classroom_id):
+        """Версия бронирований аудитории; меняется при любом их изменении"""
+        with self._lock:
+            return self._generation, self._versions.get(classroom_id, 0)
+
+    def _bump(self, classroom_id):
+        self._versions[classroom_id] = self._versions.get(classroom_id, 0) + 1
+
+    def invalidate(self, classroom_id, day):
+        with self._lock:
+            self._days.pop((classroom_id, day), None)
+            self._bump(classroom_id)
+
+    def _load(self, classroom_id, day):
+        rows = db.session.query(Booking.start_time, Booking.end_time, Booking.id).filter(
+            Booking.classroom_id == classroom_id,
+            Booking.booking_date == day,
+            Booking.status.in_(ACTIVE_STATUSES)
+        ).all()
+        return RoomDay(Slot(*row) for row in rows)
+
+    def _room_day(self, classroom_id, day):
+        key = (classroom_id, day)
+        for _ in range(LOAD_ATTEMPTS):
+            with self._lock:
+                entry = self._days.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    return entry[1]
+                seen = (self._generation, self._versions.get(classroom_id, 0))
+
+            room_day = self._load(classroom_id, day)
+            with self._lock:
+                # Пока день загружался без блокировки, add/discard могли пройти мимо
+                # него (записи в _days ещё не было) - такую загрузку не кэшируем
+                if (self._generation, self._versions.get(classroom_id, 0)) == seen:
+                    self._days[key] = (time.monotonic() + self.ttl, room_day)
+                    return room_day
+        # Аудиторию всё время меняют: отвечаем по последней загрузке, не кэшируя её
+        return room_day
+
+    def find_conflict(self, classroom_id, day, start, end):
+        """Возвращает Slot бронирования, пересекающегося с [start, end), или None"""
+        room_day = self._room_day(classroom_id, day)
+        with self._lock:
+            return room_day.find_overlap(start, end)
+
+    def is_free(self, classroom_id, day, start, end):
+        return self.find_conflict(classroom_id, day, start, end) is None
+
+    def add(self, booking):
+        """Добавляет бронирование в индекс (если дата уже загружена)"""
+        if booking.status not in ACTIVE_STATUSES:
+            return
+        with self._lock:
+            self._bump(booking.classroom_id)
+            entry = self._days.get((booking.classroom_id, booking.booking_date))
+            if entry is not None:
+                entry[1].add(Slot(booking.start_time, booking.end_time, booking.id))
+
+    def discard(self, booking):
+        """Убирает бронирование из индекса"""
+        with self._lock:
+            self._bump(booking.classroom_id)
+            entry = self._days.get((booking.classroom_id, booking.booking_date))
+            if entry is not None:
+                entry[1].discard(booking.id)
+
+    def sync(self, booking):
+        """Приводит индекс в соответствие с текущим статусом бронирования"""
+        self.discard(booking)
+        self.add(booking)
+
+
+availability = AvailabilityIndex()
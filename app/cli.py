@@ -0,0 +1,33 @@
+import click
+from flask.cli import AppGroup
+
+from app import db, occupancy, rollup
+
+occupancy_cli = AppGroup('occupancy', help='Битовые маски занятости аудиторий.')
+rollup_cli = AppGroup('rollup', help='Дневная сводка бронирований для админки.')
+
+
+@occupancy_cli.command('rebuild')
+@click.option('--from', 'date_from', type=click.DateTime(formats=['%Y-%m-%d']), help='Начальная дата (YYYY-MM-DD)')
+@click.option('--to', 'date_to', type=click.DateTime(formats=['%Y-%m-%d']), help='Конечная дата (YYYY-MM-DD)')
+def rebuild_occupancy(date_from, date_to):
+    """Перестраивает таблицу room_occupancy по таблице booking"""
+    count = occupancy.rebuild(
+        date_from=date_from.date() if date_from else None,
+        date_to=date_to.date() if date_to else None
+    )
+    db.session.commit()
+    click.echo(f'Перестроено {count} масок занятости')
+
+
+@rollup_cli.command('rebuild')
+@click.option('--from', 'date_from', type=click.DateTime(formats=['%Y-%m-%d']), help='Начальная дата (YYYY-MM-DD)')
+@click.option('--to', 'date_to', type=click.DateTime(formats=['%Y-%m-%d']), help='Конечная дата (YYYY-MM-DD)')
+def rebuild_rollup(date_from, date_to):
+    """Пересчитывает таблицу booking_daily_rollup по таблице booking"""
+    count = rollup.rebuild(
+        date_from=date_from.date() if date_from else None,
+        date_to=date_to.date() if date_to else None
+    )
+    db.session.commit()
+    click.echo(f'Пересчитано {count} строк сводки')
@@ -0,0 +1,236 @@
+"""
+Периодические задачи, выполняемые планировщиком (app/scheduler.py).
+"""
+import logging
+from datetime import date, datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, func, or_, text
+from sqlalchemy.orm import contains_eager, joinedload
+
+from app import db, admission, occupancy, outbox, push, recurrence, rollup, waitlist
+from app.availability import availability
+from app.models import Booking, BookingQueue, RecurringBooking, User, ACTIVE_BOOKING_SQL
+from app.scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Сколько серий развёртывается за один запрос конфликтов и один INSERT
+RECURRING_BATCH_SIZE = 500
+
+# Сколько истёкших удержаний слотов снимается в одной транзакции
+HOLD_BATCH_SIZE = 500
+
+# Сколько прошедших бронирований завершается в одной транзакции
+COMPLETE_BATCH_SIZE = 500
+
+
+def _expired_filter(now):
+    """Активные бронирования, закончившиеся до момента now"""
+    return and_(
+        text(ACTIVE_BOOKING_SQL),
+        Booking.booking_date <= now.date(),
+        or_(Booking.booking_date < now.date(), Booking.end_time < now.time())
+    )
+
+
+@scheduler.job('complete_past_bookings', interval=60)
+def complete_past_bookings(now=None, batch_size=COMPLETE_BATCH_SIZE):
+    """Помечает прошедшие бронирования как завершенные пачками. Возвращает их число"""
+    now = now if now is not None else datetime.now()
+    expired = _expired_filter(now)
+    completed = 0
+
+    while True:
+        with admission.writer():
+            try:
+                admission.lock()
+                due = db.session.query(Booking.id, Booking.classroom_id, Booking.booking_date).filter(
+                    expired
+                ).order_by(Booking.id).limit(batch_size).all()
+                admission.lock_all((row.classroom_id, row.booking_date) for row in due)
+                # Строки перечитываются с блокировкой: сводка и UPDATE считаются по одним и тем же
+                # id, и одобрение или отмена не может вклиниться между ними
+                ids = [row.id for row in db.session.query(Booking.id).filter(
+                    Booking.id.in_([row.id for row in due]), expired
+                ).with_for_update()] if due else []
+                groups = db.session.query(
+                    Booking.classroom_id,
+                    Booking.booking_date,
+                    Booking.status,
+                    func.count(Booking.id),
+                    func.coalesce(func.sum(Booking.duration_minutes), 0)
+                ).filter(Booking.id.in_(ids)).group_by(
+                    Booking.booking_date, Booking.classroom_id, Booking.status
+                ).all() if ids else []
+
+                for classroom_id, day, status, count, minutes in groups:
+                    rollup.apply(classroom_id, day, rollup.transition_deltas(status, 'completed', count, minutes))
+                if ids:
+                    db.session.query(Booking).filter(Booking.id.in_(ids)).update(
+                        {Booking.status: 'completed'}, synchronize_session=False
+                    )
+                # pending -> completed меняет маску подтверждённых слотов
+                for classroom_id, day, status, _, _ in groups:
+                    if status == 'pending':
+                        occupancy.refresh(classroom_id, day)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        for classroom_id, day, _, _, _ in groups:
+            availability.invalidate(classroom_id, day)
+        completed += len(ids)
+        if len(due) < batch_size:
+            break
+
+    if completed:
+        logger.info('Автоматически завершено %s бронирований', completed)
+    return completed
+
+
+@scheduler.job('extend_recurring_series', interval=3600)
+def extend_recurring_series(today=None, batch_size=RECURRING_BATCH_SIZE):
+    """Продлевает активные серии до горизонта пачками. Возвращает число созданных бронирований"""
+    today = today if today is not None else date.today()
+    horizon = recurrence.horizon(today)
+    created = 0
+    last_id = 0
+
+    while True:
+        # Пачка выбирается и развёртывается в одной транзакции под блокировками admission
+        with admission.writer():
+            try:
+                admission.lock()
+                # Только серии, у которых есть неразвёрнутый хвост до горизонта
+                batch = RecurringBooking.query.options(joinedload(RecurringBooking.user)).filter(
+                    RecurringBooking.id > last_id,
+                    RecurringBooking.status == 'active',
+                    RecurringBooking.end_date >= today,
+                    or_(
+                        RecurringBooking.materialized_until.is_(None),
+                        and_(RecurringBooking.materialized_until < horizon,
+                             RecurringBooking.materialized_until < RecurringBooking.end_date)
+                    )
+                ).order_by(RecurringBooking.id).limit(batch_size).all()
+                if not batch:
+                    db.session.rollback()
+                    break
+
+                occurrences = recurrence.materialize(batch, date_from=today, date_to=horizon)
+                created += sum(1 for occurrence in occurrences if occurrence.conflict is None)
+                last_id = batch[-1].id
+                keys = recurrence.created_keys(occurrences)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        recurrence.invalidate(keys)
+
+    if created:
+        logger.info('Регулярные серии продлены до %s: создано %s бронирований', horizon, created)
+    return created
+
+
+@scheduler.job('expire_queue_holds', interval=15)
+def expire_queue_holds(now=None, batch_size=HOLD_BATCH_SIZE):
+    """
+    Снимает истёкшие удержания слотов пачками (самые ранние первыми) и
+    передаёт освободившиеся интервалы следующим в очереди. Возвращает число
+    снятых удержаний
+    """
+    now = now if now is not None else datetime.now()
+    expired = 0
+
+    while True:
+        with admission.writer():
+            try:
+                admission.lock()
+                due = waitlist.due_holds(now, batch_size)
+                # Те же блокировки, что у admit, в постоянном порядке
+                admission.lock_all((entry.classroom_id, entry.booking_date) for entry in due)
+                # Пока ждали блокировок, удержание могли подтвердить или удалить
+                batch = BookingQueue.query.populate_existing().filter(
+                    BookingQueue.id.in_([entry.id for entry in due]),
+                    BookingQueue.status == 'notified',
+                    BookingQueue.hold_expires_at <= now
+                ).all() if due else []
+
+                for entry in batch:
+                    entry.status = 'expired'
+                db.session.flush()
+
+                # head ищем только там, где вообще кто-то ждёт
+                waiting = waitlist.days_with_waiters({(entry.classroom_id, entry.booking_date) for entry in batch})
+                promoted = []
+                for entry in batch:
+                    if ((entry.classroom_id, entry.booking_date) in waiting
+                            and datetime.combine(entry.booking_date, entry.end_time) > now):
+                        promoted += waitlist.promote(entry.classroom_id, entry.booking_date,
+                                                     entry.start_time, entry.end_time, now)
+                waitlist.notify(promoted)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        expired += len(batch)
+        if len(due) < batch_size:
+            break
+
+    if expired:
+        logger.info('Снято %s истёкших удержаний', expired)
+    return expired
+
+
+@scheduler.job('drain_email_outbox', interval=5)
+def drain_email_outbox():
+    """Отправляет накопившиеся письма из email_outbox. Возвращает число отправленных"""
+    sent = outbox.drain()
+    if sent:
+        logger.info('Отправлено %s писем', sent)
+    return sent
+
+
+@scheduler.job('send_booking_reminders', interval=60)
+def send_booking_reminders(now=None):
+    """
+    Ставит в telegram_outbox напоминания об одобренных бронированиях, которые
+    начнутся в ближайшие BOOKING_REMINDER_MINUTES минут. Возвращает число
+    поставленных напоминаний
+    """
+    now = now if now is not None else datetime.now()
+    soon = now + timedelta(minutes=current_app.config['BOOKING_REMINDER_MINUTES'])
+    # Рабочий день заканчивается до полуночи, поэтому окно всегда в пределах одного дня.
+    # Условие по ACTIVE_BOOKING_SQL и дате идёт по частичному индексу ix_booking_active_date
+    upcoming = and_(
+        text(ACTIVE_BOOKING_SQL),
+        Booking.booking_date == now.date(),
+        Booking.status == 'approved',
+        Booking.reminder_sent == False,
+        Booking.start_time > now.time(),
+        Booking.start_time <= (soon.time() if soon.date() == now.date() else time.max)
+    )
+    due = Booking.query.join(User).options(contains_eager(Booking.user), joinedload(Booking.classroom)).filter(
+        upcoming
+    ).order_by(Booking.start_time, Booking.id).all()
+    if not due:
+        return 0
+    bookings = [booking for booking in due if booking.user.telegram_chat_id is not None]
+    for booking in bookings:
+        push.add(booking.user, (
+            f'Напоминание: в {booking.start_time.strftime("%H:%M")} у вас бронирование '
+            f'аудитории {booking.classroom.room_number} ({booking.purpose}).'
+        ))
+
+    # Флаг ставится и тем, у кого Telegram не привязан, чтобы не перебирать их каждую минуту.
+    # Только выбранным строкам: бронирование, попавшее в окно после выборки, получит напоминание
+    # при следующем запуске
+    db.session.query(Booking).filter(Booking.id.in_([booking.id for booking in due])).update(
+        {Booking.reminder_sent: True}, synchronize_session=False
+    )
+    db.session.commit()
+    if bookings:
+        logger.info('Поставлено %s напоминаний о бронированиях', len(bookings))
+    return len(bookings)
@@ -0,0 +1,302 @@
+"""
+Отправка писем пулом фоновых потоков.
+
+Письма приложения сначала записываются в email_outbox (app/outbox.py), а
+сюда их передаёт задача drain_email_outbox через send_many.
+
+Письма складываются в ограниченную очередь (MAIL_QUEUE_SIZE), а MAIL_WORKERS
+потоков разбирают её пачками до MAIL_BATCH_SIZE писем. Каждый поток держит
+одно SMTP-соединение (mail.connect()) открытым и закрывает его после
+IDLE_SECONDS простоя, так что TLS-рукопожатие делается один раз на поток, а
+не на каждое письмо.
+
+Обратное давление: если очередь полна, submit ждёт до MAIL_SUBMIT_TIMEOUT
+секунд и отказывается, вместо того чтобы плодить потоки и соединения.
+
+Размыкатель цепи: после MAIL_BREAKER_THRESHOLD неудачных отправок подряд
+он открывается на MAIL_BREAKER_COOLDOWN секунд - новые письма сразу
+отклоняются, потоки не обращаются к серверу. Затем одна пробная отправка
+решает, закрыть его или открыть снова.
+
+При остановке процесса очередь дописывается не дольше DRAIN_SECONDS.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from flask import current_app
+
+from app import mail
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд простоя поток закрывает своё SMTP-соединение
+IDLE_SECONDS = 30
+
+# Сколько секунд при остановке процесса дописывается очередь
+DRAIN_SECONDS = 10
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_STOP = object()
+
+
+class CircuitBreaker:
+    """Размыкатель цепи: closed -> open после threshold ошибок подряд -> half_open после cooldown"""
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return CLOSED
+        return HALF_OPEN if now - self._opened_at >= self.cooldown else OPEN
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def allow(self):
+        """Можно ли сейчас отправлять. В half_open разрешается одна пробная отправка"""
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return state == CLOSED
+
+    def retry_after(self):
+        """Через сколько секунд размыкатель перейдёт в half_open"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(0, self._opened_at + self.cooldown - time.monotonic())
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            # Неудачная проба снова открывает размыкатель на полный cooldown
+            if self._probing or self.failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class EmailDispatcher:
+    """Ограниченная очередь писем и фиксированный пул отправляющих потоков"""
+
+    def __init__(self, app=None):
+        self.workers = 2
+        self.batch_size = 50
+        self.submit_timeout = 1.0
+        self.breaker = CircuitBreaker()
+        self.sent = 0
+        self.failed = 0
+        self.rejected = 0
+        self._queue = queue.Queue(maxsize=1000)
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._atexit = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Повторная инициализация (новое приложение в тестах) начинает с нового пула
+        self.stop(timeout=0)
+        self.workers = app.config.get('MAIL_WORKERS', 2)
+        self.batch_size = app.config.get('MAIL_BATCH_SIZE', 50)
+        self.submit_timeout = app.config.get('MAIL_SUBMIT_TIMEOUT', 1.0)
+        self.breaker = CircuitBreaker(app.config.get('MAIL_BREAKER_THRESHOLD', 5),
+                                      app.config.get('MAIL_BREAKER_COOLDOWN', 30))
+        self.sent = self.failed = self.rejected = 0
+        self._queue = queue.Queue(maxsize=app.config.get('MAIL_QUEUE_SIZE', 1000))
+        self._stopping = threading.Event()
+        if not self._atexit:
+            atexit.register(self.stop, timeout=DRAIN_SECONDS)
+            self._atexit = True
+        app.extensions['email_dispatcher'] = self
+
+    def submit(self, message, callback=None):
+        """
+        Ставит письмо в очередь. False - письмо отброшено (сервер недоступен
+        или очередь полна). callback(error) вызывается из потока пула после
+        попытки отправки; error - None, если письмо отправлено
+        """
+        if self.breaker.state == OPEN:
+            self._count('rejected')
+            logger.warning('SMTP недоступен, письмо "%s" не отправлено', message.subject)
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put((message, callback), timeout=self.submit_timeout)
+        except queue.Full:
+            self._count('rejected')
+            logger.warning('Очередь писем переполнена, письмо "%s" не отправлено', message.subject)
+            return False
+        return True
+
+    def send_many(self, messages, timeout=None):
+        """
+        Отправляет письма пулом и ждёт результата не дольше timeout секунд.
+        Возвращает ошибки в том же порядке (None - письмо отправлено)
+        """
+        errors = ['нет результата за отведённое время'] * len(messages)
+        remaining = [len(messages)]
+        done = threading.Event()
+        lock = threading.Lock()
+
+        def recorder(i):
+            def record(error):
+                with lock:
+                    errors[i] = error
+                    remaining[0] -= 1
+                    if not remaining[0]:
+                        done.set()
+            return record
+
+        for i, message in enumerate(messages):
+            if not self.submit(message, recorder(i)):
+                recorder(i)('SMTP недоступен или очередь писем полна')
+        if messages:
+            done.wait(timeout)
+        with lock:
+            return list(errors)
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def flush(self, timeout=None):
+        """Ждёт, пока все принятые письма будут отправлены или отброшены. True, если дождались"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self, timeout=None):
+        """Дописывает очередь и останавливает потоки, ожидая не дольше timeout секунд"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0, deadline - time.monotonic())
+
+        self._stopping.set()
+        for _ in threads:
+            try:
+                self._queue.put(_STOP, timeout=remaining())
+            except queue.Full:
+                break
+        for thread in threads:
+            thread.join(remaining())
+        return not any(thread.is_alive() for thread in threads)
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            app = current_app._get_current_object()
+            self._threads = [
+                threading.Thread(target=self._work, args=(app, self._queue, self._stopping),
+                                 name=f'mailer-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _work(self, app, jobs, stopping):
+        with app.app_context():
+            connection = None
+            running = True
+            while running:
+                try:
+                    message = jobs.get(timeout=IDLE_SECONDS)
+                except queue.Empty:
+                    connection = self._close(connection)
+                    continue
+                batch = [message]
+                # Метка остановки завершает пачку: остальные метки - другим потокам
+                while batch[-1] is not _STOP and len(batch) < self.batch_size:
+                    try:
+                        batch.append(jobs.get_nowait())
+                    except queue.Empty:
+                        break
+                for item in batch:
+                    if item is _STOP:
+                        running = False
+                    else:
+                        message, callback = item
+                        connection, error = self._deliver(connection, message, stopping)
+                        if callback is not None:
+                            callback(error)
+                    jobs.task_done()
+            self._close(connection)
+
+    def _deliver(self, connection, message, stopping):
+        """
+        Отправляет письмо через соединение потока, переоткрывая его один раз
+        при ошибке. Возвращает (соединение, текст ошибки или None)
+        """
+        while not self.breaker.allow():
+            if stopping.is_set():
+                self._count('failed')
+                logger.warning('SMTP недоступен при остановке, письмо "%s" не отправлено', message.subject)
+                return connection, 'SMTP недоступен'
+            time.sleep(min(self.breaker.retry_after(), 1.0) or 0.05)
+
+        error = None
+        for attempt in range(2):
+            try:
+                if connection is None:
+                    connection = mail.connect().__enter__()
+                connection.send(message)
+                self.breaker.success()
+                self._count('sent')
+                return connection, None
+            except Exception as e:
+                # Сервер мог закрыть простаивающее соединение - пробуем новое
+                connection = self._close(connection)
+                error = f'{type(e).__name__}: {e}'
+                if attempt:
+                    self.breaker.failure()
+                    self._count('failed')
+                    logger.exception('Ошибка при отправке письма "%s"', message.subject)
+        return connection, error
+
+    @staticmethod
+    def _close(connection):
+        if connection is not None and connection.host is not None:
+            try:
+                connection.host.quit()
+            except Exception:
+                connection.host.close()
+        return None
+
+
+dispatcher = EmailDispatcher()
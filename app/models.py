@@ -30,6 +30,10 @@
 #     id = db.Column(db.Integer, primary_key=True)
 from app import db, login_manager
 from flask_login import UserMixin
+from sqlalchemy import text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
+from sqlalchemy.sql.expression import FunctionElement
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
@@ -43,6 +47,9 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(256))
     role = db.Column(db.String(20), default='student')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Чат Telegram для push-уведомлений; привязывается командой бота /link <код>
+    telegram_chat_id = db.Column(db.BigInteger, unique=True, index=True)
+    telegram_link_code = db.Column(db.String(16), unique=True, index=True)
 
     bookings = db.relationship('Booking', backref='user', lazy='dynamic')
 
@@ -73,7 +80,58 @@ class Classroom(db.Model):
         return f'<Classroom {self.room_number}>'
 
 
-class RecurringBooking(db.Model):
+class minutes_of_day(FunctionElement):
+    """Число минут от полуночи для колонки типа Time (SQLite и Postgres)"""
+    type = db.Integer()
+    name = 'minutes_of_day'
+    inherit_cache = True
+
+
+@compiles(minutes_of_day)
+def _minutes_of_day_default(element, compiler, **kw):
+    column = compiler.process(list(element.clauses)[0], **kw)
+    return f'(CAST(EXTRACT(EPOCH FROM {column}) AS INTEGER) / 60)'
+
+
+@compiles(minutes_of_day, 'sqlite')
+def _minutes_of_day_sqlite(element, compiler, **kw):
+    # SQLite хранит время строкой 'HH:MM:SS.ffffff'
+    column = compiler.process(list(element.clauses)[0], **kw)
+    return f'(CAST(substr({column}, 1, 2) AS INTEGER) * 60 + CAST(substr({column}, 4, 2) AS INTEGER))'
+
+
+def upsert(model):
+    """INSERT с поддержкой ON CONFLICT для текущей СУБД (SQLite/Postgres) или None"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(model)
+
+
+class TimeRangeMixin:
+    """Общая проверка пересечения интервалов [start_time, end_time)"""
+
+    @hybrid_method
+    def overlaps(self, start, end):
+        # Два полуоткрытых интервала пересекаются, если каждый начинается
+        # раньше, чем заканчивается другой. Одно условие вместо трёх OR
+        # позволяет планировщику использовать составной индекс.
+        return (self.start_time < end) & (self.end_time > start)
+
+    @hybrid_property
+    def duration_minutes(self):
+        return (self.end_time.hour * 60 + self.end_time.minute) - (self.start_time.hour * 60 + self.start_time.minute)
+
+    @duration_minutes.expression
+    def duration_minutes(cls):
+        return minutes_of_day(cls.end_time) - minutes_of_day(cls.start_time)
+
+
+class RecurringBooking(TimeRangeMixin, db.Model):
     __tablename__ = 'recurring_booking'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -87,14 +145,30 @@ class RecurringBooking(db.Model):
     purpose = db.Column(db.String(200), nullable=False)
     recurrence_type = db.Column(db.String(20), default='weekly')
     status = db.Column(db.String(20), default='active')
+    # Последняя дата, до которой вхождения серии уже созданы в booking
+    materialized_until = db.Column(db.Date, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     user = db.relationship('User', backref='recurring_bookings')
     classroom = db.relationship('Classroom', backref='recurring_bookings')
 
 
-class Booking(db.Model):
+# Условие частичного индекса ix_booking_active_date. Запрос может использовать
+# индекс, только если содержит это условие буквально (без bind-параметров)
+ACTIVE_BOOKING_SQL = "status IN ('pending', 'approved')"
+
+
+class Booking(TimeRangeMixin, db.Model):
     __tablename__ = 'booking'
+    __table_args__ = (
+        db.Index('ix_booking_classroom_date_status', 'classroom_id', 'booking_date', 'status', 'start_time', 'end_time'),
+        # Покрывает и проверку пересечений пользователя, и постраничный профиль (app/pagination.py)
+        db.Index('ix_booking_user_date', 'user_id', 'booking_date', 'start_time', 'id'),
+        # Частичный индекс только по активным бронированиям - для фоновой задачи,
+        # завершающей прошедшие бронирования
+        db.Index('ix_booking_active_date', 'booking_date',
+                 sqlite_where=text(ACTIVE_BOOKING_SQL), postgresql_where=text(ACTIVE_BOOKING_SQL)),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -106,12 +180,119 @@ class Booking(db.Model):
     status = db.Column(db.String(20), default='pending')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     recurring_booking_id = db.Column(db.Integer, db.ForeignKey('recurring_booking.id'), nullable=True)
+    # Напоминание о скором начале уже поставлено в telegram_outbox (задача send_booking_reminders)
+    reminder_sent = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
 
     recurring_booking = db.relationship('RecurringBooking', backref='generated_bookings')
 
 
-class BookingQueue(db.Model):
+class RoomOccupancy(db.Model):
+    """Битовые маски занятости аудитории на дату (один бит - 15-минутный слот)"""
+    __tablename__ = 'room_occupancy'
+
+    day = db.Column(db.Date, primary_key=True)
+    classroom_id = db.Column(db.Integer, db.ForeignKey('classroom.id'), primary_key=True)
+    busy_mask = db.Column(db.BigInteger, nullable=False, default=0)
+    approved_mask = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<RoomOccupancy classroom={self.classroom_id} day={self.day}>'
+
+
+class BookingDailyRollup(db.Model):
+    """Сводка бронирований аудитории за день, обновляется при каждом изменении статуса"""
+    __tablename__ = 'booking_daily_rollup'
+
+    day = db.Column(db.Date, primary_key=True)
+    classroom_id = db.Column(db.Integer, db.ForeignKey('classroom.id'), primary_key=True)
+    booking_count = db.Column(db.Integer, nullable=False, default=0)
+    booked_minutes = db.Column(db.Integer, nullable=False, default=0)
+    pending_count = db.Column(db.Integer, nullable=False, default=0)
+    approved_count = db.Column(db.Integer, nullable=False, default=0)
+    rejected_count = db.Column(db.Integer, nullable=False, default=0)
+    completed_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<BookingDailyRollup classroom={self.classroom_id} day={self.day}>'
+
+
+class SchedulerLease(db.Model):
+    """Аренда лидерства для периодической задачи: задачу выполняет только держатель"""
+    __tablename__ = 'scheduler_lease'
+
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<SchedulerLease {self.name} holder={self.holder}>'
+
+
+class EmailOutbox(db.Model):
+    """Письмо, записанное в одной транзакции с изменением; отправляется задачей drain_email_outbox"""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_due', 'status', 'next_attempt_at'),
+        db.Index('ix_email_outbox_claim', 'claim_token'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipients = db.Column(db.Text, nullable=False)  # адреса через запятую
+    subject = db.Column(db.String(255), nullable=False)
+    text_body = db.Column(db.Text)
+    html_body = db.Column(db.Text)
+    # Уведомление по шаблону app/templates/email/<template>.{txt,html} с контекстом
+    # в JSON; рендерится при отправке, несколько таких писем одному адресату - сводкой
+    template = db.Column(db.String(64))
+    context = db.Column(db.Text)
+    # pending -> sent или failed (после исчерпания попыток)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Кто разбирает письмо сейчас и до какого момента (потом его может забрать другой)
+    claim_token = db.Column(db.String(32))
+    claimed_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<EmailOutbox {self.id} {self.status}>'
+
+
+class TelegramOutbox(db.Model):
+    """Push-уведомление в Telegram; отправляет бот (telegram_bot/push.py) с учётом лимитов Bot API"""
+    __tablename__ = 'telegram_outbox'
+    __table_args__ = (
+        db.Index('ix_telegram_outbox_due', 'status', 'next_attempt_at'),
+        db.Index('ix_telegram_outbox_chat', 'chat_id', 'status', 'id'),
+        db.Index('ix_telegram_outbox_claim', 'claim_token'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.BigInteger, nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    # pending -> sent или failed (попытки исчерпаны или бот заблокирован)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32))
+    claimed_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<TelegramOutbox {self.id} {self.status}>'
+
+
+class BookingQueue(TimeRangeMixin, db.Model):
     __tablename__ = 'booking_queue'
+    __table_args__ = (
+        db.Index('ix_booking_queue_waiting', 'classroom_id', 'booking_date', 'status', 'order_key'),
+        db.Index('ix_booking_queue_hold', 'status', 'hold_expires_at'),
+        db.Index('ix_booking_queue_user_date', 'user_id', 'booking_date', 'start_time', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -119,10 +300,13 @@ class BookingQueue(db.Model):
     booking_date = db.Column(db.Date, nullable=False)
     start_time = db.Column(db.Time, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
-    queue_position = db.Column(db.Integer, nullable=False)
+    # Ключ сортировки очереди (см. app/waitlist.py); позиция считается при чтении
+    order_key = db.Column(db.BigInteger, nullable=False)
+    # waiting -> notified (слот удержан до hold_expires_at) -> booked или expired
     status = db.Column(db.String(20), default='waiting')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     notified = db.Column(db.Boolean, default=False)
+    hold_expires_at = db.Column(db.DateTime)
 
     user = db.relationship('User', backref='queue_entries')
     classroom = db.relationship('Classroom', backref='queue_entries')
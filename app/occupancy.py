@@ -0,0 +1,220 @@
+"""
+Битовые маски занятости аудиторий.
+
+Рабочий день 08:00-22:00 разбит на 56 слотов по 15 минут. Для каждой аудитории
+на каждую дату в таблице room_occupancy хранятся две маски:
+busy_mask - слоты, занятые любым действующим бронированием (в т.ч. ожидающим
+подтверждения), и approved_mask - только одобренными. Поиск свободных аудиторий
+сводится к побитовому AND по этим числам.
+
+Маски пересчитываются из таблицы booking в той же транзакции, что и изменение
+бронирования, а также могут быть полностью перестроены командой
+`flask occupancy rebuild`.
+"""
+import math
+from datetime import time, timedelta
+
+import numpy as np
+from sqlalchemy import insert, tuple_
+
+from app import db
+from app.models import Booking, RoomOccupancy, upsert
+
+SLOT_MINUTES = 15
+DAY_START = time(8, 0)
+DAY_END = time(22, 0)
+SLOTS_PER_DAY = 56
+
+# Завершённые бронирования тоже остаются в масках, чтобы автозавершение
+# не меняло историю занятости
+BUSY_STATUSES = ('pending', 'approved', 'completed')
+APPROVED_STATUSES = ('approved', 'completed')
+
+
+def _minutes(t):
+    return t.hour * 60 + t.minute - (DAY_START.hour * 60 + DAY_START.minute)
+
+
+def slot_mask(start, end):
+    """Маска слотов, пересекающихся с интервалом [start, end)"""
+    end_minutes = _minutes(end) + (1 if end.second or end.microsecond else 0)
+    first = max(0, _minutes(start) // SLOT_MINUTES)
+    last = min(SLOTS_PER_DAY, math.ceil(end_minutes / SLOT_MINUTES))
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def slot_at(moment):
+    """Маска слота, в который попадает момент времени (0 вне рабочего дня)"""
+    minutes = _minutes(moment)
+    if minutes < 0 or minutes >= SLOTS_PER_DAY * SLOT_MINUTES:
+        return 0
+    return 1 << (minutes // SLOT_MINUTES)
+
+
+def _masks(rows):
+    """Собирает маски по (дата, аудитория) из строк (classroom_id, booking_date, start, end, status)"""
+    masks = {}
+    for classroom_id, booking_date, start, end, status in rows:
+        mask = slot_mask(start, end)
+        entry = masks.setdefault((booking_date, classroom_id), [0, 0])
+        entry[0] |= mask
+        if status in APPROVED_STATUSES:
+            entry[1] |= mask
+    return masks
+
+
+def refresh(classroom_id, day):
+    """Пересчитывает маски одной аудитории на одну дату (без коммита)"""
+    rows = db.session.query(
+        Booking.classroom_id, Booking.booking_date, Booking.start_time, Booking.end_time, Booking.status
+    ).filter(
+        Booking.classroom_id == classroom_id,
+        Booking.booking_date == day,
+        Booking.status.in_(BUSY_STATUSES)
+    ).all()
+    busy_mask, approved_mask = _masks(rows).get((day, classroom_id), (0, 0))
+
+    db.session.merge(RoomOccupancy(
+        day=day,
+        classroom_id=classroom_id,
+        busy_mask=busy_mask,
+        approved_mask=approved_mask
+    ))
+
+
+def mark(booking):
+    """
+    Добавляет слоты нового бронирования в маски одним INSERT ... ON CONFLICT
+    DO UPDATE с побитовым OR (без коммита). Для удаления и смены статуса
+    нужен refresh - снять биты без пересчёта нельзя
+    """
+    if booking.status not in BUSY_STATUSES:
+        return
+    statement = upsert(RoomOccupancy)
+    if statement is None:
+        refresh(booking.classroom_id, booking.booking_date)
+        return
+
+    mask = slot_mask(booking.start_time, booking.end_time)
+    approved = mask if booking.status in APPROVED_STATUSES else 0
+    statement = statement.values(
+        day=booking.booking_date, classroom_id=booking.classroom_id, busy_mask=mask, approved_mask=approved
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['day', 'classroom_id'],
+        set_={
+            'busy_mask': RoomOccupancy.busy_mask.op('|')(statement.excluded.busy_mask),
+            'approved_mask': RoomOccupancy.approved_mask.op('|')(statement.excluded.approved_mask),
+        }
+    ))
+
+
+def refresh_for(bookings):
+    """Пересчитывает маски всех (аудитория, дата), затронутых бронированиями"""
+    for classroom_id, day in {(b.classroom_id, b.booking_date) for b in bookings}:
+        refresh(classroom_id, day)
+
+
+def refresh_many(keys):
+    """Пересчитывает маски набора (аудитория, дата) за фиксированное число запросов (без коммита)"""
+    keys = set(keys)
+    if not keys:
+        return
+    rows = db.session.query(
+        Booking.classroom_id, Booking.booking_date, Booking.start_time, Booking.end_time, Booking.status
+    ).filter(
+        tuple_(Booking.classroom_id, Booking.booking_date).in_(keys),
+        Booking.status.in_(BUSY_STATUSES)
+    )
+    masks = _masks(rows)
+
+    RoomOccupancy.query.filter(
+        tuple_(RoomOccupancy.classroom_id, RoomOccupancy.day).in_(keys)
+    ).delete(synchronize_session=False)
+    db.session.execute(insert(RoomOccupancy), [
+        {'day': day, 'classroom_id': classroom_id,
+         'busy_mask': masks.get((day, classroom_id), (0, 0))[0],
+         'approved_mask': masks.get((day, classroom_id), (0, 0))[1]}
+        for classroom_id, day in keys
+    ])
+
+
+def rebuild(date_from=None, date_to=None):
+    """Полностью перестраивает маски по таблице booking. Возвращает число строк"""
+    stale = RoomOccupancy.query
+    rows = db.session.query(
+        Booking.classroom_id, Booking.booking_date, Booking.start_time, Booking.end_time, Booking.status
+    ).filter(Booking.status.in_(BUSY_STATUSES))
+
+    if date_from is not None:
+        stale = stale.filter(RoomOccupancy.day >= date_from)
+        rows = rows.filter(Booking.booking_date >= date_from)
+    if date_to is not None:
+        stale = stale.filter(RoomOccupancy.day <= date_to)
+        rows = rows.filter(Booking.booking_date <= date_to)
+
+    stale.delete(synchronize_session=False)
+    masks = _masks(rows)
+    if masks:
+        db.session.execute(insert(RoomOccupancy), [
+            {'day': day, 'classroom_id': classroom_id, 'busy_mask': busy, 'approved_mask': approved}
+            for (day, classroom_id), (busy, approved) in masks.items()
+        ])
+    return len(masks)
+
+
+def occupancy_matrix(classroom_ids, date_from, days):
+    """
+    Матрица занятости rooms x days x slots (bool) для аудиторий classroom_ids,
+    упорядоченных по id, начиная с даты date_from. Все бронирования периода
+    загружаются одним запросом, слоты размечаются векторно через разностный массив.
+    """
+    room_ids = np.asarray(sorted(classroom_ids), dtype=np.int64)
+    diff = np.zeros((len(room_ids), days, SLOTS_PER_DAY + 1), dtype=np.int32)
+
+    rows = db.session.query(
+        Booking.classroom_id, Booking.booking_date, Booking.start_time, Booking.end_time
+    ).filter(
+        Booking.booking_date >= date_from,
+        Booking.booking_date < date_from + timedelta(days=days),
+        Booking.classroom_id.in_(room_ids.tolist()),
+        Booking.status.in_(BUSY_STATUSES)
+    ).all()
+
+    if rows:
+        classroom, day, start, end = (np.asarray(column) for column in zip(*rows))
+        offset = _minutes(time(0, 0))
+        start_minutes = np.array([t.hour * 60 + t.minute for t in start]) + offset
+        end_minutes = np.array([t.hour * 60 + t.minute + bool(t.second or t.microsecond) for t in end]) + offset
+
+        first = np.clip(start_minutes // SLOT_MINUTES, 0, SLOTS_PER_DAY)
+        last = np.clip(-(-end_minutes // SLOT_MINUTES), 0, SLOTS_PER_DAY)
+        room_idx = np.searchsorted(room_ids, classroom.astype(np.int64))
+        day_idx = np.array([d.toordinal() for d in day]) - date_from.toordinal()
+
+        keep = last > first
+        np.add.at(diff, (room_idx[keep], day_idx[keep], first[keep]), 1)
+        np.add.at(diff, (room_idx[keep], day_idx[keep], last[keep]), -1)
+
+    return np.cumsum(diff[:, :, :SLOTS_PER_DAY], axis=2) > 0
+
+
+def to_bitmasks(matrix):
+    """rooms x days x slots -> rooms x days масок (uint64, бит i - слот i)"""
+    weights = np.left_shift(np.uint64(1), np.arange(SLOTS_PER_DAY, dtype=np.uint64))
+    return (matrix.astype(np.uint64) * weights).sum(axis=2, dtype=np.uint64)
+
+
+def to_runs(matrix):
+    """rooms x days x slots -> для каждой аудитории и даты список [первый слот, длина]"""
+    padded = np.zeros(matrix.shape[:2] + (SLOTS_PER_DAY + 2,), dtype=np.int8)
+    padded[:, :, 1:-1] = matrix
+    edges = np.diff(padded, axis=2)
+
+    runs = [[[] for _ in range(matrix.shape[1])] for _ in range(matrix.shape[0])]
+    # argwhere обходит массив по порядку, поэтому начала и концы отрезков идут парами
+    for (room, day, first), (_, _, last) in zip(np.argwhere(edges == 1), np.argwhere(edges == -1)):
+        runs[room][day].append([int(first), int(last - first)])
+    return runs
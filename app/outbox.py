@@ -0,0 +1,187 @@
+"""
+Транзакционная очередь исходящих писем (таблица email_outbox).
+
+send_email только добавляет строку в текущую сессию: письмо фиксируется тем
+же коммитом, что и изменение, о котором оно сообщает, и не теряется, если
+процесс упадёт до отправки. Обработчики запросов SMTP не касаются.
+
+Письма отправляет задача drain_email_outbox (app/jobs.py): она захватывает
+пачку готовых к отправке строк одним UPDATE, отправляет их пулом
+app/mailer.py и отмечает результат. Захват:
+- Postgres: подзапрос SELECT ... FOR UPDATE SKIP LOCKED - несколько
+  разборщиков не ждут друг друга и не берут одни и те же строки;
+- SQLite: сам UPDATE сериализован блокировкой базы.
+Захваченные строки помечаются claim_token и claimed_until: если разборщик
+умер, через CLAIM_SECONDS строки снова становятся доступны.
+Неудачная отправка повторяется с экспоненциальной задержкой
+(BACKOFF_SECONDS * 2^попытка, не больше MAX_BACKOFF_SECONDS); после
+MAX_ATTEMPTS попыток письмо получает status='failed'.
+
+Сводки: уведомление по шаблону (add_notification) откладывается на
+EMAIL_DIGEST_WINDOW секунд, а следующие уведомления тому же адресату в это
+окно получают тот же срок отправки. Разборщик объединяет их в одно письмо
+по шаблону email/digest, так что массовая отмена или отклонение бронирований
+даёт одно письмо на пользователя, а не по письму на бронирование. Шаблоны
+компилируются Jinja один раз и кэшируются окружением Flask.
+"""
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app, render_template
+from flask_mail import Message
+from sqlalchemy import or_, select, update
+
+from app import db
+from app.mailer import OPEN, dispatcher
+from app.models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+# Сколько писем захватывается и отправляется за раз
+BATCH_SIZE = 100
+
+# На сколько секунд разборщик захватывает пачку
+CLAIM_SECONDS = 300
+
+MAX_ATTEMPTS = 8
+BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 6 * 3600
+
+
+def add(recipients, subject, text_body, html_body=None):
+    """Добавляет письмо в текущую транзакцию (без коммита)"""
+    entry = EmailOutbox(
+        recipients=','.join(recipients),
+        subject=subject,
+        text_body=text_body,
+        html_body=html_body,
+        next_attempt_at=datetime.utcnow()
+    )
+    db.session.add(entry)
+    return entry
+
+
+def add_notification(recipient, subject, template, context):
+    """
+    Добавляет уведомление по шаблону в текущую транзакцию. Срок отправки -
+    открытое окно сводки этого адресата или новое окно EMAIL_DIGEST_WINDOW
+    """
+    now = datetime.utcnow()
+    send_at = db.session.query(EmailOutbox.next_attempt_at).filter(
+        EmailOutbox.status == 'pending',
+        EmailOutbox.next_attempt_at > now,
+        EmailOutbox.recipients == recipient,
+        EmailOutbox.template.isnot(None),
+        EmailOutbox.attempts == 0,
+        EmailOutbox.claim_token.is_(None)
+    ).order_by(EmailOutbox.next_attempt_at).limit(1).scalar()
+    entry = EmailOutbox(
+        recipients=recipient,
+        subject=subject,
+        template=template,
+        context=json.dumps(context, ensure_ascii=False),
+        next_attempt_at=send_at or now + timedelta(seconds=current_app.config.get('EMAIL_DIGEST_WINDOW', 60))
+    )
+    db.session.add(entry)
+    return entry
+
+
+def backoff(attempts):
+    """Задержка перед следующей попыткой после attempts неудачных"""
+    return timedelta(seconds=min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS))
+
+
+def claim(batch_size=BATCH_SIZE, now=None):
+    """Захватывает до batch_size готовых писем и фиксирует захват. Возвращает строки"""
+    now = now if now is not None else datetime.utcnow()
+    token = uuid.uuid4().hex
+    due = select(EmailOutbox.id).where(
+        EmailOutbox.status == 'pending',
+        EmailOutbox.next_attempt_at <= now,
+        or_(EmailOutbox.claimed_until.is_(None), EmailOutbox.claimed_until < now)
+    ).order_by(EmailOutbox.next_attempt_at, EmailOutbox.recipients, EmailOutbox.id).limit(batch_size)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        due = due.with_for_update(skip_locked=True)
+
+    db.session.execute(
+        update(EmailOutbox).where(EmailOutbox.id.in_(due)).values(
+            claim_token=token, claimed_until=now + timedelta(seconds=CLAIM_SECONDS)
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return EmailOutbox.query.filter_by(claim_token=token).order_by(EmailOutbox.id).all()
+
+
+def _group(batch):
+    """Группы строк, уходящих одним письмом: уведомления одному адресату вместе, остальные по одной"""
+    groups = {}
+    for entry in batch:
+        key = entry.recipients if entry.template else entry.id
+        groups.setdefault(key, []).append(entry)
+    return list(groups.values())
+
+
+def _message(entries):
+    """Письмо для группы: готовое письмо, уведомление по его шаблону или сводка"""
+    first = entries[0]
+    if first.template is None:
+        subject, text_body, html_body = first.subject, first.text_body, first.html_body
+    else:
+        if len(entries) == 1:
+            template, subject, context = first.template, first.subject, json.loads(first.context)
+        else:
+            items = [dict(json.loads(entry.context), template=entry.template) for entry in entries]
+            template, subject = 'digest', f'Уведомления о бронированиях: {len(items)}'
+            context = {'username': items[0].get('username'), 'items': items}
+        text_body = render_template(f'email/{template}.txt', **context)
+        html_body = render_template(f'email/{template}.html', **context)
+    return Message(subject=subject, recipients=first.recipients.split(','), body=text_body, html=html_body)
+
+
+def drain(batch_size=BATCH_SIZE, now=None):
+    """Отправляет все готовые письма пачками. Возвращает число отправленных строк"""
+    sent = 0
+    while True:
+        # Пока цепь разомкнута, письма ждут в таблице, не тратя попытки
+        if dispatcher.breaker.state == OPEN:
+            return sent
+        batch = claim(batch_size, now)
+        if not batch:
+            return sent
+        groups = _group(batch)
+        errors = [None] * len(groups)
+        messages = []
+        for i, group in enumerate(groups):
+            # Битое уведомление (контекст, шаблон) получает ошибку и расходует попытки,
+            # а не обрывает разбор: иначе пачка захватывалась бы заново и падала без конца
+            try:
+                messages.append((i, _message(group)))
+            except Exception as e:
+                logger.exception('Не удалось собрать письмо из строк %s', [entry.id for entry in group])
+                errors[i] = f'Ошибка сборки письма: {e!r}'
+        for (i, _), error in zip(messages, dispatcher.send_many([message for _, message in messages],
+                                                                 timeout=CLAIM_SECONDS / 2)):
+            errors[i] = error
+
+        finished = now if now is not None else datetime.utcnow()
+        for entry, error in ((entry, error) for group, error in zip(groups, errors) for entry in group):
+            entry.claim_token = None
+            entry.claimed_until = None
+            if error is None:
+                entry.status = 'sent'
+                entry.sent_at = finished
+                sent += 1
+                continue
+            entry.attempts += 1
+            entry.last_error = error
+            if entry.attempts >= MAX_ATTEMPTS:
+                entry.status = 'failed'
+                logger.error('Письмо %s не отправлено после %s попыток: %s', entry.id, entry.attempts, error)
+            else:
+                entry.next_attempt_at = finished + backoff(entry.attempts)
+        db.session.commit()
+
+        if len(batch) < batch_size:
+            return sent
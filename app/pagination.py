@@ -0,0 +1,59 @@
+"""
+Постраничная выдача бронирований и очереди пользователя по ключу (keyset).
+
+Строки упорядочены по убыванию (booking_date, start_time, id). Следующая
+страница - строки строго меньше последней строки предыдущей: условие
+(booking_date, start_time, id) < (...) идёт поиском по индексам
+ix_booking_user_date и ix_booking_queue_user_date, без OFFSET, так что
+стоимость страницы не зависит от того, насколько далеко пролистан список,
+а вставки между запросами не дают пропусков и повторов.
+
+Курсор - непрозрачная строка (base64 от JSON с ключом последней строки).
+"""
+import base64
+import binascii
+import json
+from datetime import date, time
+
+from sqlalchemy import literal, tuple_
+
+# Строк на странице по умолчанию и не больше MAX_PAGE_SIZE по запросу
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(row):
+    """Курсор, указывающий на строку row (следующая страница начнётся после неё)"""
+    key = [row.booking_date.isoformat(), row.start_time.isoformat(), row.id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(booking_date, start_time, id) из курсора. ValueError, если курсор испорчен"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        day, start, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return date.fromisoformat(day), time.fromisoformat(start), int(row_id)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError(f'Некорректный курсор: {cursor}') from e
+
+
+def page_query(query, model, cursor=None, limit=PAGE_SIZE):
+    """query, ограниченный строками после cursor, упорядоченный и с LIMIT limit + 1"""
+    keys = (model.booking_date, model.start_time, model.id)
+    if cursor:
+        values = decode_cursor(cursor)
+        query = query.filter(tuple_(*keys) < tuple_(*(literal(v, k.type) for k, v in zip(keys, values))))
+    # Лишняя строка показывает, есть ли следующая страница
+    return query.order_by(*(key.desc() for key in keys)).limit(limit + 1)
+
+
+def page(query, model, cursor=None, limit=PAGE_SIZE):
+    """
+    Страница query (бронирования или очередь) после cursor.
+    Возвращает (строки, курсор следующей страницы или None)
+    """
+    rows = page_query(query, model, cursor, limit).all()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
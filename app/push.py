@@ -0,0 +1,132 @@
+"""
+Очередь push-уведомлений в Telegram (таблица telegram_outbox).
+
+Как и письма (app/outbox.py), уведомление добавляется в текущую транзакцию
+и фиксируется вместе с изменением. Отправляет их бот: telegram_bot/push.py
+захватывает пачки через claim, отправляет с учётом лимитов Bot API и
+записывает результат через record.
+
+Порядок в пределах чата сохраняется: строка доступна для захвата, только
+если все более ранние ожидающие строки того же чата тоже доступны сейчас.
+Поэтому сообщение, ждущее повтора после ошибки, задерживает следующие
+сообщения своего чата, но не чужих. Гарантия рассчитана на одного
+отправителя (процесс бота); второй отправитель на Postgres может захватить
+следующее сообщение чата, пока первый ещё не зафиксировал захват предыдущего.
+"""
+import secrets
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, exists, not_, or_, select, update
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.models import TelegramOutbox, User
+from app.outbox import CLAIM_SECONDS, MAX_ATTEMPTS, backoff
+
+BATCH_SIZE = 500
+
+Push = namedtuple('Push', ['id', 'chat_id', 'text'])
+
+# Результаты отправки для record
+SENT = 'sent'
+RETRY = 'retry'          # временная ошибка - повтор с задержкой
+FAILED = 'failed'        # повторять бессмысленно (бот заблокирован, чат не найден)
+RELEASED = 'released'    # не отправлялось (раньше в чате ошибка) - вернуть в очередь
+
+
+def add(user, text):
+    """Добавляет уведомление пользователю в текущую транзакцию, если у него привязан Telegram"""
+    if user.telegram_chat_id is None:
+        return None
+    entry = TelegramOutbox(chat_id=user.telegram_chat_id, text=text, next_attempt_at=datetime.utcnow())
+    db.session.add(entry)
+    return entry
+
+
+def link_code(user):
+    """Новый одноразовый код для команды бота /link (без коммита)"""
+    user.telegram_link_code = secrets.token_hex(4)
+    return user.telegram_link_code
+
+
+def link(code, chat_id):
+    """Привязывает чат к пользователю с кодом code и коммитит. Возвращает пользователя или None"""
+    user = User.query.filter_by(telegram_link_code=code).first() if code else None
+    if user is None:
+        return None
+    # Чат может быть привязан только к одному пользователю
+    User.query.filter(User.telegram_chat_id == chat_id, User.id != user.id).update(
+        {User.telegram_chat_id: None}, synchronize_session=False
+    )
+    user.telegram_chat_id = chat_id
+    user.telegram_link_code = None
+    db.session.commit()
+    return user
+
+
+def _available(entry, now):
+    return and_(
+        entry.status == 'pending',
+        entry.next_attempt_at <= now,
+        or_(entry.claimed_until.is_(None), entry.claimed_until < now)
+    )
+
+
+def claim(batch_size=BATCH_SIZE, now=None):
+    """
+    Захватывает до batch_size готовых уведомлений (старые первыми) и фиксирует
+    захват. Возвращает список Push в порядке id
+    """
+    now = now if now is not None else datetime.utcnow()
+    token = uuid.uuid4().hex
+    earlier = aliased(TelegramOutbox)
+    blocked = exists().where(
+        earlier.chat_id == TelegramOutbox.chat_id,
+        earlier.status == 'pending',
+        earlier.id < TelegramOutbox.id,
+        not_(_available(earlier, now))
+    )
+    due = select(TelegramOutbox.id).where(
+        _available(TelegramOutbox, now), ~blocked
+    ).order_by(TelegramOutbox.id).limit(batch_size)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        due = due.with_for_update(skip_locked=True)
+
+    db.session.execute(
+        update(TelegramOutbox).where(TelegramOutbox.id.in_(due)).values(
+            claim_token=token, claimed_until=now + timedelta(seconds=CLAIM_SECONDS)
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    rows = db.session.query(TelegramOutbox.id, TelegramOutbox.chat_id, TelegramOutbox.text).filter(
+        TelegramOutbox.claim_token == token
+    ).order_by(TelegramOutbox.id).all()
+    return [Push(*row) for row in rows]
+
+
+def record(results, now=None):
+    """Записывает результаты отправки: {id: (результат, текст ошибки или None)}. Коммитит"""
+    now = now if now is not None else datetime.utcnow()
+    if not results:
+        return
+    for entry in TelegramOutbox.query.filter(TelegramOutbox.id.in_(list(results))):
+        outcome, error = results[entry.id]
+        entry.claim_token = None
+        entry.claimed_until = None
+        if outcome == SENT:
+            entry.status = 'sent'
+            entry.sent_at = now
+        elif outcome == RETRY:
+            entry.attempts += 1
+            entry.last_error = error
+            if entry.attempts >= MAX_ATTEMPTS:
+                entry.status = 'failed'
+            else:
+                entry.next_attempt_at = now + backoff(entry.attempts)
+        elif outcome == FAILED:
+            entry.attempts += 1
+            entry.last_error = error
+            entry.status = 'failed'
+    db.session.commit()
@@ -0,0 +1,258 @@
+"""
+Развёртывание регулярных бронирований (RecurringBooking) в отдельные Booking.
+
+Серии развёртываются не целиком, а до горизонта RECURRING_HORIZON_DAYS дней
+вперёд; дальше их продлевает фоновая задача extend_recurring_series.
+RecurringBooking.materialized_until - отметка, до которой вхождения уже
+созданы, поэтому каждый запуск генерирует только новый хвост.
+
+Для пачки серий все даты вхождений вычисляются в памяти, занятость всех
+затронутых (аудитория, дата) загружается одним запросом к booking (и одним -
+к действующим удержаниям очереди), конфликты проверяются в памяти (в т.ч.
+между сериями одной пачки), а свободные вхождения вставляются одним bulk
+INSERT. Число запросов не зависит ни от длины серии, ни от числа серий в
+пачке.
+
+Вставка идёт под теми же блокировками, что и admission.admit: до чтения
+занятости берутся блокировки admission на все затронутые (аудитория, дата) в
+постоянном порядке - одним запросом (admission.lock_all), поэтому одновременная
+заявка не может занять слот между проверкой и вставкой.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import insert, tuple_, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db, admission, occupancy, rollup, waitlist
+from app.availability import availability, RoomDay, Slot, ACTIVE_STATUSES
+from app.models import Booking, RecurringBooking
+
+DAY_NAMES = ('Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье')
+
+# Сколько диапазонов (аудитория, период) держит кэш предпросмотра
+PREVIEW_CACHE_SIZE = 256
+
+STEP_DAYS = {
+    'weekly': 7,
+    'biweekly': 14,
+}
+
+# conflict - Slot пересекающегося бронирования (booking_id=None, если
+# пересечение с вхождением другой серии из той же пачки или с чужим
+# удержанием слота из очереди) или None
+Occurrence = namedtuple('Occurrence', ['series', 'day', 'conflict'])
+
+
+def horizon(today=None):
+    """Дата, до которой развёртываются регулярные бронирования"""
+    today = today if today is not None else date.today()
+    return today + timedelta(days=current_app.config.get('RECURRING_HORIZON_DAYS', 30))
+
+
+def first_occurrence(series):
+    """Первая дата серии: ближайший к start_date нужный день недели"""
+    return series.start_date + timedelta(days=(int(series.day_of_week) - series.start_date.weekday()) % 7)
+
+
+def occurrence_dates(series, date_from=None, date_to=None):
+    """Даты вхождений серии, попадающие в [date_from, date_to] и в период серии"""
+    step = STEP_DAYS.get(series.recurrence_type, 7)
+    day = first_occurrence(series)
+    last = series.end_date if date_to is None else min(series.end_date, date_to)
+    if date_from is not None and date_from > day:
+        # Сдвигаемся на целое число шагов, чтобы не нарушить чередование недель
+        day += timedelta(days=-(-(date_from - day).days // step) * step)
+
+    dates = []
+    while day <= last:
+        dates.append(day)
+        day += timedelta(days=step)
+    return dates
+
+
+def _booked_slots(keys):
+    """Активные бронирования по набору (аудитория, дата) одним запросом"""
+    slots = defaultdict(list)
+    if not keys:
+        return slots
+    rows = db.session.query(
+        Booking.classroom_id, Booking.booking_date, Booking.start_time, Booking.end_time, Booking.id
+    ).filter(
+        tuple_(Booking.classroom_id, Booking.booking_date).in_(keys),
+        Booking.status.in_(ACTIVE_STATUSES)
+    )
+    for classroom_id, day, start, end, booking_id in rows:
+        slots[(classroom_id, day)].append(Slot(start, end, booking_id))
+    return slots
+
+
+def pending_window(series, date_from=None):
+    """Начало ещё не развёрнутой части серии (после materialized_until)"""
+    if series.materialized_until is None:
+        return date_from
+    tail = series.materialized_until + timedelta(days=1)
+    return tail if date_from is None else max(tail, date_from)
+
+
+def _pending_dates(series_list, date_from, date_to):
+    return {
+        series: occurrence_dates(series, pending_window(series, date_from), date_to)
+        for series in series_list
+    }
+
+
+def _keys(dates):
+    return {(series.classroom_id, day) for series, days in dates.items() for day in days}
+
+
+def _held_conflict(holds, series):
+    """Чужое удержание, пересекающее время серии, как Slot или None"""
+    for start, end, user_id in holds:
+        if user_id != series.user_id and start < series.end_time and end > series.start_time:
+            return Slot(start, end, None)
+    return None
+
+
+def _plan(dates, now):
+    keys = _keys(dates)
+    booked = _booked_slots(keys)
+    holds = waitlist.live_holds(keys, now)
+    room_days = {key: RoomDay(slots) for key, slots in booked.items()}
+
+    occurrences = []
+    for series, days in dates.items():
+        for day in days:
+            key = (series.classroom_id, day)
+            room_day = room_days.setdefault(key, RoomDay())
+            conflict = room_day.find_overlap(series.start_time, series.end_time)
+            if conflict is None:
+                conflict = _held_conflict(holds.get(key, ()), series)
+            if conflict is None:
+                # Занимаем слот, чтобы следующие серии пачки его увидели
+                room_day.add(Slot(series.start_time, series.end_time, None))
+            occurrences.append(Occurrence(series, day, conflict))
+    return occurrences
+
+
+def plan(series_list, date_from=None, date_to=None, now=None):
+    """Вхождения серий с отметкой о конфликте, без записи в БД"""
+    now = now if now is not None else datetime.now()
+    return _plan(_pending_dates(series_list, date_from, date_to), now)
+
+
+def default_status(series):
+    return 'approved' if series.user.role == 'teacher' else 'pending'
+
+
+def materialize(series_list, date_from=None, date_to=None, status_for=default_status, now=None):
+    """
+    Создаёт бронирования для свободных вхождений серий из [date_from, date_to],
+    ещё не созданных ранее, и сдвигает materialized_until (без коммита).
+    Вызывать под admission.writer(), блокировки держатся до коммита.
+    Возвращает список Occurrence - отчёт по каждой дате
+    """
+    now = now if now is not None else datetime.now()
+    dates = _pending_dates(series_list, date_from, date_to)
+    # Те же блокировки, что у admit, в постоянном порядке; занятость читается уже под ними
+    admission.lock_all(_keys(dates))
+    occurrences = _plan(dates, now)
+    _advance_watermarks(series_list, date_to)
+    free = [occurrence for occurrence in occurrences if occurrence.conflict is None]
+    if not free:
+        return occurrences
+
+    statuses = {series: status_for(series) for series in series_list}
+    rows = [{
+        'user_id': occurrence.series.user_id,
+        'classroom_id': occurrence.series.classroom_id,
+        'booking_date': occurrence.day,
+        'start_time': occurrence.series.start_time,
+        'end_time': occurrence.series.end_time,
+        'purpose': occurrence.series.purpose,
+        'status': statuses[occurrence.series],
+        'recurring_booking_id': occurrence.series.id,
+    } for occurrence in free]
+    db.session.execute(insert(Booking), rows)
+
+    deltas = defaultdict(dict)
+    for occurrence in free:
+        series = occurrence.series
+        entry = deltas[(series.classroom_id, occurrence.day)]
+        for column, value in rollup.transition_deltas(None, statuses[series], minutes=series.duration_minutes).items():
+            entry[column] = entry.get(column, 0) + value
+    rollup.apply_many(deltas)
+    occupancy.refresh_many(deltas.keys())
+    return occurrences
+
+
+def _advance_watermarks(series_list, date_to):
+    """Одним executemany запоминает, до какой даты развёрнута каждая серия"""
+    rows = []
+    for series in series_list:
+        until = series.end_date if date_to is None else min(series.end_date, date_to)
+        if series.materialized_until is None or until > series.materialized_until:
+            rows.append({'id': series.id, 'materialized_until': until})
+            set_committed_value(series, 'materialized_until', until)
+    if rows:
+        db.session.execute(update(RecurringBooking), rows)
+
+
+def created_keys(occurrences):
+    """(аудитория, дата) созданных вхождений. Вызывать до коммита, пока серии не истекли"""
+    return {(occurrence.series.classroom_id, occurrence.day) for occurrence in occurrences if occurrence.conflict is None}
+
+
+def invalidate(keys):
+    """Сбрасывает индекс занятости для созданных вхождений (после коммита)"""
+    for classroom_id, day in keys:
+        availability.invalidate(classroom_id, day)
+
+
+_preview_cache = OrderedDict()
+_preview_lock = threading.Lock()
+
+
+def _room_days(classroom_id, date_from, date_to):
+    """
+    Занятость аудитории по датам периода: один запрос к booking, результат
+    кэшируется по (аудитория, период, версия бронирований аудитории) на
+    AVAILABILITY_INDEX_TTL секунд
+    """
+    key = (classroom_id, date_from, date_to, availability.version(classroom_id))
+    now = time.monotonic()
+    with _preview_lock:
+        entry = _preview_cache.get(key)
+        if entry is not None and entry[0] > now:
+            _preview_cache.move_to_end(key)
+            return entry[1]
+
+    slots = defaultdict(list)
+    rows = db.session.query(Booking.booking_date, Booking.start_time, Booking.end_time, Booking.id).filter(
+        Booking.classroom_id == classroom_id,
+        Booking.booking_date >= date_from,
+        Booking.booking_date <= date_to,
+        Booking.status.in_(ACTIVE_STATUSES)
+    )
+    for day, start, end, booking_id in rows:
+        slots[day].append(Slot(start, end, booking_id))
+    room_days = {day: RoomDay(day_slots) for day, day_slots in slots.items()}
+
+    with _preview_lock:
+        _preview_cache[key] = (now + availability.ttl, room_days)
+        while len(_preview_cache) > PREVIEW_CACHE_SIZE:
+            _preview_cache.popitem(last=False)
+    return room_days
+
+
+def preview(series):
+    """Все вхождения несохранённой серии с отметкой о конфликте (только чтение)"""
+    room_days = _room_days(series.classroom_id, series.start_date, series.end_date)
+    empty = RoomDay()
+    return [
+        Occurrence(series, day, room_days.get(day, empty).find_overlap(series.start_time, series.end_time))
+        for day in occurrence_dates(series)
+    ]
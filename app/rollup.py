@@ -0,0 +1,170 @@
+"""
+Дневная сводка бронирований (таблица booking_daily_rollup).
+
+Для каждой аудитории на каждую дату хранятся счётчики по статусам, а также
+число и суммарная длительность бронирований, занимающих аудиторию
+(pending/approved/completed). Сводка обновляется приращениями при каждом
+переходе статуса бронирования, в той же транзакции, поэтому статистика для
+админки читается из небольшой таблицы, а не из всей истории booking.
+Полный пересчёт - `flask rollup rebuild`.
+"""
+from datetime import timedelta
+
+from sqlalchemy import func, insert
+
+from app import db
+from app.models import Booking, BookingDailyRollup, upsert
+
+# Статусы, при которых бронирование учитывается в booking_count и booked_minutes
+COUNTED_STATUSES = ('pending', 'approved', 'completed')
+
+STATUS_COLUMNS = {
+    'pending': 'pending_count',
+    'approved': 'approved_count',
+    'rejected': 'rejected_count',
+    'completed': 'completed_count',
+}
+
+COUNTER_COLUMNS = ('booking_count', 'booked_minutes', *STATUS_COLUMNS.values())
+
+
+def _deltas(status, sign, count=1, minutes=0):
+    deltas = {}
+    if status in STATUS_COLUMNS:
+        deltas[STATUS_COLUMNS[status]] = sign * count
+    if status in COUNTED_STATUSES:
+        deltas['booking_count'] = sign * count
+        deltas['booked_minutes'] = sign * minutes
+    return deltas
+
+
+def transition_deltas(old_status, new_status, count=1, minutes=0):
+    """Приращения счётчиков при переходе old_status -> new_status (None - нет записи)"""
+    deltas = _deltas(old_status, -1, count, minutes)
+    for column, value in _deltas(new_status, 1, count, minutes).items():
+        deltas[column] = deltas.get(column, 0) + value
+    return {column: value for column, value in deltas.items() if value}
+
+
+def apply(classroom_id, day, deltas):
+    """Добавляет приращения к строке сводки (без коммита)"""
+    if not deltas:
+        return
+    updated = BookingDailyRollup.query.filter_by(day=day, classroom_id=classroom_id).update(
+        {getattr(BookingDailyRollup, column): getattr(BookingDailyRollup, column) + value
+         for column, value in deltas.items()},
+        synchronize_session=False
+    )
+    if not updated:
+        db.session.add(BookingDailyRollup(day=day, classroom_id=classroom_id, **{
+            column: deltas.get(column, 0) for column in COUNTER_COLUMNS
+        }))
+
+
+def apply_many(deltas_by_key):
+    """
+    Добавляет приращения {(classroom_id, day): deltas} одним INSERT ... ON CONFLICT
+    DO UPDATE (без коммита). На других СУБД - построчно через apply()
+    """
+    rows = [
+        {'day': day, 'classroom_id': classroom_id, **{column: deltas.get(column, 0) for column in COUNTER_COLUMNS}}
+        for (classroom_id, day), deltas in deltas_by_key.items() if deltas
+    ]
+    if not rows:
+        return
+
+    statement = upsert(BookingDailyRollup)
+    if statement is None:
+        for (classroom_id, day), deltas in deltas_by_key.items():
+            apply(classroom_id, day, deltas)
+        return
+
+    statement = statement.on_conflict_do_update(
+        index_elements=['day', 'classroom_id'],
+        set_={column: getattr(BookingDailyRollup, column) + statement.excluded[column] for column in COUNTER_COLUMNS}
+    )
+    db.session.execute(statement, rows)
+
+
+def record(booking, old_status, new_status):
+    """Учитывает смену статуса одного бронирования (None - создание или удаление)"""
+    apply_many({(booking.classroom_id, booking.booking_date):
+                transition_deltas(old_status, new_status, minutes=booking.duration_minutes)})
+
+
+def rebuild(date_from=None, date_to=None):
+    """Полностью пересчитывает сводку по таблице booking. Возвращает число строк"""
+    stale = BookingDailyRollup.query
+    rows = db.session.query(
+        Booking.booking_date,
+        Booking.classroom_id,
+        Booking.status,
+        func.count(Booking.id),
+        func.coalesce(func.sum(Booking.duration_minutes), 0)
+    ).group_by(Booking.booking_date, Booking.classroom_id, Booking.status)
+
+    if date_from is not None:
+        stale = stale.filter(BookingDailyRollup.day >= date_from)
+        rows = rows.filter(Booking.booking_date >= date_from)
+    if date_to is not None:
+        stale = stale.filter(BookingDailyRollup.day <= date_to)
+        rows = rows.filter(Booking.booking_date <= date_to)
+
+    stale.delete(synchronize_session=False)
+
+    totals = {}
+    for day, classroom_id, status, count, minutes in rows:
+        entry = totals.setdefault((day, classroom_id), {column: 0 for column in COUNTER_COLUMNS})
+        for column, value in _deltas(status, 1, count, minutes).items():
+            entry[column] += value
+
+    if totals:
+        db.session.execute(insert(BookingDailyRollup), [
+            {'day': day, 'classroom_id': classroom_id, **counters}
+            for (day, classroom_id), counters in totals.items()
+        ])
+    return len(totals)
+
+
+def daily_stats(date_from, date_to):
+    """Сводка по дням за период [date_from, date_to] (по всем аудиториям)"""
+    rows = db.session.query(
+        BookingDailyRollup.day,
+        func.sum(BookingDailyRollup.booking_count),
+        func.sum(BookingDailyRollup.booked_minutes),
+        func.sum(BookingDailyRollup.pending_count),
+        func.sum(BookingDailyRollup.approved_count),
+        func.sum(BookingDailyRollup.rejected_count)
+    ).filter(
+        BookingDailyRollup.day >= date_from,
+        BookingDailyRollup.day <= date_to
+    ).group_by(BookingDailyRollup.day).all()
+    by_day = {row[0]: row[1:] for row in rows}
+
+    stats = []
+    day = date_from
+    while day <= date_to:
+        bookings, minutes, pending, approved, rejected = by_day.get(day, (0, 0, 0, 0, 0))
+        stats.append({
+            'date': day.strftime('%d.%m'),
+            'bookings': int(bookings),
+            'booked_minutes': int(minutes),
+            'pending': int(pending),
+            'approved': int(approved),
+            'rejected': int(rejected)
+        })
+        day += timedelta(days=1)
+    return stats
+
+
+def classroom_stats(date_from, date_to, limit=10):
+    """Самые загруженные аудитории за период: [(classroom_id, booking_count, booked_minutes)]"""
+    booking_count = func.sum(BookingDailyRollup.booking_count)
+    return db.session.query(
+        BookingDailyRollup.classroom_id,
+        booking_count,
+        func.sum(BookingDailyRollup.booked_minutes)
+    ).filter(
+        BookingDailyRollup.day >= date_from,
+        BookingDailyRollup.day <= date_to
+    ).group_by(BookingDailyRollup.classroom_id).order_by(booking_count.desc()).limit(limit).all()
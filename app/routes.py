@@ -1,14 +1,13 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import current_user, login_required
-from app import db
-from app.models import Classroom, Booking, User, RecurringBooking, BookingQueue
+from sqlalchemy import and_, func
+from sqlalchemy.orm import joinedload
+from app import db, admission, occupancy, pagination, push, recurrence, rollup, waitlist
+from app.models import Classroom, Booking, User, RecurringBooking, BookingQueue, RoomOccupancy, BookingDailyRollup
 from app.forms import BookingForm, RecurringBookingForm
-from datetime import datetime, date,timedelta
-from app.email import (
-    send_queue_notification_email,
-    send_queue_approved_email,
-    send_booking_cancelled_email
-)
+from app.availability import availability, RoomDay, Slot, ACTIVE_STATUSES
+from datetime import datetime, date, time, timedelta
+from app.email import send_booking_email, send_booking_cancelled_email, send_booking_rejected_email
 
 
 
@@ -16,6 +15,15 @@ from app.email import (
 
 main_bp = Blueprint('main', __name__)
 
+# Максимальное число проверок в одном запросе /api/check_availability/batch
+AVAILABILITY_BATCH_LIMIT = 5000
+# Максимальный период (в днях) для /api/occupancy_matrix
+OCCUPANCY_MATRIX_MAX_DAYS = 62
+# Статистика админки считается за +-30 дней от сегодня (горизонт бронирования)
+ADMIN_STATS_WINDOW_DAYS = 30
+# Максимальная длина серии (в днях) для /api/recurring_preview
+RECURRING_PREVIEW_MAX_DAYS = 731
+
 @main_bp.context_processor
 def inject_now():
     return {'now': datetime.now()}
@@ -44,44 +52,44 @@ def classrooms():
     if floor_filter != 'all':
         query = query.filter_by(floor=int(floor_filter))
     
-    classrooms_list = query.all()
-    
-    # Получаем текущие активные бронирования
     now = datetime.now()
     current_date = now.date()
     current_time = now.time()
     
+    classrooms_list = query.all()
+    
+    # Одним запросом получаем все одобренные бронирования на сегодня
+    # вместе с пользователями и раскладываем их по аудиториям
+    today_bookings = Booking.query.options(joinedload(Booking.user)).filter(
+        Booking.booking_date == current_date,
+        Booking.status == 'approved'
+    ).order_by(Booking.start_time).all()
+    
+    bookings_by_classroom = {}
+    for booking in today_bookings:
+        bookings_by_classroom.setdefault(booking.classroom_id, []).append(booking)
+    
     # Для каждой аудитории проверяем, занята ли она сейчас
     for classroom in classrooms_list:
+        classroom.today_bookings = bookings_by_classroom.get(classroom.id, [])
+        
         # Проверяем, есть ли активное бронирование на эту аудиторию прямо сейчас
-        active_booking = Booking.query.filter(
-            Booking.classroom_id == classroom.id,
-            Booking.booking_date == current_date,
-            Booking.status == 'approved',
-            Booking.start_time <= current_time,
-            Booking.end_time > current_time
-        ).first()
+        active_booking = next(
+            (b for b in classroom.today_bookings if b.start_time <= current_time < b.end_time),
+            None
+        )
         
         classroom.is_occupied_now = active_booking is not None
         if active_booking:
             classroom.occupied_by = active_booking.user.username
             classroom.occupied_until = active_booking.end_time
             classroom.booking_purpose = active_booking.purpose
-        
-        # Также проверяем бронирования на сегодня (для отображения расписания)
-        today_bookings = Booking.query.filter(
-            Booking.classroom_id == classroom.id,
-            Booking.booking_date == current_date,
-            Booking.status == 'approved'
-        ).order_by(Booking.start_time).all()
-        
-        classroom.today_bookings = today_bookings
     
-    # Применяем фильтр по статусу (свободные/занятые)
-    if status_filter == 'free':
-        classrooms_list = [c for c in classrooms_list if not c.is_occupied_now]
-    elif status_filter == 'occupied':
-        classrooms_list = [c for c in classrooms_list if c.is_occupied_now]
+    # Фильтр по статусу (свободные/занятые) - по тому же точному времени, что и отметка
+    # "Занята", а не по 15-минутному слоту, чтобы список не расходился с карточками
+    if status_filter in ('free', 'occupied'):
+        occupied = status_filter == 'occupied'
+        classrooms_list = [c for c in classrooms_list if c.is_occupied_now == occupied]
     
     # Рассчитываем максимальную дату для календаря
     from datetime import timedelta
@@ -107,14 +115,8 @@ def check_availability(classroom_id, date, start_time, end_time):
         end = datetime.strptime(end_time, '%H:%M').time()
         
         # Проверяем наличие пересекающихся бронирований
-        conflicting_booking = Booking.query.filter(
-            Booking.classroom_id == classroom_id,
-            Booking.booking_date == booking_date,
-            Booking.status.in_(['pending', 'approved']),
-            ((Booking.start_time <= start) & (Booking.end_time > start)) |
-            ((Booking.start_time < end) & (Booking.end_time >= end)) |
-            ((Booking.start_time >= start) & (Booking.end_time <= end))
-        ).first()
+        conflict = availability.find_conflict(classroom_id, booking_date, start, end)
+        conflicting_booking = Booking.query.get(conflict.booking_id) if conflict else None
         
         is_available = conflicting_booking is None
         
@@ -137,15 +139,199 @@ def check_availability(classroom_id, date, start_time, end_time):
 
 
 
+@main_bp.route('/api/check_availability/batch', methods=['POST'])
+def check_availability_batch():
+    """Проверяет доступность для списка (аудитория, дата, интервал) одним запросом к БД"""
+    payload = request.get_json(silent=True)
+    probes = payload.get('probes') if isinstance(payload, dict) else payload
+    if not isinstance(probes, list):
+        return jsonify({'error': 'Ожидается JSON-список проверок'}), 400
+    if len(probes) > AVAILABILITY_BATCH_LIMIT:
+        return jsonify({'error': f'Не более {AVAILABILITY_BATCH_LIMIT} проверок за запрос'}), 400
+    
+    parsed = []
+    for probe in probes:
+        try:
+            classroom_id = int(probe['classroom_id'])
+            booking_date = datetime.strptime(probe['date'], '%Y-%m-%d').date()
+            start = datetime.strptime(probe['start_time'], '%H:%M').time()
+            end = datetime.strptime(probe['end_time'], '%H:%M').time()
+            if start >= end:
+                raise ValueError('Время окончания должно быть позже времени начала')
+            parsed.append((classroom_id, booking_date, start, end))
+        except Exception as e:
+            parsed.append(e)
+    
+    valid = [p for p in parsed if not isinstance(p, Exception)]
+    classroom_ids = set()
+    room_days = {}
+    details = {}
+    if valid:
+        # Один запрос на все даты и аудитории из пакета; аудитории без бронирований
+        # приходят строкой с пустым бронированием, так отличаются несуществующие
+        rows = db.session.query(
+            Classroom.id.label('classroom_id'), Booking.id, Booking.booking_date,
+            Booking.start_time, Booking.end_time, Booking.purpose, User.username
+        ).outerjoin(Booking, and_(
+            Booking.classroom_id == Classroom.id,
+            Booking.booking_date.in_({p[1] for p in valid}),
+            Booking.status.in_(ACTIVE_STATUSES)
+        )).outerjoin(User, User.id == Booking.user_id).filter(
+            Classroom.id.in_({p[0] for p in valid})
+        ).all()
+        
+        slots = {}
+        for row in rows:
+            classroom_ids.add(row.classroom_id)
+            if row.id is None:
+                continue
+            slots.setdefault((row.classroom_id, row.booking_date), []).append(
+                Slot(row.start_time, row.end_time, row.id)
+            )
+            details[row.id] = row
+        room_days = {key: RoomDay(day_slots) for key, day_slots in slots.items()}
+    
+    results = []
+    for probe, item in zip(probes, parsed):
+        if isinstance(item, Exception):
+            results.append({'error': str(item)})
+            continue
+        
+        classroom_id, booking_date, start, end = item
+        if classroom_id not in classroom_ids:
+            results.append({'error': f'Аудитория {classroom_id} не найдена'})
+            continue
+        room_day = room_days.get((classroom_id, booking_date))
+        conflict = room_day.find_overlap(start, end) if room_day else None
+        conflicting_booking = details[conflict.booking_id] if conflict else None
+        
+        results.append({
+            'classroom_id': classroom_id,
+            'date': probe['date'],
+            'start_time': probe['start_time'],
+            'end_time': probe['end_time'],
+            'is_available': conflicting_booking is None,
+            'conflict': {
+                'exists': True,
+                'user': conflicting_booking.username,
+                'purpose': conflicting_booking.purpose,
+                'time': f"{conflicting_booking.start_time.strftime('%H:%M')} - {conflicting_booking.end_time.strftime('%H:%M')}"
+            } if conflicting_booking else None
+        })
+    
+    return jsonify(results)
+
+
+@main_bp.route('/api/free_rooms')
+def free_rooms():
+    """Возвращает аудитории, свободные весь указанный интервал, по возрастанию вместимости"""
+    try:
+        booking_date = datetime.strptime(request.args['date'], '%Y-%m-%d').date()
+        start = datetime.strptime(request.args['start_time'], '%H:%M').time()
+        end = datetime.strptime(request.args['end_time'], '%H:%M').time()
+        # Не type=int: он молча заменил бы некорректное число значением по умолчанию
+        min_capacity = int(request.args.get('min_capacity', 0))
+        floor = int(request.args['floor']) if request.args.get('floor') else None
+        has_projector = request.args.get('has_projector', '').lower() in ('1', 'true', 'yes')
+        has_computers = request.args.get('has_computers', '').lower() in ('1', 'true', 'yes')
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f'Некорректные параметры: {e}'}), 400
+    
+    if start >= end:
+        return jsonify({'error': 'Время окончания должно быть позже времени начала'}), 400
+    
+    if start < occupancy.DAY_START or end > occupancy.DAY_END:
+        return jsonify({'error': 'Интервал должен быть в пределах рабочего дня 08:00-22:00'}), 400
+    
+    mask = occupancy.slot_mask(start, end)
+    
+    # Один запрос: аудитории + маска занятости на дату; аудитория свободна,
+    # если ни один бит интервала не занят (строки маски может не быть вовсе)
+    query = db.session.query(Classroom).outerjoin(
+        RoomOccupancy,
+        (RoomOccupancy.classroom_id == Classroom.id) & (RoomOccupancy.day == booking_date)
+    ).filter(
+        Classroom.is_active == True,
+        Classroom.capacity >= min_capacity,
+        func.coalesce(RoomOccupancy.busy_mask, 0).op('&')(mask) == 0
+    )
+    
+    if has_projector:
+        query = query.filter(Classroom.has_projector == True)
+    if has_computers:
+        query = query.filter(Classroom.has_computers == True)
+    if floor is not None:
+        query = query.filter(Classroom.floor == floor)
+    
+    rooms = query.order_by(Classroom.capacity, Classroom.room_number).all()
+    
+    return jsonify({
+        'date': booking_date.strftime('%Y-%m-%d'),
+        'start_time': start.strftime('%H:%M'),
+        'end_time': end.strftime('%H:%M'),
+        'rooms': [{
+            'id': room.id,
+            'room_number': room.room_number,
+            'capacity': room.capacity,
+            'floor': room.floor,
+            'has_projector': room.has_projector,
+            'has_computers': room.has_computers
+        } for room in rooms]
+    })
+
+
+@main_bp.route('/api/occupancy_matrix')
+def occupancy_matrix():
+    """Матрица занятости всех аудиторий по 15-минутным слотам за период"""
+    try:
+        start_date = datetime.strptime(request.args.get('start_date', date.today().strftime('%Y-%m-%d')), '%Y-%m-%d').date()
+        days = request.args.get('days', default=7, type=int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if days < 1 or days > OCCUPANCY_MATRIX_MAX_DAYS:
+        return jsonify({'error': f'Период должен быть от 1 до {OCCUPANCY_MATRIX_MAX_DAYS} дней'}), 400
+    
+    output = request.args.get('format', 'bitmask')
+    if output not in ('bitmask', 'runs'):
+        return jsonify({'error': 'format должен быть bitmask или runs'}), 400
+    
+    classrooms = Classroom.query.filter_by(is_active=True).order_by(Classroom.id).all()
+    matrix = occupancy.occupancy_matrix([c.id for c in classrooms], start_date, days)
+    
+    if output == 'bitmask':
+        # Маски шире 53 бит, поэтому отдаем их hex-строками, чтобы JS не терял точность
+        rows = [[format(int(mask), 'x') for mask in room] for room in occupancy.to_bitmasks(matrix)]
+    else:
+        rows = occupancy.to_runs(matrix)
+    
+    return jsonify({
+        'start_date': start_date.strftime('%Y-%m-%d'),
+        'days': days,
+        'day_start': occupancy.DAY_START.strftime('%H:%M'),
+        'slot_minutes': occupancy.SLOT_MINUTES,
+        'slots': occupancy.SLOTS_PER_DAY,
+        'format': output,
+        'rooms': [{
+            'classroom_id': classroom.id,
+            'room_number': classroom.room_number,
+            'days': row
+        } for classroom, row in zip(classrooms, rows)]
+    })
+
+
 @main_bp.route('/api/classroom_schedule/<int:classroom_id>')
 def classroom_schedule(classroom_id):
-    """Возвращает расписание аудитории на сегодня"""
-    today = date.today()
+    """Возвращает почасовое расписание аудитории на дату (по умолчанию на сегодня)"""
+    try:
+        day = datetime.strptime(request.args.get('date', date.today().strftime('%Y-%m-%d')), '%Y-%m-%d').date()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Получаем все бронирования на сегодня
-    bookings = Booking.query.filter(
+    # Получаем все бронирования на дату
+    bookings = Booking.query.options(joinedload(Booking.user)).filter(
         Booking.classroom_id == classroom_id,
-        Booking.booking_date == today,
+        Booking.booking_date == day,
         Booking.status.in_(['approved', 'pending'])
     ).all()
     
@@ -156,11 +342,11 @@ def classroom_schedule(classroom_id):
         is_booked = False
         booking_info = None
         
+        # Час занят, если бронирование пересекается с ним хотя бы на минуту
+        hour_start = time(hour, 0)
+        hour_end = time(hour + 1, 0) if hour < 23 else time.max
         for booking in bookings:
-            start_hour = booking.start_time.hour
-            end_hour = booking.end_time.hour
-            
-            if start_hour <= hour < end_hour:
+            if booking.overlaps(hour_start, hour_end):
                 is_booked = True
                 booking_info = {
                     'user': booking.user.username,
@@ -177,7 +363,7 @@ def classroom_schedule(classroom_id):
     
     return jsonify({
         'classroom_id': classroom_id,
-        'date': today.strftime('%Y-%m-%d'),
+        'date': day.strftime('%Y-%m-%d'),
         'schedule': schedule
     })
 
@@ -275,96 +461,26 @@ def booking():
                 flash('Нельзя бронировать аудиторию на прошедшее время', 'danger')
                 return render_template('booking.html', title='Бронирование', form=form)
         
-        # Проверяем доступность аудитории
-        existing_booking = Booking.query.filter(
-            Booking.classroom_id == form.classroom_id.data,
-            Booking.booking_date == form.booking_date.data,
-            Booking.status.in_(['pending', 'approved']),
-            ((Booking.start_time <= start_time) & (Booking.end_time > start_time)) |
-            ((Booking.start_time < end_time) & (Booking.end_time >= end_time)) |
-            ((Booking.start_time >= start_time) & (Booking.end_time <= end_time))
-        ).first()
-        
-        if existing_booking:
-            # Аудитория занята — предлагаем встать в очередь
-            queue_count = BookingQueue.query.filter(
-                BookingQueue.classroom_id == form.classroom_id.data,
-                BookingQueue.booking_date == form.booking_date.data,
-                BookingQueue.start_time == start_time,
-                BookingQueue.end_time == end_time,
-                BookingQueue.status == 'waiting'
-            ).count()
-            
-            new_queue_entry = BookingQueue(
-                user_id=current_user.id,
-                classroom_id=form.classroom_id.data,
-                booking_date=form.booking_date.data,
-                start_time=start_time,
-                end_time=end_time,
-                queue_position=queue_count + 1,
-                status='waiting'
-            )
-            db.session.add(new_queue_entry)
-            db.session.commit()
-            
-            # Отправляем email уведомление об очереди
-            classroom = Classroom.query.get(form.classroom_id.data)
-            try:
-                send_queue_notification_email(
-                    user_email=current_user.email,
-                    username=current_user.username,
-                    classroom_number=classroom.room_number,
-                    position=queue_count + 1,
-                    booking_date=form.booking_date.data.strftime('%d.%m.%Y'),
-                    start_time=start_time.strftime('%H:%M'),
-                    end_time=end_time.strftime('%H:%M')
-                )
-            except Exception as e:
-                print(f'Ошибка при отправке email: {e}')
-            
-            flash(f'Аудитория занята. Вы встали в очередь (позиция {queue_count + 1}). Вас уведомят, когда слот освободится.', 'info')
-            return redirect(url_for('main.booking'))
-        
+        # Все проверки и вставка - в одной транзакции под блокировкой слота
+        result = admission.admit(
+            current_user, form.classroom_id.data, form.booking_date.data, start_time, end_time, form.purpose.data
+        )
         
-        # Проверяем, не бронирует ли пользователь другую аудиторию на это же время
-        user_conflict = Booking.query.filter(
-            Booking.user_id == current_user.id,
-            Booking.booking_date == form.booking_date.data,
-            Booking.status.in_(['pending', 'approved']),
-            ((Booking.start_time <= start_time) & (Booking.end_time > start_time)) |
-            ((Booking.start_time < end_time) & (Booking.end_time >= end_time)) |
-            ((Booking.start_time >= start_time) & (Booking.end_time <= end_time))
-        ).first()
+        if result.status == admission.QUEUED:
+            # Аудитория занята — пользователь встал в очередь (письмо записано в той же транзакции)
+            position = result.position
+            flash(f'Аудитория занята. Вы встали в очередь (позиция {position}). Вас уведомят, когда слот освободится.', 'info')
+            return redirect(url_for('main.booking'))
         
-        if user_conflict:
+        if result.status == admission.USER_CONFLICT:
             flash('У вас уже есть бронирование на это время в другой аудитории', 'danger')
             return render_template('booking.html', title='Бронирование', form=form)
         
-        # Ограничиваем количество бронирований в день для студентов
-        if current_user.role == 'student':
-            today_bookings_count = Booking.query.filter(
-                Booking.user_id == current_user.id,
-                Booking.booking_date == form.booking_date.data,
-                Booking.status.in_(['pending', 'approved'])
-            ).count()
-            
-            if today_bookings_count >= 2:
-                flash('Вы не можете забронировать более 2 аудиторий в день', 'danger')
-                return render_template('booking.html', title='Бронирование', form=form)
-        
-        # Создаем бронирование
-        booking = Booking(
-            user_id=current_user.id,
-            classroom_id=form.classroom_id.data,
-            booking_date=form.booking_date.data,
-            start_time=start_time,
-            end_time=end_time,
-            purpose=form.purpose.data,
-            status='approved' if current_user.role == 'teacher' else 'pending'
-        )
+        if result.status == admission.QUOTA:
+            flash(f'Вы не можете забронировать более {admission.STUDENT_DAILY_LIMIT} аудиторий в день', 'danger')
+            return render_template('booking.html', title='Бронирование', form=form)
         
-        db.session.add(booking)
-        db.session.commit()
+        availability.add(result.booking)
         
         status_msg = 'одобрено' if current_user.role == 'teacher' else 'ожидает подтверждения'
         flash(f'Бронирование успешно создано и {status_msg}!', 'success')
@@ -393,64 +509,101 @@ def recurring_booking():
             flash('Нельзя создавать бронирования на прошедшие даты', 'danger')
             return render_template('recurring_booking.html', title='Регулярное бронирование', form=form)
         
-        # Проверяем доступность для первых 4 недель
-        from datetime import timedelta
-        check_end_date = min(form.end_date.data, form.start_date.data + timedelta(days=28))
-        
-        for i in range(4):
-            current_date = form.start_date.data + timedelta(days=i * (7 if form.recurrence_type.data == 'weekly' else 14))
-            if current_date > check_end_date:
-                break
-            
-            # Проверяем доступность для этой даты
-            start_time = datetime.strptime(form.start_time.data, '%H:%M').time()
-            end_time = datetime.strptime(form.end_time.data, '%H:%M').time()
-            
-            existing = Booking.query.filter(
-                Booking.classroom_id == form.classroom_id.data,
-                Booking.booking_date == current_date,
-                Booking.status.in_(['pending', 'approved']),
-                ((Booking.start_time <= start_time) & (Booking.end_time > start_time)) |
-                ((Booking.start_time < end_time) & (Booking.end_time >= end_time))
-            ).first()
-            
-            if existing:
-                flash(f'Аудитория занята {current_date.strftime("%d.%m.%Y")} в это время', 'danger')
-                return render_template('recurring_booking.html', title='Регулярное бронирование', form=form)
-        
         # Создаем повторяющееся бронирование
         recurring = RecurringBooking(
             user_id=current_user.id,
             classroom_id=form.classroom_id.data,
             start_date=form.start_date.data,
             end_date=form.end_date.data,
-            day_of_week=form.day_of_week.data,
+            day_of_week=int(form.day_of_week.data),
             start_time=datetime.strptime(form.start_time.data, '%H:%M').time(),
             end_time=datetime.strptime(form.end_time.data, '%H:%M').time(),
             recurrence_type=form.recurrence_type.data,
             purpose=form.purpose.data
         )
+        # Вхождения до горизонта проверяются одним запросом и вставляются одним INSERT под
+        # блокировками admission, дальнейшие даты создаёт фоновая задача extend_recurring_series
+        with admission.writer():
+            try:
+                admission.lock()
+                db.session.add(recurring)
+                db.session.flush()
+                occurrences = recurrence.materialize([recurring], date_to=recurrence.horizon())
+                created = [occurrence for occurrence in occurrences if occurrence.conflict is None]
+                conflicts = [occurrence.day.strftime('%d.%m.%Y') for occurrence in occurrences if occurrence.conflict]
+
+                keys = recurrence.created_keys(occurrences)
+                if occurrences and not created:
+                    db.session.rollback()
+                else:
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        if occurrences and not created:
+            flash('Аудитория занята во все ближайшие даты серии в это время', 'danger')
+            return render_template('recurring_booking.html', title='Регулярное бронирование', form=form)
+        recurrence.invalidate(keys)
         
-        db.session.add(recurring)
-        db.session.commit()
-        
-        # Генерируем бронирования на первые 4 недели
-        generated_bookings = recurring.generate_bookings(
-            start_date=form.start_date.data,
-            end_date=min(form.end_date.data, form.start_date.data + timedelta(days=28))
-        )
-        
-        for booking in generated_bookings:
-            db.session.add(booking)
-        
-        db.session.commit()
-        
-        flash(f'Регулярное бронирование создано! Создано {len(generated_bookings)} бронирований.', 'success')
+        if conflicts:
+            flash(f'Аудитория занята в эти даты, они пропущены: {", ".join(conflicts)}', 'warning')
+        flash(f'Регулярное бронирование создано! Создано {len(created)} бронирований.', 'success')
         return redirect(url_for('main.profile'))
     
     return render_template('recurring_booking.html', title='Регулярное бронирование', form=form)
 
 
+@main_bp.route('/api/recurring_preview')
+@login_required
+def recurring_preview():
+    """Предпросмотр дат регулярного бронирования с отметкой о занятости"""
+    try:
+        classroom_id = int(request.args['classroom_id'])
+        start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date()
+        day_of_week = int(request.args['day_of_week'])
+        start = datetime.strptime(request.args['start_time'], '%H:%M').time()
+        end = datetime.strptime(request.args['end_time'], '%H:%M').time()
+        recurrence_type = request.args.get('recurrence_type', 'weekly')
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f'Некорректные параметры: {e}'}), 400
+    
+    if start >= end:
+        return jsonify({'error': 'Время окончания должно быть позже времени начала'}), 400
+    
+    if end_date < start_date or (end_date - start_date).days > RECURRING_PREVIEW_MAX_DAYS:
+        return jsonify({'error': f'Период серии должен быть от 0 до {RECURRING_PREVIEW_MAX_DAYS} дней'}), 400
+    
+    if not 0 <= day_of_week <= 6 or recurrence_type not in recurrence.STEP_DAYS:
+        return jsonify({'error': 'Некорректный день недели или тип повторения'}), 400
+    
+    classroom = db.session.get(Classroom, classroom_id)
+    if classroom is None:
+        return jsonify({'error': 'Аудитория не найдена'}), 404
+    
+    # Серия не сохраняется: нужна только для расчёта дат
+    series = RecurringBooking(
+        classroom_id=classroom_id,
+        start_date=start_date,
+        end_date=end_date,
+        day_of_week=day_of_week,
+        start_time=start,
+        end_time=end,
+        recurrence_type=recurrence_type
+    )
+    time_label = f"{start.strftime('%H:%M')} - {end.strftime('%H:%M')}"
+    
+    return jsonify({'preview': [{
+        'date': occurrence.day.strftime('%d.%m.%Y'),
+        'day_name': recurrence.DAY_NAMES[occurrence.day.weekday()],
+        'time': time_label,
+        'room_number': classroom.room_number,
+        'available': occurrence.conflict is None,
+        'conflict': occurrence.conflict is not None
+    } for occurrence in recurrence.preview(series)]})
+
+
 @main_bp.route('/cancel_recurring/<int:recurring_id>')
 @login_required
 def cancel_recurring(recurring_id):
@@ -470,67 +623,127 @@ def cancel_recurring(recurring_id):
     ).all()
     
     for booking in future_bookings:
+        # Владельцу серии уходит одна сводка, а не письмо на каждое занятие
+        if booking.user_id != current_user.id:
+            send_booking_email(send_booking_cancelled_email, booking)
+        rollup.record(booking, booking.status, None)
         db.session.delete(booking)
     
     recurring.status = 'cancelled'
+    occupancy.refresh_for(future_bookings)
     db.session.commit()
+    for booking in future_bookings:
+        availability.discard(booking)
     
     flash(f'Регулярное бронирование отменено. Удалено {len(future_bookings)} будущих бронирований.', 'success')
     return redirect(url_for('main.profile'))
 
 
-def auto_complete_past_bookings():
-    """Автоматически помечает прошедшие бронирования как завершенные"""
-    now = datetime.now()
-    current_time = now.time()
-    current_date = now.date()
-    
-    # Находим бронирования, которые уже закончились но еще активны
-    expired_bookings = Booking.query.filter(
-        ((Booking.booking_date < current_date) |
-         ((Booking.booking_date == current_date) & (Booking.end_time < current_time))),
-        Booking.status.in_(['approved', 'pending'])
-    ).all()
-    
-    for booking in expired_bookings:
-        booking.status = 'completed'
-    
-    if expired_bookings:
-        db.session.commit()
-        print(f"Автоматически завершено {len(expired_bookings)} бронирований")
-
 @main_bp.route('/profile')
 @login_required
 def profile():
     try:
-        # Автоматически завершаем прошедшие бронирования
-        auto_complete_past_bookings()
-        
-        # Получаем бронирования ТОЛЬКО текущего пользователя
-        user_bookings = Booking.query.filter_by(user_id=current_user.id).order_by(
-            Booking.booking_date.desc(), 
-            Booking.start_time.desc()
-        ).all()
-        
-        # Получаем очередь ожидания текущего пользователя
-        user_queue_entries = BookingQueue.query.filter_by(user_id=current_user.id).order_by(
-            BookingQueue.booking_date.desc(),
-            BookingQueue.start_time.desc()
-        ).all()
+        # Прошедшие бронирования завершает фоновая задача complete_past_bookings
+        # Первая страница бронирований и очереди ТОЛЬКО текущего пользователя,
+        # остальные подгружаются через /api/my_bookings и /api/my_queue
+        user_bookings, bookings_cursor = pagination.page(_my_bookings(), Booking)
+        user_queue_entries, queue_cursor = pagination.page(_my_queue(), BookingQueue)
+
+        # Счётчики и бронирования на сегодня - отдельными запросами, а не по загруженной странице
+        status_counts = dict(db.session.query(Booking.status, func.count(Booking.id)).filter(
+            Booking.user_id == current_user.id
+        ).group_by(Booking.status).all())
+        today_bookings = _my_bookings().filter(Booking.booking_date == date.today()).order_by(Booking.start_time).all()
         
         return render_template('profile.html', 
                              title='Мой профиль', 
                              bookings=user_bookings,
+                             bookings_cursor=bookings_cursor,
+                             total_bookings=sum(status_counts.values()),
+                             status_counts=status_counts,
+                             today_bookings=today_bookings,
                              queue_entries=user_queue_entries,
+                             queue_cursor=queue_cursor,
+                             queue_total=_my_queue().count(),
+                             queue_positions=waitlist.positions(user_queue_entries),
                              current_date=date.today())
     except Exception as e:
         flash('Ошибка загрузки данных профиля.', 'danger')
         return render_template('profile.html', 
                              title='Мой профиль', 
                              bookings=[],
+                             total_bookings=0,
+                             status_counts={},
+                             today_bookings=[],
                              queue_entries=[],
+                             queue_total=0,
+                             queue_positions={},
                              current_date=date.today())
-    
+
+
+def _my_bookings():
+    return Booking.query.filter(Booking.user_id == current_user.id).options(joinedload(Booking.classroom))
+
+
+def _my_queue():
+    return BookingQueue.query.filter(BookingQueue.user_id == current_user.id).options(joinedload(BookingQueue.classroom))
+
+
+def _page_args():
+    """(курсор, размер страницы) из запроса. ValueError при некорректных значениях"""
+    limit = request.args.get('limit', default=pagination.PAGE_SIZE, type=int)
+    if not 1 <= limit <= pagination.MAX_PAGE_SIZE:
+        raise ValueError(f'limit должен быть от 1 до {pagination.MAX_PAGE_SIZE}')
+    return request.args.get('cursor'), limit
+
+
+@main_bp.route('/api/my_bookings')
+@login_required
+def api_my_bookings():
+    """Страница бронирований текущего пользователя для бесконечной прокрутки профиля"""
+    try:
+        bookings, next_cursor = pagination.page(_my_bookings(), Booking, *_page_args())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'bookings': [{
+            'id': booking.id,
+            'classroom': booking.classroom.room_number,
+            'date': booking.booking_date.strftime('%Y-%m-%d'),
+            'start_time': booking.start_time.strftime('%H:%M'),
+            'end_time': booking.end_time.strftime('%H:%M'),
+            'purpose': booking.purpose,
+            'status': booking.status
+        } for booking in bookings],
+        'html': render_template('_booking_rows.html', bookings=bookings, current_date=date.today()),
+        'next_cursor': next_cursor
+    })
+
+
+@main_bp.route('/api/my_queue')
+@login_required
+def api_my_queue():
+    """Страница очереди ожидания текущего пользователя для бесконечной прокрутки профиля"""
+    try:
+        entries, next_cursor = pagination.page(_my_queue(), BookingQueue, *_page_args())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    positions = waitlist.positions(entries)
+    return jsonify({
+        'queue': [{
+            'id': entry.id,
+            'classroom': entry.classroom.room_number,
+            'date': entry.booking_date.strftime('%Y-%m-%d'),
+            'start_time': entry.start_time.strftime('%H:%M'),
+            'end_time': entry.end_time.strftime('%H:%M'),
+            'status': entry.status,
+            'position': positions.get(entry.id)
+        } for entry in entries],
+        'html': render_template('_queue_cards.html', queue_entries=entries, queue_positions=positions),
+        'next_cursor': next_cursor
+    })
 
 
 @main_bp.route('/calendar')
@@ -560,38 +773,58 @@ def calendar_view():
         end_date = date(year, month + 1, 1)
     
     # Для студентов - только их бронирования, для преподавателей - все
-    if current_user.role in ['teacher', 'admin']:
-        month_bookings = Booking.query.filter(
-            Booking.booking_date >= start_date,
-            Booking.booking_date < end_date,
-            Booking.status.in_(['approved', 'pending'])
-        ).all()
-    else:
-        month_bookings = Booking.query.filter(
-            Booking.booking_date >= start_date,
-            Booking.booking_date < end_date,
-            Booking.user_id == current_user.id,
-            Booking.status.in_(['approved', 'pending'])
-        ).all()
+    month_filter = [
+        Booking.booking_date >= start_date,
+        Booking.booking_date < end_date,
+        Booking.status.in_(['approved', 'pending'])
+    ]
+    if current_user.role not in ['teacher', 'admin']:
+        month_filter.append(Booking.user_id == current_user.id)
+    
+    # Для ячеек календаря достаточно легкой проекции, без ORM-объектов
+    month_bookings = db.session.query(
+        Booking.booking_date,
+        Booking.start_time,
+        Booking.end_time,
+        Booking.status,
+        Booking.purpose,
+        Booking.user_id,
+        User.username,
+        Classroom.room_number,
+        Classroom.has_projector
+    ).join(User, User.id == Booking.user_id).join(Classroom, Classroom.id == Booking.classroom_id).filter(
+        *month_filter
+    ).order_by(Booking.booking_date, Booking.start_time).all()
     
     # Группируем бронирования по датам
     bookings_by_date = {}
     for booking in month_bookings:
-        date_str = booking.booking_date.strftime('%Y-%m-%d')
-        if date_str not in bookings_by_date:
-            bookings_by_date[date_str] = []
-        bookings_by_date[date_str].append(booking)
+        bookings_by_date.setdefault(booking.booking_date.strftime('%Y-%m-%d'), []).append(booking)
+    
+    # Статистика по аудиториям одним GROUP BY: число бронирований и точные минуты
+    month_totals = {
+        classroom_id: (booking_count, booked_minutes)
+        for classroom_id, booking_count, booked_minutes in db.session.query(
+            Booking.classroom_id,
+            func.count(Booking.id),
+            func.coalesce(func.sum(Booking.duration_minutes), 0)
+        ).filter(*month_filter).group_by(Booking.classroom_id)
+    }
+    
+    # Загрузка считается от рабочих дней (пн-пт) месяца и длины рабочего дня
+    working_days = sum(1 for week in cal for day in week[:5] if day != 0)
+    day_minutes = (occupancy.DAY_END.hour - occupancy.DAY_START.hour) * 60
     
-    # Получаем статистику занятости по аудиториям
     classroom_stats = {}
     classrooms = Classroom.query.filter_by(is_active=True).all()
     for classroom in classrooms:
-        classroom_bookings = [b for b in month_bookings if b.classroom_id == classroom.id]
+        booking_count, booked_minutes = month_totals.get(classroom.id, (0, 0))
         classroom_stats[classroom.id] = {
             'room_number': classroom.room_number,
-            'total_hours': sum((b.end_time.hour - b.start_time.hour) for b in classroom_bookings),
-            'booking_count': len(classroom_bookings),
-            'utilization': (len(classroom_bookings) / 22) * 100  # 22 рабочих дня в месяце
+            'total_minutes': booked_minutes,
+            'total_hours': round(booked_minutes / 60, 1),
+            'booking_count': booking_count,
+            'utilization': booked_minutes / (working_days * day_minutes) * 100
         }
     
     # Соседние месяцы для навигации
@@ -608,7 +841,10 @@ def calendar_view():
                          month_name=month_name,
                          bookings_by_date=bookings_by_date,
                          classroom_stats=classroom_stats,
+                         classrooms=classrooms,
                          today=date.today(),
+                         date=date,
+                         timedelta=timedelta,
                          prev_month=prev_month,
                          prev_year=prev_year,
                          next_month=next_month,
@@ -632,37 +868,21 @@ def cancel_booking(booking_id):
         flash('Нельзя отменить прошедшее бронирование', 'danger')
         return redirect(url_for('main.profile'))
     
-    db.session.delete(booking)
-    db.session.commit()
-    
-    # Уведомляем первого в очереди
-    queue_entry = BookingQueue.query.filter(
-        BookingQueue.classroom_id == booking.classroom_id,
-        BookingQueue.booking_date == booking.booking_date,
-        BookingQueue.start_time == booking.start_time,
-        BookingQueue.end_time == booking.end_time,
-        BookingQueue.status == 'waiting'
-    ).order_by(BookingQueue.queue_position).first()
-    
-    if queue_entry:
-        queue_entry.status = 'notified'
-        queue_entry.notified = True
+    # Освободившийся интервал сразу удерживается за первыми подходящими в очереди
+    with admission.writer():
+        admission.lock(booking.classroom_id, booking.booking_date)
+        if booking.user_id != current_user.id:
+            send_booking_email(send_booking_cancelled_email, booking)
+        rollup.record(booking, booking.status, None)
+        db.session.delete(booking)
+        occupancy.refresh(booking.classroom_id, booking.booking_date)
+        db.session.flush()
+        promoted = waitlist.promote(booking.classroom_id, booking.booking_date, booking.start_time, booking.end_time)
+        waitlist.notify(promoted)
         db.session.commit()
-        
-        # Отправляем email уведомление
-        classroom = Classroom.query.get(booking.classroom_id)
-        try:
-            send_queue_approved_email(
-                user_email=queue_entry.user.email,
-                username=queue_entry.user.username,
-                classroom_number=classroom.room_number,
-                booking_date=booking.booking_date.strftime('%d.%m.%Y'),
-                start_time=booking.start_time.strftime('%H:%M'),
-                end_time=booking.end_time.strftime('%H:%M')
-            )
-        except Exception as e:
-            print(f'Ошибка при отправке email: {e}')
-        
+    availability.discard(booking)
+    
+    for queue_entry in promoted:
         flash(f'Уведомление отправлено пользователю {queue_entry.user.username} о возможности бронирования', 'info')
     
     flash('Бронирование успешно отменено', 'success')
@@ -683,6 +903,70 @@ def admin_bookings():
                          pending_bookings=pending_bookings,
                          approved_bookings=approved_bookings)
 
+def _admin_stats():
+    """Статистика для админки из дневной сводки - не зависит от объема истории"""
+    today = date.today()
+    window = rollup.daily_stats(
+        today - timedelta(days=ADMIN_STATS_WINDOW_DAYS),
+        today + timedelta(days=ADMIN_STATS_WINDOW_DAYS)
+    )
+    classrooms = {c.id: c for c in Classroom.query.all()}
+    
+    return {
+        'daily_stats': rollup.daily_stats(today - timedelta(days=6), today),
+        'total_bookings': sum(d['bookings'] for d in window),
+        'booked_minutes': sum(d['booked_minutes'] for d in window),
+        'approved_bookings': sum(d['approved'] for d in window),
+        'pending_bookings': sum(d['pending'] for d in window),
+        'rejected_bookings': sum(d['rejected'] for d in window),
+        'popular_classrooms': [{
+            'classroom_id': classroom_id,
+            'room_number': classrooms[classroom_id].room_number,
+            'booking_count': int(booking_count),
+            'booked_minutes': int(booked_minutes)
+        } for classroom_id, booking_count, booked_minutes in rollup.classroom_stats(
+            today - timedelta(days=ADMIN_STATS_WINDOW_DAYS),
+            today + timedelta(days=ADMIN_STATS_WINDOW_DAYS)
+        )],
+        'total_classrooms': len(classrooms),
+        'active_classrooms': sum(1 for c in classrooms.values() if c.is_active)
+    }
+
+
+@main_bp.route('/api/admin_stats')
+@login_required
+def admin_stats():
+    if current_user.role not in ['teacher', 'admin']:
+        return jsonify({'error': 'Недостаточно прав'}), 403
+    
+    return jsonify(_admin_stats())
+
+
+@main_bp.route('/admin/dashboard')
+@login_required
+def admin_dashboard():
+    if current_user.role not in ['teacher', 'admin']:
+        flash('У вас нет прав для доступа к этой странице.', 'danger')
+        return redirect(url_for('main.index'))
+    
+    users_by_role = dict(db.session.query(User.role, func.count(User.id)).group_by(User.role).all())
+    recent_users = User.query.order_by(User.created_at.desc()).limit(5).all()
+    recent_bookings = Booking.query.options(
+        joinedload(Booking.user), joinedload(Booking.classroom)
+    ).order_by(Booking.id.desc()).limit(10).all()
+    
+    return render_template('admin_dashboard.html',
+                         title='Панель администратора',
+                         total_users=sum(users_by_role.values()),
+                         teachers=users_by_role.get('teacher', 0),
+                         students=users_by_role.get('student', 0),
+                         recent_users=recent_users,
+                         active_users=[],
+                         recent_bookings=recent_bookings,
+                         classrooms=Classroom.query.all(),
+                         **_admin_stats())
+
+
 @main_bp.route('/admin/approve_booking/<int:booking_id>')
 @login_required
 def approve_booking(booking_id):
@@ -691,8 +975,11 @@ def approve_booking(booking_id):
         return redirect(url_for('main.index'))
     
     booking = Booking.query.get_or_404(booking_id)
+    rollup.record(booking, booking.status, 'approved')
     booking.status = 'approved'
+    occupancy.refresh(booking.classroom_id, booking.booking_date)
     db.session.commit()
+    availability.sync(booking)
     flash('Бронирование одобрено', 'success')
     return redirect(url_for('main.admin_bookings'))
 
@@ -706,25 +993,75 @@ def remove_from_queue(queue_id):
         flash('Вы можете удалять только свои записи из очереди', 'danger')
         return redirect(url_for('main.profile'))
     
-    # Удаляем из очереди
-    classroom_id = queue_entry.classroom_id
-    db.session.delete(queue_entry)
+    if queue_entry.status != 'notified':
+        # Позиции остальных считаются при чтении, поэтому удаляется одна строка
+        db.session.delete(queue_entry)
+        db.session.commit()
+        flash('Вы удалены из очереди', 'success')
+        return redirect(url_for('main.profile'))
+
+    # Отказ от удержания освобождает слот: он сразу удерживается за следующими в очереди,
+    # под той же блокировкой, что у отмены бронирования
+    classroom_id, day = queue_entry.classroom_id, queue_entry.booking_date
+    start, end = queue_entry.start_time, queue_entry.end_time
+    with admission.writer():
+        admission.lock(classroom_id, day)
+        # Пока ждали блокировку, удержание могли подтвердить или передать дальше
+        queue_entry = db.session.get(BookingQueue, queue_id, populate_existing=True)
+        released = queue_entry is not None and queue_entry.status == 'notified'
+        if queue_entry is not None:
+            db.session.delete(queue_entry)
+            db.session.flush()
+        promoted = []
+        if released and datetime.combine(day, end) > datetime.now():
+            promoted = waitlist.promote(classroom_id, day, start, end)
+        waitlist.notify(promoted)
+        db.session.commit()
+
+    for entry in promoted:
+        flash(f'Уведомление отправлено пользователю {entry.user.username} о возможности бронирования', 'info')
+    flash('Вы удалены из очереди', 'success')
+    return redirect(url_for('main.profile'))
+
+
+@main_bp.route('/telegram_link')
+@login_required
+def telegram_link():
+    # Код одноразовый: бот привязывает чат командой /link и стирает его
+    code = push.link_code(current_user)
     db.session.commit()
+    flash(f'Отправьте боту команду /link {code}, чтобы получать уведомления в Telegram', 'info')
+    return redirect(url_for('main.profile'))
+
+
+@main_bp.route('/confirm_queue/<int:queue_id>')
+@login_required
+def confirm_queue(queue_id):
+    queue_entry = BookingQueue.query.get_or_404(queue_id)
     
-    # Переиндексируем позиции в очереди
-    remaining_queue = BookingQueue.query.filter(
-        BookingQueue.classroom_id == classroom_id,
-        BookingQueue.booking_date == queue_entry.booking_date,
-        BookingQueue.start_time == queue_entry.start_time,
-        BookingQueue.end_time == queue_entry.end_time,
-        BookingQueue.status == 'waiting'
-    ).order_by(BookingQueue.created_at).all()
+    if queue_entry.user_id != current_user.id:
+        flash('Вы можете подтверждать только свои записи в очереди', 'danger')
+        return redirect(url_for('main.profile'))
     
-    for idx, entry in enumerate(remaining_queue, 1):
-        entry.queue_position = idx
+    # Удержание превращается в бронирование в той же транзакции, что и проверки
+    result = admission.admit(
+        current_user, queue_entry.classroom_id, queue_entry.booking_date,
+        queue_entry.start_time, queue_entry.end_time, 'Бронирование из очереди ожидания',
+        hold=queue_entry
+    )
     
-    db.session.commit()
-    flash('Вы удалены из очереди', 'success')
+    if result.status == admission.HOLD_EXPIRED:
+        flash('Время на подтверждение истекло, удержание слота снято', 'warning')
+    elif result.status == admission.ROOM_CONFLICT:
+        flash('Это время уже занято', 'danger')
+    elif result.status == admission.USER_CONFLICT:
+        flash('У вас уже есть бронирование на это время в другой аудитории', 'danger')
+    elif result.status == admission.QUOTA:
+        flash(f'Вы не можете забронировать более {admission.STUDENT_DAILY_LIMIT} аудиторий в день', 'danger')
+    else:
+        availability.add(result.booking)
+        status_msg = 'одобрено' if current_user.role == 'teacher' else 'ожидает подтверждения'
+        flash(f'Бронирование успешно создано и {status_msg}!', 'success')
     return redirect(url_for('main.profile'))
 @main_bp.route('/admin/reject_booking/<int:booking_id>')
 @login_required
@@ -734,8 +1071,12 @@ def reject_booking(booking_id):
         return redirect(url_for('main.index'))
     
     booking = Booking.query.get_or_404(booking_id)
+    rollup.record(booking, booking.status, 'rejected')
     booking.status = 'rejected'
+    send_booking_email(send_booking_rejected_email, booking)
+    occupancy.refresh(booking.classroom_id, booking.booking_date)
     db.session.commit()
+    availability.discard(booking)
     
     flash(f'Бронирование аудитории {booking.classroom.room_number} отклонено.', 'info')
     return redirect(url_for('main.admin_bookings'))
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+Фоновый планировщик периодических задач.
+
+Каждый воркер gunicorn запускает у себя поток планировщика (при первом
+запросе), но задачу выполняет только тот, кто держит её аренду в таблице
+scheduler_lease. Аренда продлевается при каждом запуске; если воркер-лидер
+умер, через lease_ttl секунд аренду забирает другой воркер.
+
+Задачи регистрируются декоратором @scheduler.job (см. app/jobs.py).
+Отключить планировщик: SCHEDULER_ENABLED=false. В режиме TESTING поток не
+запускается, задачи вызываются из тестов напрямую.
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import SchedulerLease
+
+logger = logging.getLogger(__name__)
+
+# Как часто поток планировщика проверяет, не пора ли запускать задачи
+TICK_SECONDS = 5
+
+Job = namedtuple('Job', ['name', 'interval', 'func'])
+
+
+class Scheduler:
+    """Периодические задачи с выбором лидера через аренду в БД"""
+
+    def __init__(self, app=None):
+        self.jobs = {}
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._next_run = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['scheduler'] = self
+        if app.config.get('SCHEDULER_ENABLED', True) and not app.testing:
+            app.before_request(self._ensure_started)
+
+    def job(self, name, interval):
+        """Регистрирует функцию как задачу, выполняемую раз в interval секунд"""
+        def decorator(func):
+            self.jobs[name] = Job(name, interval, func)
+            return func
+        return decorator
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self.start(current_app._get_current_object())
+
+    def start(self, app):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(app,), name='scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, app):
+        while not self._stop.wait(TICK_SECONDS):
+            with app.app_context():
+                try:
+                    self.run_pending()
+                finally:
+                    db.session.remove()
+
+    def acquire(self, name, ttl):
+        """Берёт или продлевает аренду задачи. Возвращает True, если этот процесс - лидер"""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        try:
+            # Забрать можно свою или просроченную аренду; при гонке двух воркеров
+            # UPDATE пройдёт только у одного, второй получит 0 строк
+            updated = SchedulerLease.query.filter(
+                SchedulerLease.name == name,
+                (SchedulerLease.holder == self.holder) | (SchedulerLease.expires_at < now)
+            ).update({'holder': self.holder, 'expires_at': expires_at}, synchronize_session=False)
+            if not updated:
+                db.session.add(SchedulerLease(name=name, holder=self.holder, expires_at=expires_at))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            # Аренда уже существует и принадлежит живому лидеру
+            db.session.rollback()
+            return False
+
+    def release(self, name):
+        SchedulerLease.query.filter_by(name=name, holder=self.holder).delete(synchronize_session=False)
+        db.session.commit()
+
+    def run_pending(self, now=None):
+        """Запускает задачи, у которых подошло время и чья аренда у этого процесса"""
+        now = now if now is not None else datetime.utcnow()
+        for job in list(self.jobs.values()):
+            if self._next_run.get(job.name, now) > now:
+                continue
+            self._next_run[job.name] = now + timedelta(seconds=job.interval)
+            try:
+                if not self.acquire(job.name, ttl=job.interval * 3):
+                    continue
+                job.func()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception('Задача %s завершилась с ошибкой', job.name)
+
+
+scheduler = Scheduler()
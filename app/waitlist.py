@@ -0,0 +1,235 @@
+"""
+Очередь ожидания на занятые слоты (таблица booking_queue).
+
+Порядок в очереди задаёт order_key - время постановки в микросекундах
+(при равенстве - id). Номер позиции не хранится, а считается при чтении:
+1 + число ожидающих раньше с пересекающимся интервалом в той же аудитории
+и дате. Поэтому постановка и удаление меняют ровно одну строку, а между
+соседними ключами остаётся зазор, куда можно вставить запись, не трогая
+остальные.
+
+Очередь сопоставляется по пересечению интервалов (TimeRangeMixin.overlaps),
+а не по точному совпадению начала и конца: освободившийся слот достаётся
+первому ожидающему, чей интервал он задевает и теперь целиком свободен.
+
+Выбранный ожидающий получает удержание слота (status='notified') на
+QUEUE_HOLD_MINUTES: пока оно действует, слот не могут занять другие, а сам
+он подтверждает его бронированием (admission.admit(hold=...)). Истёкшие
+удержания снимает задача expire_queue_holds: индекс (status, hold_expires_at)
+служит ей очередью с приоритетом, поэтому ни таймеров, ни потоков на каждое
+удержание нет. Все изменения удержаний делаются под admission.lock.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, exists, func, or_, select, tuple_
+from sqlalchemy.orm import aliased
+
+from app import db, push
+from app.availability import ACTIVE_STATUSES
+from app.email import send_queue_approved_email, send_queue_notification_email
+from app.models import Booking, BookingQueue, Classroom
+
+logger = logging.getLogger(__name__)
+
+
+def next_order_key():
+    return time.time_ns() // 1000
+
+
+def _ahead_of(entry_alias, other):
+    """Условие: other стоит в очереди раньше entry_alias и претендует на пересекающийся интервал"""
+    return and_(
+        other.classroom_id == entry_alias.classroom_id,
+        other.booking_date == entry_alias.booking_date,
+        other.status == 'waiting',
+        other.overlaps(entry_alias.start_time, entry_alias.end_time),
+        or_(other.order_key < entry_alias.order_key,
+            and_(other.order_key == entry_alias.order_key, other.id < entry_alias.id))
+    )
+
+
+def waiting_count(classroom_id, day, start, end):
+    """Подзапрос: сколько записей ожидают пересекающийся интервал"""
+    return select(func.count(BookingQueue.id)).where(
+        BookingQueue.classroom_id == classroom_id,
+        BookingQueue.booking_date == day,
+        BookingQueue.status == 'waiting',
+        BookingQueue.overlaps(start, end)
+    ).scalar_subquery()
+
+
+def enqueue(user_id, classroom_id, day, start, end):
+    """Ставит пользователя в очередь (одна вставка, без коммита)"""
+    entry = BookingQueue(
+        user_id=user_id,
+        classroom_id=classroom_id,
+        booking_date=day,
+        start_time=start,
+        end_time=end,
+        order_key=next_order_key(),
+        status='waiting'
+    )
+    db.session.add(entry)
+    return entry
+
+
+def positions(entries):
+    """Позиции записей в очереди {id: позиция} одним запросом (None - запись уже не ожидает)"""
+    ids = [entry.id for entry in entries]
+    if not ids:
+        return {}
+    other = aliased(BookingQueue)
+    ahead = select(func.count(other.id)).where(_ahead_of(BookingQueue, other)).scalar_subquery()
+    rows = db.session.query(BookingQueue.id, BookingQueue.status, ahead).filter(BookingQueue.id.in_(ids))
+    return {entry_id: ahead_count + 1 if status == 'waiting' else None for entry_id, status, ahead_count in rows}
+
+
+def _live_hold(entry, now):
+    """Условие: entry - действующее на момент now удержание"""
+    return and_(entry.status == 'notified', entry.hold_expires_at > now)
+
+
+def held_by_other(user_id, classroom_id, day, start, end, now):
+    """Подзапрос: id чужого действующего удержания, пересекающего интервал, или NULL"""
+    return select(BookingQueue.id).where(
+        BookingQueue.classroom_id == classroom_id,
+        BookingQueue.booking_date == day,
+        _live_hold(BookingQueue, now),
+        BookingQueue.overlaps(start, end),
+        BookingQueue.user_id != user_id
+    ).limit(1).scalar_subquery()
+
+
+def live_holds(keys, now):
+    """Действующие удержания по набору (аудитория, дата) одним запросом: {ключ: [(начало, конец, user_id)]}"""
+    holds = {}
+    if not keys:
+        return holds
+    rows = db.session.query(
+        BookingQueue.classroom_id, BookingQueue.booking_date,
+        BookingQueue.start_time, BookingQueue.end_time, BookingQueue.user_id
+    ).filter(
+        tuple_(BookingQueue.classroom_id, BookingQueue.booking_date).in_(keys),
+        _live_hold(BookingQueue, now)
+    )
+    for classroom_id, day, start, end, user_id in rows:
+        holds.setdefault((classroom_id, day), []).append((start, end, user_id))
+    return holds
+
+
+def head(classroom_id, day, start, end, now=None):
+    """
+    Первая ожидающая запись, чей интервал задевает [start, end) и больше
+    ни с каким действующим бронированием или удержанием не пересекается.
+    Один запрос
+    """
+    now = now if now is not None else datetime.now()
+    busy = exists().where(
+        Booking.classroom_id == BookingQueue.classroom_id,
+        Booking.booking_date == BookingQueue.booking_date,
+        Booking.status.in_(ACTIVE_STATUSES),
+        Booking.overlaps(BookingQueue.start_time, BookingQueue.end_time)
+    )
+    other = aliased(BookingQueue)
+    held = exists().where(
+        other.classroom_id == BookingQueue.classroom_id,
+        other.booking_date == BookingQueue.booking_date,
+        _live_hold(other, now),
+        other.overlaps(BookingQueue.start_time, BookingQueue.end_time)
+    )
+    return BookingQueue.query.filter(
+        BookingQueue.classroom_id == classroom_id,
+        BookingQueue.booking_date == day,
+        BookingQueue.status == 'waiting',
+        BookingQueue.overlaps(start, end),
+        ~busy,
+        ~held
+    ).order_by(BookingQueue.order_key, BookingQueue.id).first()
+
+
+def promote(classroom_id, day, start, end, now=None):
+    """
+    Выдаёт удержания ожидающим, которым подходит освободившийся интервал
+    (по одному head за раз, пока такие есть), и возвращает их записи.
+    Вызывать под admission.lock(classroom_id, day)
+    """
+    now = now if now is not None else datetime.now()
+    hold_until = now + timedelta(minutes=current_app.config['QUEUE_HOLD_MINUTES'])
+    promoted = []
+    while True:
+        entry = head(classroom_id, day, start, end, now)
+        if entry is None:
+            return promoted
+        entry.status = 'notified'
+        entry.notified = True
+        entry.hold_expires_at = hold_until
+        # Следующий head должен видеть это удержание
+        db.session.flush()
+        promoted.append(entry)
+
+
+def claim(entry, now):
+    """Превращает действующее удержание в бронирование (status='booked'). False, если оно истекло"""
+    claimed = BookingQueue.query.filter(
+        BookingQueue.id == entry.id,
+        _live_hold(BookingQueue, now)
+    ).update({'status': 'booked'}, synchronize_session='fetch')
+    return claimed == 1
+
+
+def due_holds(now, limit):
+    """Истёкшие на момент now удержания, самые ранние первыми"""
+    return BookingQueue.query.filter(
+        BookingQueue.status == 'notified',
+        BookingQueue.hold_expires_at <= now
+    ).order_by(BookingQueue.hold_expires_at, BookingQueue.id).limit(limit).all()
+
+
+def days_with_waiters(keys):
+    """Какие из пар (аудитория, дата) вообще имеют ожидающих, одним запросом"""
+    if not keys:
+        return set()
+    rows = db.session.query(BookingQueue.classroom_id, BookingQueue.booking_date).filter(
+        tuple_(BookingQueue.classroom_id, BookingQueue.booking_date).in_(list(keys)),
+        BookingQueue.status == 'waiting'
+    ).distinct()
+    return {tuple(row) for row in rows}
+
+
+def notify(entries):
+    """
+    Пишет получившим удержание, что слот свободен (письмо и push в Telegram).
+    Вызывать до коммита (см. app/outbox.py, app/push.py)
+    """
+    for entry in entries:
+        send_queue_approved_email(
+            user_email=entry.user.email,
+            username=entry.user.username,
+            classroom_number=entry.classroom.room_number,
+            booking_date=entry.booking_date.strftime('%d.%m.%Y'),
+            start_time=entry.start_time.strftime('%H:%M'),
+            end_time=entry.end_time.strftime('%H:%M')
+        )
+        push.add(entry.user, (
+            f'Аудитория {entry.classroom.room_number} свободна '
+            f"{entry.booking_date.strftime('%d.%m.%Y')} {entry.start_time.strftime('%H:%M')}-"
+            f"{entry.end_time.strftime('%H:%M')}. Слот удержан за вами до "
+            f"{entry.hold_expires_at.strftime('%H:%M')} - подтвердите бронирование в профиле."
+        ))
+
+
+def notify_queued(entry, user, position):
+    """Пишет пользователю, что он встал в очередь на позицию position. Вызывать до коммита"""
+    classroom = db.session.get(Classroom, entry.classroom_id)
+    send_queue_notification_email(
+        user_email=user.email,
+        username=user.username,
+        classroom_number=classroom.room_number,
+        position=position,
+        booking_date=entry.booking_date.strftime('%d.%m.%Y'),
+        start_time=entry.start_time.strftime('%H:%M'),
+        end_time=entry.end_time.strftime('%H:%M')
+    )
@@ -8,6 +8,21 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # How long (seconds) the in-memory availability index trusts loaded bookings
+    AVAILABILITY_INDEX_TTL = int(os.environ.get('AVAILABILITY_INDEX_TTL', 30))
+
+    # Recurring series are materialized into bookings only this many days ahead
+    RECURRING_HORIZON_DAYS = int(os.environ.get('RECURRING_HORIZON_DAYS', 30))
+
+    # A promoted waiter holds the freed slot this many minutes before it passes to the next one
+    QUEUE_HOLD_MINUTES = int(os.environ.get('QUEUE_HOLD_MINUTES', 60))
+
+    # Telegram reminders go out this many minutes before an approved booking starts
+    BOOKING_REMINDER_MINUTES = int(os.environ.get('BOOKING_REMINDER_MINUTES', 30))
+
+    # Background jobs (auto-completing past bookings etc.); one worker is elected leader via the DB
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'True').lower() in ('true', '1', 'yes')
+
     # Email Configuration (Gmail SMTP)
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
     MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
@@ -15,4 +30,16 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@booking-system.com')
-    ADMINS = os.environ.get('ADMINS', 'admin@booking-system.com').split(',')
\ No newline at end of file
+    ADMINS = os.environ.get('ADMINS', 'admin@booking-system.com').split(',')
+
+    # Outgoing mail is sent by a fixed pool of workers, each reusing one SMTP connection
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS', 2))
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE', 1000))
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 50))
+    # Seconds send_email waits for room in a full queue before dropping the message
+    MAIL_SUBMIT_TIMEOUT = float(os.environ.get('MAIL_SUBMIT_TIMEOUT', 1))
+    # Consecutive SMTP failures that open the circuit breaker, and how long (seconds) it stays open
+    MAIL_BREAKER_THRESHOLD = int(os.environ.get('MAIL_BREAKER_THRESHOLD', 5))
+    MAIL_BREAKER_COOLDOWN = int(os.environ.get('MAIL_BREAKER_COOLDOWN', 30))
+    # Notifications to the same recipient within this many seconds are merged into one digest email
+    EMAIL_DIGEST_WINDOW = int(os.environ.get('EMAIL_DIGEST_WINDOW', 60))
@@ -0,0 +1,39 @@
+"""
+Общая настройка тестов: конфигурация с SQLite в памяти, фикстура app -
+приложение с созданными таблицами - и app_context - его контекст на время
+теста. Файлы тестов, которым нужны свои данные, переопределяют app поверх
+этой.
+
+app сам контекст не держит: запросы тестового клиента внутри уже открытого
+контекста разделили бы с тестом g и сессию базы.
+"""
+
+import pytest
+
+from app import create_app, db
+from config import Config
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+
+
+def make_app(**config):
+    """Приложение на TestingConfig с заменёнными настройками и пустыми таблицами"""
+    app = create_app(type('Config', (TestingConfig,), config))
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def app():
+    return make_app()
+
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context() as context:
+        yield context
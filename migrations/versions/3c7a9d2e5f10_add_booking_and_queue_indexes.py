@@ -0,0 +1,34 @@
+"""Add composite indexes for booking and booking_queue lookups
+
+Revision ID: 3c7a9d2e5f10
+Revises: e1ddf4d01fe6
+Create Date: 2026-10-18 10:12:31.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7a9d2e5f10'
+down_revision = 'e1ddf4d01fe6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.create_index('ix_booking_classroom_date_status', ['classroom_id', 'booking_date', 'status', 'start_time', 'end_time'], unique=False)
+        batch_op.create_index('ix_booking_user_date', ['user_id', 'booking_date'], unique=False)
+
+    with op.batch_alter_table('booking_queue', schema=None) as batch_op:
+        batch_op.create_index('ix_booking_queue_slot', ['classroom_id', 'booking_date', 'start_time', 'end_time', 'status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('booking_queue', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_queue_slot')
+
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_user_date')
+        batch_op.drop_index('ix_booking_classroom_date_status')
@@ -0,0 +1,36 @@
+"""Add template and context to email_outbox for notification digests
+
+Revision ID: 5c2d9a7e1f40
+Revises: 0b6e4f2a9c13
+Create Date: 2026-10-18 21:14:07.318402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2d9a7e1f40'
+down_revision = '0b6e4f2a9c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('template', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('context', sa.Text(), nullable=True))
+        batch_op.alter_column('text_body',
+               existing_type=sa.TEXT(),
+               nullable=True)
+
+
+def downgrade():
+    # Неотправленные уведомления по шаблону без тела письма не пережили бы откат
+    op.execute(sa.text("DELETE FROM email_outbox WHERE text_body IS NULL"))
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.alter_column('text_body',
+               existing_type=sa.TEXT(),
+               nullable=False)
+        batch_op.drop_column('context')
+        batch_op.drop_column('template')
@@ -0,0 +1,37 @@
+"""Add booking_daily_rollup table for admin statistics
+
+Revision ID: 5e2d8a1b9c34
+Revises: 8b41f0c6d2a7
+Create Date: 2026-10-18 15:02:47.650193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2d8a1b9c34'
+down_revision = '8b41f0c6d2a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('booking_daily_rollup',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('classroom_id', sa.Integer(), nullable=False),
+    sa.Column('booking_count', sa.Integer(), nullable=False),
+    sa.Column('booked_minutes', sa.Integer(), nullable=False),
+    sa.Column('pending_count', sa.Integer(), nullable=False),
+    sa.Column('approved_count', sa.Integer(), nullable=False),
+    sa.Column('rejected_count', sa.Integer(), nullable=False),
+    sa.Column('completed_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['classroom_id'], ['classroom.id'], ),
+    sa.PrimaryKeyConstraint('day', 'classroom_id')
+    )
+    # Сводка по уже существующим бронированиям заполняется командой
+    # `flask rollup rebuild`
+
+
+def downgrade():
+    op.drop_table('booking_daily_rollup')
@@ -0,0 +1,65 @@
+"""Add telegram_outbox, user Telegram link columns and booking reminder flag
+
+Revision ID: 66e3a01ccab8
+Revises: 8e4b1f6c2a75
+Create Date: 2026-10-18 20:48:15.166644
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '66e3a01ccab8'
+down_revision = '8e4b1f6c2a75'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('telegram_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('chat_id', sa.BigInteger(), nullable=False),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('claim_token', sa.String(length=32), nullable=True),
+    sa.Column('claimed_until', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('telegram_outbox', schema=None) as batch_op:
+        batch_op.create_index('ix_telegram_outbox_chat', ['chat_id', 'status', 'id'], unique=False)
+        batch_op.create_index('ix_telegram_outbox_claim', ['claim_token'], unique=False)
+        batch_op.create_index('ix_telegram_outbox_due', ['status', 'next_attempt_at'], unique=False)
+
+    # Уже прошедшим и идущим бронированиям напоминать нечего - их отсекает сама задача
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reminder_sent', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('telegram_chat_id', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('telegram_link_code', sa.String(length=16), nullable=True))
+        batch_op.create_index('ix_user_telegram_chat_id', ['telegram_chat_id'], unique=True)
+        batch_op.create_index('ix_user_telegram_link_code', ['telegram_link_code'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_telegram_link_code')
+        batch_op.drop_index('ix_user_telegram_chat_id')
+        batch_op.drop_column('telegram_link_code')
+        batch_op.drop_column('telegram_chat_id')
+
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_column('reminder_sent')
+
+    with op.batch_alter_table('telegram_outbox', schema=None) as batch_op:
+        batch_op.drop_index('ix_telegram_outbox_due')
+        batch_op.drop_index('ix_telegram_outbox_claim')
+        batch_op.drop_index('ix_telegram_outbox_chat')
+
+    op.drop_table('telegram_outbox')
@@ -0,0 +1,33 @@
+"""Add room_occupancy table with per-day slot bitmasks
+
+Revision ID: 8b41f0c6d2a7
+Revises: 3c7a9d2e5f10
+Create Date: 2026-10-18 12:40:05.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41f0c6d2a7'
+down_revision = '3c7a9d2e5f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('room_occupancy',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('classroom_id', sa.Integer(), nullable=False),
+    sa.Column('busy_mask', sa.BigInteger(), nullable=False),
+    sa.Column('approved_mask', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['classroom_id'], ['classroom.id'], ),
+    sa.PrimaryKeyConstraint('day', 'classroom_id')
+    )
+    # Маски для уже существующих бронирований заполняются командой
+    # `flask occupancy rebuild`
+
+
+def downgrade():
+    op.drop_table('room_occupancy')
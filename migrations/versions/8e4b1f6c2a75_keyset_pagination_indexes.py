@@ -0,0 +1,34 @@
+"""Extend user indexes on booking and booking_queue for keyset pagination
+
+Revision ID: 8e4b1f6c2a75
+Revises: 5c2d9a7e1f40
+Create Date: 2026-10-18 21:48:22.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4b1f6c2a75'
+down_revision = '5c2d9a7e1f40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_user_date')
+        batch_op.create_index('ix_booking_user_date', ['user_id', 'booking_date', 'start_time', 'id'], unique=False)
+
+    with op.batch_alter_table('booking_queue', schema=None) as batch_op:
+        batch_op.create_index('ix_booking_queue_user_date', ['user_id', 'booking_date', 'start_time', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('booking_queue', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_queue_user_date')
+
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_user_date')
+        batch_op.create_index('ix_booking_user_date', ['user_id', 'booking_date'], unique=False)
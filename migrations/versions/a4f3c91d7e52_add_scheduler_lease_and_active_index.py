@@ -0,0 +1,36 @@
+"""Add scheduler_lease table and partial index on active bookings
+
+Revision ID: a4f3c91d7e52
+Revises: 5e2d8a1b9c34
+Create Date: 2026-10-18 16:21:09.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4f3c91d7e52'
+down_revision = '5e2d8a1b9c34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('scheduler_lease',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('holder', sa.String(length=128), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.create_index('ix_booking_active_date', ['booking_date'], unique=False,
+                              sqlite_where=sa.text("status IN ('pending', 'approved')"),
+                              postgresql_where=sa.text("status IN ('pending', 'approved')"))
+
+
+def downgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_active_date')
+
+    op.drop_table('scheduler_lease')
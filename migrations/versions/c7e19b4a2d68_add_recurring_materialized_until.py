@@ -0,0 +1,29 @@
+"""Add recurring_booking.materialized_until high-water mark
+
+Revision ID: c7e19b4a2d68
+Revises: a4f3c91d7e52
+Create Date: 2026-10-18 17:05:41.902557
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e19b4a2d68'
+down_revision = 'a4f3c91d7e52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('recurring_booking', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('materialized_until', sa.Date(), nullable=True))
+    # Для существующих серий отметка остаётся пустой: задача
+    # extend_recurring_series создаст недостающие даты, а уже созданные
+    # бронирования будут отброшены проверкой конфликтов
+
+
+def downgrade():
+    with op.batch_alter_table('recurring_booking', schema=None) as batch_op:
+        batch_op.drop_column('materialized_until')
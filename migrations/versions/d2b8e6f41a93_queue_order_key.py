@@ -0,0 +1,40 @@
+"""Replace booking_queue.queue_position with order_key
+
+Revision ID: d2b8e6f41a93
+Revises: c7e19b4a2d68
+Create Date: 2026-10-18 18:22:09.417305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b8e6f41a93'
+down_revision = 'c7e19b4a2d68'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('booking_queue', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('order_key', sa.BigInteger(), nullable=True))
+    # Существующие записи сохраняют порядок постановки: id растёт монотонно
+    # и заведомо меньше ключей новых записей (время в микросекундах)
+    op.execute('UPDATE booking_queue SET order_key = id')
+    with op.batch_alter_table('booking_queue', schema=None) as batch_op:
+        batch_op.alter_column('order_key', existing_type=sa.BigInteger(), nullable=False)
+        batch_op.drop_index('ix_booking_queue_slot')
+        batch_op.drop_column('queue_position')
+        batch_op.create_index('ix_booking_queue_waiting', ['classroom_id', 'booking_date', 'status', 'order_key'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('booking_queue', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_queue_waiting')
+        batch_op.add_column(sa.Column('queue_position', sa.Integer(), nullable=True))
+    op.execute('UPDATE booking_queue SET queue_position = 1')
+    with op.batch_alter_table('booking_queue', schema=None) as batch_op:
+        batch_op.alter_column('queue_position', existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column('order_key')
+        batch_op.create_index('ix_booking_queue_slot', ['classroom_id', 'booking_date', 'start_time', 'end_time', 'status'], unique=False)
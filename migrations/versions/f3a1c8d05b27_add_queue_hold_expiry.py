@@ -0,0 +1,34 @@
+"""Add booking_queue.hold_expires_at for timed slot holds
+
+Revision ID: f3a1c8d05b27
+Revises: d2b8e6f41a93
+Create Date: 2026-10-18 19:10:36.284519
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a1c8d05b27'
+down_revision = 'd2b8e6f41a93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('booking_queue', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('hold_expires_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_booking_queue_hold', ['status', 'hold_expires_at'], unique=False)
+    # Старые уведомления висели без срока: задача expire_queue_holds снимет
+    # их при первом запуске и передаст слоты следующим в очереди
+    op.execute(sa.text("UPDATE booking_queue SET hold_expires_at = :now WHERE status = 'notified'")
+               .bindparams(now=datetime.now()))
+
+
+def downgrade():
+    with op.batch_alter_table('booking_queue', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_queue_hold')
+        batch_op.drop_column('hold_expires_at')
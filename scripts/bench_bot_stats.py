@@ -0,0 +1,87 @@
+"""
+Бенчмарк /stats Telegram-бота: время stats_for_telegram при росте таблицы
+orders. Прежние запросы (COUNT(*) по всей таблице и сортировка для
+последних заказов) сравниваются со счётчиками order_counters и индексом
+ix_orders_created_at.
+
+Запустить: python scripts/bench_bot_stats.py [--sizes 10000 100000 1000000] [--calls 200]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time as timer
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram_bot import db
+
+USERS = 1000
+
+
+def legacy_stats(conn, telegram_id):
+    """Прежние запросы /stats (без счётчиков и индекса по created_at)"""
+    total = conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+    uid = conn.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()[0]
+    user_count = conn.execute('SELECT COUNT(*) FROM orders NOT INDEXED WHERE user_id = ?', (uid,)).fetchone()[0]
+    recent = conn.execute('SELECT o.id, u.username, o.description, o.created_at FROM orders o NOT INDEXED '
+                          'JOIN users u ON o.user_id=u.id ORDER BY o.created_at DESC LIMIT 5').fetchall()
+    return total, user_count, recent
+
+
+def grow(path, count, start):
+    """Добавляет заказы до count штук (триггеры счётчиков срабатывают как обычно)"""
+    began = datetime(2024, 1, 1)
+    with sqlite3.connect(path) as conn:
+        conn.executemany(
+            'INSERT INTO orders (user_id, description, created_at) VALUES (?, ?, ?)',
+            ((i % USERS + 1, f'order {i}', (began + timedelta(seconds=i)).isoformat()) for i in range(start, count))
+        )
+    conn.close()
+
+
+def timed(fn, calls):
+    began = timer.perf_counter()
+    for i in range(calls):
+        fn(i % USERS + 1)
+    return (timer.perf_counter() - began) / calls * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'bot.db'
+        await db.init_db(path)
+        await db.close_db()
+        with sqlite3.connect(path) as conn:
+            conn.executemany('INSERT INTO users (telegram_id, username) VALUES (?, ?)',
+                             ((i, f'user{i}') for i in range(1, USERS + 1)))
+        conn.close()
+
+        conn = sqlite3.connect(path)
+        grown = 0
+        for size in sorted(args.sizes):
+            grow(path, size, grown)
+            grown = size
+            legacy = timed(lambda telegram_id: legacy_stats(conn, telegram_id), max(args.calls // 10, 5))
+
+            await db.init_db(path)
+            began = timer.perf_counter()
+            for i in range(args.calls):
+                await db.stats_for_telegram(i % USERS + 1)
+            current = (timer.perf_counter() - began) / args.calls * 1000
+            await db.close_db()
+            print(f'{size:>9} заказов: прежние запросы {legacy:8.2f} мс, счётчики {current:6.2f} мс на /stats')
+        conn.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
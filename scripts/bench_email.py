@@ -0,0 +1,142 @@
+"""
+Бенчмарк отправки писем на локальный SMTP-сервер (aiosmtpd): прежняя схема
+"поток и новое соединение на каждое письмо" против пула app/mailer.py.
+Считает письма в секунду и число SMTP-соединений.
+
+Требуется: pip install aiosmtpd
+Запустить: python scripts/bench_email.py [--messages 500] [--workers 4] [--delay 0]
+
+--delay имитирует задержку сети на каждую команду SMTP (у локального
+сервера её нет, а стоимость нового соединения - это именно круглые рейсы).
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time as timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiosmtpd.controller import Controller
+from flask_mail import Message
+
+from app import create_app, mail
+from app.mailer import dispatcher
+from config import Config
+
+
+class Sink:
+    """SMTP-сервер, который считает соединения и письма и ничего не хранит"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.connections = 0
+        self.messages = 0
+        self.done = threading.Event()
+        self.expected = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await asyncio.sleep(self.delay)
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        await asyncio.sleep(self.delay)
+        envelope.mail_from = address
+        return '250 OK'
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        await asyncio.sleep(self.delay)
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.delay)
+        self.messages += 1
+        if self.messages >= self.expected:
+            self.done.set()
+        return '250 OK'
+
+    def reset(self, expected):
+        self.connections = 0
+        self.messages = 0
+        self.expected = expected
+        self.done.clear()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def _message(i):
+    return Message(subject=f'bench {i}', recipients=['student@example.com'], body='Тестовое письмо')
+
+
+def thread_per_message(app, count):
+    """Прежняя схема send_email: поток и mail.send (новое соединение) на письмо"""
+    def send(msg):
+        with app.app_context():
+            mail.send(msg)
+
+    for i in range(count):
+        thread = threading.Thread(target=send, args=(_message(i),), daemon=True)
+        thread.start()
+
+
+def pool(app, count):
+    for i in range(count):
+        dispatcher.submit(_message(i))
+
+
+def run(label, app, sink, send, count):
+    sink.reset(count)
+    began = timer.perf_counter()
+    with app.app_context():
+        send(app, count)
+    sink.done.wait(30)
+    elapsed = timer.perf_counter() - began
+    print(f'{label}: {sink.messages} писем за {elapsed:.2f} с, '
+          f'{sink.messages / elapsed:.0f} писем/с, SMTP-соединений: {sink.connections}, '
+          f'потеряно: {count - sink.messages}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--delay', type=float, default=0)
+    args = parser.parse_args()
+
+    sink = Sink(args.delay)
+    port = _free_port()
+    controller = Controller(sink, hostname='localhost', port=port)
+    controller.start()
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        MAIL_SERVER = 'localhost'
+        MAIL_PORT = port
+        MAIL_USE_TLS = False
+        MAIL_USERNAME = None
+        MAIL_PASSWORD = None
+        MAIL_WORKERS = args.workers
+        MAIL_QUEUE_SIZE = args.messages
+        MAIL_SUPPRESS_SEND = False
+
+    app = create_app(BenchConfig)
+    try:
+        print(f'Писем: {args.messages}, задержка SMTP-команды: {args.delay * 1000:.0f} мс')
+        run('Поток на письмо', app, sink, thread_per_message, args.messages)
+        run(f'Пул из {args.workers} потоков', app, sink, pool, args.messages)
+        dispatcher.stop(timeout=5)
+    finally:
+        controller.stop()
+
+
+if __name__ == '__main__':
+    main()
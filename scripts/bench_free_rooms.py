@@ -0,0 +1,101 @@
+"""
+Бенчмарк /api/free_rooms: 500 аудиторий, 10 000 бронирований на день.
+Цель - p99 < 20 мс.
+
+Запустить: python scripts/bench_free_rooms.py [--rooms 500] [--bookings 10000] [--requests 1000]
+"""
+import argparse
+import os
+import random
+import sys
+import time as timer
+from datetime import date, time, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+
+from app import create_app, db, occupancy
+from app.models import User, Classroom, Booking
+from config import Config
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+def seed(rooms, bookings, day):
+    rng = random.Random(1)
+    user = User(username='bench', email='bench@example.com')
+    db.session.add(user)
+    db.session.execute(insert(Classroom), [{
+        'room_number': str(i),
+        'capacity': rng.choice([15, 20, 25, 30, 40, 60, 100]),
+        'floor': rng.randrange(1, 10),
+        'has_projector': rng.random() < 0.5,
+        'has_computers': rng.random() < 0.2,
+        'is_active': True
+    } for i in range(rooms)])
+    db.session.flush()
+
+    rows = []
+    for _ in range(bookings):
+        start = rng.randrange(8, 21)
+        rows.append({
+            'user_id': user.id,
+            'classroom_id': rng.randrange(1, rooms + 1),
+            'booking_date': day,
+            'start_time': time(start, 0),
+            'end_time': time(start + 1, 0),
+            'purpose': 'bench',
+            'status': rng.choice(['pending', 'approved'])
+        })
+    db.session.execute(insert(Booking), rows)
+    occupancy.rebuild()
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=500)
+    parser.add_argument('--bookings', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app(BenchConfig)
+    day = date.today() + timedelta(days=1)
+    rng = random.Random(2)
+
+    with app.app_context():
+        db.create_all()
+        seed(args.rooms, args.bookings, day)
+
+    client = app.test_client()
+    latencies = []
+    found = 0
+    for _ in range(args.requests):
+        start = rng.randrange(8, 21)
+        end = rng.randrange(start + 1, min(start + 4, 22) + 1)
+        params = {
+            'date': day.strftime('%Y-%m-%d'),
+            'start_time': f'{start:02d}:00',
+            'end_time': f'{end:02d}:00',
+            'min_capacity': rng.choice([0, 20, 30, 50])
+        }
+        if rng.random() < 0.3:
+            params['has_projector'] = '1'
+        began = timer.perf_counter()
+        response = client.get('/api/free_rooms', query_string=params)
+        latencies.append((timer.perf_counter() - began) * 1000)
+        found += len(response.get_json()['rooms'])
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f'Аудиторий: {args.rooms}, бронирований: {args.bookings}, запросов: {args.requests}')
+    print(f'В среднем свободно: {found / args.requests:.1f} аудиторий')
+    print(f'p50: {p50:.2f} мс, p99: {p99:.2f} мс ({"OK" if p99 < 20 else "выше цели 20 мс"})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Бенчмарк фоновой задачи extend_recurring_series: несколько тысяч еженедельных
+серий на семестр, первый запуск до горизонта и продление на неделю.
+Цель - несколько секунд на полный проход.
+
+Запустить: python scripts/bench_materializer.py [--series 3000] [--rooms 300] [--batch 500]
+"""
+import argparse
+import os
+import random
+import sys
+import time as timer
+from datetime import date, time, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, insert
+
+from app import create_app, db
+from app.jobs import extend_recurring_series
+from app.models import User, Classroom, Booking, RecurringBooking
+from config import Config
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+def seed(series, rooms, today):
+    rng = random.Random(1)
+    user = User(username='bench', email='bench@example.com', role='teacher')
+    db.session.add(user)
+    db.session.execute(insert(Classroom), [
+        {'room_number': str(i), 'capacity': 30, 'floor': 1, 'is_active': True} for i in range(rooms)
+    ])
+    db.session.flush()
+
+    db.session.execute(insert(RecurringBooking), [{
+        'user_id': user.id,
+        'classroom_id': rng.randrange(1, rooms + 1),
+        'start_date': today,
+        'end_date': today + timedelta(weeks=18),
+        'day_of_week': rng.randrange(0, 5),
+        'start_time': time(start, 0),
+        'end_time': time(start + 2, 0),
+        'purpose': 'lecture',
+        'recurrence_type': rng.choice(['weekly', 'weekly', 'biweekly']),
+        'status': 'active'
+    } for start in (rng.randrange(8, 20) for _ in range(series))])
+    db.session.commit()
+
+
+def run(label, today, batch):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    began = timer.perf_counter()
+    try:
+        created = extend_recurring_series(today=today, batch_size=batch)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    elapsed = timer.perf_counter() - began
+    print(f'{label}: создано {created} бронирований за {elapsed:.2f} с, запросов к БД: {len(statements)}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--series', type=int, default=3000)
+    parser.add_argument('--rooms', type=int, default=300)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+
+    app = create_app(BenchConfig)
+    today = date.today()
+
+    with app.app_context():
+        db.create_all()
+        seed(args.series, args.rooms, today)
+        print(f'Серий: {args.series}, аудиторий: {args.rooms}, размер пачки: {args.batch}')
+        run('Первый запуск', today, args.batch)
+        run('Повторный запуск', today, args.batch)
+        run('Через неделю', today + timedelta(days=7), args.batch)
+        print(f'Всего бронирований: {Booking.query.count()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Бенчмарк базы Telegram-бота: прежняя схема "новое соединение на каждый
+вызов в asyncio.to_thread" против слоя доступа telegram_bot/db.py.
+Имитирует USERS одновременных пользователей, каждый отправляет
+/register, несколько /add, /list и /stats. Печатает сообщения в секунду.
+
+Запустить: python scripts/bench_telegram_db.py [--users 1000] [--adds 5]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time as timer
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram_bot import db
+
+
+class Legacy:
+    """Прежние помощники: соединение открывается и закрывается на каждый вызов"""
+
+    def __init__(self, path):
+        self.path = path
+        conn = sqlite3.connect(path)
+        conn.executescript(db.SCHEMA)
+        conn.close()
+
+    def _conn(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    async def create_user(self, telegram_id, username=None, full_name=None):
+        def _create():
+            conn = self._conn()
+            conn.execute('INSERT OR IGNORE INTO users (telegram_id, username, full_name, created_at) VALUES (?, ?, ?, ?)',
+                         (telegram_id, username, full_name, datetime.utcnow().isoformat()))
+            conn.commit()
+            row = conn.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
+            conn.close()
+            return dict(row)
+        return await asyncio.to_thread(_create)
+
+    async def add_order_for_telegram(self, telegram_id, description):
+        def _add():
+            conn = self._conn()
+            row = conn.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
+            cur = conn.execute('INSERT INTO orders (user_id, description, created_at) VALUES (?, ?, ?)',
+                               (row['id'], description, datetime.utcnow().isoformat()))
+            conn.commit()
+            order = conn.execute('SELECT * FROM orders WHERE id = ?', (cur.lastrowid,)).fetchone()
+            conn.close()
+            return dict(order)
+        return await asyncio.to_thread(_add)
+
+    async def list_orders_for_telegram(self, telegram_id):
+        def _list():
+            conn = self._conn()
+            row = conn.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
+            rows = conn.execute('SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC', (row['id'],)).fetchall()
+            conn.close()
+            return [dict(r) for r in rows]
+        return await asyncio.to_thread(_list)
+
+    async def stats_for_telegram(self, telegram_id):
+        def _stats():
+            conn = self._conn()
+            total = conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+            conn.execute('SELECT o.id FROM orders o JOIN users u ON o.user_id=u.id ORDER BY o.created_at DESC LIMIT 5').fetchall()
+            conn.close()
+            return total
+        return await asyncio.to_thread(_stats)
+
+
+async def user_session(api, telegram_id, adds):
+    await api.create_user(telegram_id, f'user{telegram_id}')
+    for i in range(adds):
+        await api.add_order_for_telegram(telegram_id, f'order {i}')
+    await api.list_orders_for_telegram(telegram_id)
+    await api.stats_for_telegram(telegram_id)
+    return adds + 3
+
+
+async def run(label, api, users, adds):
+    began = timer.perf_counter()
+    messages = sum(await asyncio.gather(*(user_session(api, i, adds) for i in range(users))))
+    elapsed = timer.perf_counter() - began
+    print(f'{label}: {messages} сообщений за {elapsed:.2f} с, {messages / elapsed:.0f} сообщений/с')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--adds', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f'Пользователей: {args.users}, /add на пользователя: {args.adds}')
+        await run('Соединение на вызов', Legacy(Path(tmp) / 'legacy.db'), args.users, args.adds)
+
+        await db.init_db(Path(tmp) / 'bot.db')
+        try:
+            await run('Слой доступа (WAL, пакетные коммиты)', db, args.users, args.adds)
+            print(f'Транзакций записи: {db._db.commits}')
+        finally:
+            await db.close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
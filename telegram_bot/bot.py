@@ -1,12 +1,18 @@
 import asyncio
 import logging
 import os
+import signal
+from datetime import datetime
+
 from dotenv import load_dotenv
-from aiogram import Bot, Dispatcher
+from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 
-from telegram_bot import db
+from app import create_app
+from telegram_bot import db, snapshot, webhook
+from telegram_bot.push import pushes
+from telegram_bot.snapshot import snapshots
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,9 +22,22 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 if not BOT_TOKEN:
     logger.error('BOT_TOKEN not set in environment. Copy .env.example to .env and set BOT_TOKEN.')
 
+# With WEBHOOK_URL set Telegram pushes updates to WEBHOOK_URL + WEBHOOK_PATH (see telegram_bot/webhook.py);
+# otherwise the bot long-polls getUpdates
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', webhook.WEBHOOK_PATH)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT') or os.getenv('PORT') or 8080)
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', webhook.WORKERS))
+
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
+# Orders per /list message; with trimmed descriptions a page stays under Telegram's 4096 chars
+ORDERS_PAGE = 10
+DESCRIPTION_PREVIEW = 300
+
 
 @dp.message(Command(commands=['start']))
 async def cmd_start(message: Message):
@@ -29,7 +48,10 @@ async def cmd_start(message: Message):
         '/add <текст> - добавить заказ\n'
         '/list - список ваших заказов\n'
         '/delete <id> - удалить заказ по id\n'
-        '/stats - статистика'
+        '/stats - статистика\n'
+        '/free 10:00-12:00 [projector] [computers] [мест] [завтра] - свободные аудитории\n'
+        '/room <номер> - занятость аудитории сегодня\n'
+        '/link <код> - получать уведомления сайта бронирования (код - в профиле на сайте)'
     )
 
 
@@ -63,6 +85,27 @@ async def cmd_add(message: Message):
         await message.answer('Ошибка при добавлении заказа.')
 
 
+async def orders_page(telegram_id, after=None):
+    """Text and "next page" keyboard for one page of the user's orders"""
+    orders = await db.list_orders_for_telegram(telegram_id, after=after, limit=ORDERS_PAGE + 1)
+    more = len(orders) > ORDERS_PAGE
+    orders = orders[:ORDERS_PAGE]
+
+    lines = []
+    for o in orders:
+        created = o['created_at'][:19].replace('T', ' ')
+        lines.append(f"{o['id']}. [{created}] {o['description'][:DESCRIPTION_PREVIEW]}")
+
+    markup = None
+    if more:
+        # the cursor is the (created_at, id) of the last order shown; fits the 64-byte callback_data
+        last = orders[-1]
+        markup = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text='Дальше ›', callback_data=f"orders:{last['created_at']}|{last['id']}")
+        ]])
+    return '\n'.join(lines), markup
+
+
 @dp.message(Command(commands=['list']))
 async def cmd_list(message: Message):
     user = await db.get_user_by_telegram_id(message.from_user.id)
@@ -70,17 +113,27 @@ async def cmd_list(message: Message):
         await message.answer('Вы не зарегистрированы. Введите /register чтобы зарегистрироваться.')
         return
 
-    orders = await db.list_orders_for_telegram(message.from_user.id)
-    if not orders:
+    text, markup = await orders_page(message.from_user.id)
+    if not text:
         await message.answer('У вас пока нет заказов.')
         return
 
-    lines = []
-    for o in orders:
-        created = o['created_at'][:19].replace('T', ' ')
-        lines.append(f"{o['id']}. [{created}] {o['description']}")
+    await message.answer(text, reply_markup=markup)
+
 
-    await message.answer('\n'.join(lines))
+@dp.callback_query(F.data.startswith('orders:'))
+async def cb_orders_next(callback: CallbackQuery):
+    created_at, _, order_id = callback.data.partition(':')[2].rpartition('|')
+    # callback_data comes from the client, so a forged or stale button is possible
+    if not created_at or not order_id.isdigit():
+        await callback.answer('Некорректная кнопка, откройте /list заново')
+        return
+    text, markup = await orders_page(callback.from_user.id, after=(created_at, int(order_id)))
+    # the button is spent: drop it so a second tap does not repeat the page
+    await callback.message.edit_reply_markup(reply_markup=None)
+    if text:
+        await callback.message.answer(text, reply_markup=markup)
+    await callback.answer()
 
 
 @dp.message(Command(commands=['delete']))
@@ -107,13 +160,79 @@ async def cmd_stats(message: Message):
     await message.answer(text)
 
 
+# /free and /room answer from the in-memory snapshot only, never from the database
+@dp.message(Command(commands=['free']))
+async def cmd_free(message: Message):
+    current = snapshots.current
+    if current is None:
+        await message.answer('Данные о занятости ещё загружаются, попробуйте через минуту.')
+        return
+    try:
+        query = snapshot.parse_free(message.text.partition(' ')[2], datetime.now())
+    except ValueError as e:
+        await message.answer(f'{e}\nИспользование: /free 10:00-12:00 [projector] [computers] [мест] [завтра]')
+        return
+    await message.answer(snapshot.free_text(current, query))
+
+
+@dp.message(Command(commands=['room']))
+async def cmd_room(message: Message):
+    number = message.text.partition(' ')[2].strip()
+    if not number:
+        await message.answer('Использование: /room <номер аудитории>')
+        return
+    current = snapshots.current
+    if current is None:
+        await message.answer('Данные о занятости ещё загружаются, попробуйте через минуту.')
+        return
+    await message.answer(snapshot.room_text(current, number, datetime.now()))
+
+
+@dp.message(Command(commands=['link']))
+async def cmd_link(message: Message):
+    code = message.text.partition(' ')[2].strip()
+    if not code:
+        await message.answer('Использование: /link <код из профиля на сайте>')
+        return
+    username = await pushes.link(code, message.chat.id)
+    if username is None:
+        await message.answer('Код не найден или уже использован. Получите новый в профиле на сайте.')
+        return
+    await message.answer(f'Готово, {username}! Уведомления об очереди и напоминания о бронированиях будут приходить сюда ✅')
+
+
+async def run_webhook():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    app = webhook.create_app(dp, bot, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, workers=WEBHOOK_WORKERS)
+    # the webhook is left registered on exit: other processes may still be serving it
+    await webhook.serve(app, WEBHOOK_HOST, WEBHOOK_PORT, stop)
+
+
 async def main():
     await db.init_db()
+    app = create_app()
+    await snapshots.start(app)
+    await pushes.start(app, bot)
     try:
-        logger.info('Starting bot...')
-        await dp.start_polling(bot)
+        if WEBHOOK_URL:
+            await run_webhook()
+        else:
+            logger.info('Starting bot...')
+            await dp.start_polling(bot)
     finally:
+        await pushes.stop()
+        await snapshots.stop()
         await bot.session.close()
+        await db.close_db()
 
 
 if __name__ == '__main__':
@@ -1,10 +1,40 @@
+"""
+SQLite access layer for the bot.
+
+All writes go through one writer thread that owns a long-lived connection:
+jobs queued while a transaction is running are committed together (up to
+WRITE_BATCH per commit), each inside its own savepoint so one failing job
+does not roll back the others. Reads run on a small pool of threads, each
+with its own long-lived connection. The database is in WAL mode, so readers
+never wait for the writer, and since connections are not reopened sqlite3
+keeps their prepared statements cached (STATEMENT_CACHE per connection).
+
+/stats reads order counts from order_counters, which triggers on orders keep
+up to date, and the recent list from ix_orders_created_at, so its cost does
+not grow with the number of orders.
+
+init_db() must be awaited before the helpers are used, close_db() commits
+the pending writes and closes the connections.
+"""
+import asyncio
+import queue
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import asyncio
 from pathlib import Path
 
 DB_PATH = Path(__file__).resolve().parents[1] / 'telegram_bot.db'
 
+# Reader threads (one connection each)
+READERS = 4
+
+# Max write jobs committed in one transaction
+WRITE_BATCH = 200
+
+# Prepared statements kept per connection
+STATEMENT_CACHE = 128
+
 SCHEMA = '''
 CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -21,128 +51,236 @@ CREATE TABLE IF NOT EXISTS orders (
     created_at TEXT NOT NULL,
     FOREIGN KEY(user_id) REFERENCES users(id)
 );
+
+CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders (created_at);
+CREATE INDEX IF NOT EXISTS ix_orders_user_created_at ON orders (user_id, created_at);
+
+-- Order counts kept by triggers; user_id = 0 holds the total over all users
+CREATE TABLE IF NOT EXISTS order_counters (
+    user_id INTEGER PRIMARY KEY,
+    orders INTEGER NOT NULL
+);
+
+-- Databases created before the counters existed are counted once
+INSERT OR IGNORE INTO order_counters (user_id, orders) SELECT 0, COUNT(*) FROM orders;
+INSERT OR IGNORE INTO order_counters (user_id, orders) SELECT user_id, COUNT(*) FROM orders GROUP BY user_id;
+
+CREATE TRIGGER IF NOT EXISTS orders_counted AFTER INSERT ON orders
+BEGIN
+    INSERT INTO order_counters (user_id, orders) VALUES (0, 1), (NEW.user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET orders = orders + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS orders_uncounted AFTER DELETE ON orders
+BEGIN
+    UPDATE order_counters SET orders = orders - 1 WHERE user_id IN (0, OLD.user_id);
+END;
 '''
 
+_STOP = object()
+
 
-def _get_conn():
-    conn = sqlite3.connect(DB_PATH)
+def _connect(path):
+    # Transactions are managed explicitly (BEGIN in the writer), reads autocommit
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA busy_timeout = 5000')
     return conn
 
 
-async def init_db():
-    def _init():
-        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-        conn = _get_conn()
-        cur = conn.cursor()
-        cur.executescript(SCHEMA)
-        conn.commit()
+def _resolve(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class Database:
+    """One writer thread with batched commits and a pool of reader connections"""
+
+    def __init__(self, path, readers=READERS, write_batch=WRITE_BATCH):
+        self.path = path
+        self.write_batch = write_batch
+        self.commits = 0
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        conn = _connect(path)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.executescript(SCHEMA)
         conn.close()
 
-    await asyncio.to_thread(_init)
+        self._local = threading.local()
+        self._reader_conns = []
+        self._reader_lock = threading.Lock()
+        self._readers = ThreadPoolExecutor(readers, thread_name_prefix='bot-db-reader')
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name='bot-db-writer', daemon=True)
+        self._writer.start()
+
+    async def read(self, fn):
+        """Runs fn(conn) on a reader connection"""
+        return await asyncio.get_running_loop().run_in_executor(self._readers, self._read, fn)
+
+    async def write(self, fn):
+        """Runs fn(conn) in the writer's transaction and returns once it is committed"""
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put((fn, future))
+        return await future
+
+    def close(self):
+        self._writes.put(_STOP)
+        self._writer.join()
+        self._readers.shutdown(wait=True)
+        with self._reader_lock:
+            for conn in self._reader_conns:
+                conn.close()
+            self._reader_conns = []
+
+    def _read(self, fn):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+            with self._reader_lock:
+                self._reader_conns.append(conn)
+        return fn(conn)
+
+    def _write_loop(self):
+        conn = _connect(self.path)
+        # In WAL mode NORMAL is still safe against application crashes
+        conn.execute('PRAGMA synchronous = NORMAL')
+        running = True
+        while running:
+            batch = [self._writes.get()]
+            while batch[-1] is not _STOP and len(batch) < self.write_batch:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP:
+                batch.pop()
+                running = False
+            if batch:
+                self._commit(conn, batch)
+        conn.close()
+
+    def _commit(self, conn, batch):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for fn, future in batch:
+                conn.execute('SAVEPOINT job')
+                try:
+                    results.append((future, fn(conn), None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO job')
+                    results.append((future, None, e))
+                conn.execute('RELEASE job')
+            conn.execute('COMMIT')
+            self.commits += 1
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            results = [(future, None, e) for fn, future in batch]
+        for future, result, error in results:
+            future.get_loop().call_soon_threadsafe(_resolve, future, result, error)
+
+
+_db = None
+
+
+def _database():
+    if _db is None:
+        raise RuntimeError('Database is not initialised, await init_db() first')
+    return _db
+
+
+async def init_db(path=None):
+    global _db
+    if _db is None:
+        _db = await asyncio.to_thread(Database, path or DB_PATH)
+
+
+async def close_db():
+    global _db
+    if _db is not None:
+        db, _db = _db, None
+        await asyncio.to_thread(db.close)
 
 
 # User helpers
 async def get_user_by_telegram_id(telegram_id):
-    def _get():
-        conn = _get_conn()
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
-        row = cur.fetchone()
-        conn.close()
+    def _get(conn):
+        row = conn.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
         return dict(row) if row else None
-    return await asyncio.to_thread(_get)
+    return await _database().read(_get)
 
 
 async def create_user(telegram_id, username=None, full_name=None):
-    def _create():
-        conn = _get_conn()
-        cur = conn.cursor()
+    def _create(conn):
         now = datetime.utcnow().isoformat()
-        cur.execute('INSERT OR IGNORE INTO users (telegram_id, username, full_name, created_at) VALUES (?, ?, ?, ?)',
-                    (telegram_id, username, full_name, now))
-        conn.commit()
-        cur.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
-        row = cur.fetchone()
-        conn.close()
+        conn.execute('INSERT OR IGNORE INTO users (telegram_id, username, full_name, created_at) VALUES (?, ?, ?, ?)',
+                     (telegram_id, username, full_name, now))
+        row = conn.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
         return dict(row) if row else None
-    return await asyncio.to_thread(_create)
+    return await _database().write(_create)
 
 
 # Orders
 async def add_order_for_telegram(telegram_id, description):
-    def _add():
-        conn = _get_conn()
-        cur = conn.cursor()
+    def _add(conn):
         # ensure user exists
-        cur.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
-        row = cur.fetchone()
+        row = conn.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
         if not row:
-            conn.close()
             return None
-        user_id = row['id']
         now = datetime.utcnow().isoformat()
-        cur.execute('INSERT INTO orders (user_id, description, created_at) VALUES (?, ?, ?)', (user_id, description, now))
-        conn.commit()
-        order_id = cur.lastrowid
-        cur.execute('SELECT * FROM orders WHERE id = ?', (order_id,))
-        order = cur.fetchone()
-        conn.close()
-        return dict(order)
-    return await asyncio.to_thread(_add)
+        cur = conn.execute('INSERT INTO orders (user_id, description, created_at) VALUES (?, ?, ?)',
+                           (row['id'], description, now))
+        return {'id': cur.lastrowid, 'user_id': row['id'], 'description': description, 'created_at': now}
+    return await _database().write(_add)
 
 
-async def list_orders_for_telegram(telegram_id):
-    def _list():
-        conn = _get_conn()
-        cur = conn.cursor()
-        cur.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
-        row = cur.fetchone()
+async def list_orders_for_telegram(telegram_id, after=None, limit=None):
+    """Orders newest first. after=(created_at, id) of the last order already shown (keyset paging)"""
+    def _list(conn):
+        row = conn.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
         if not row:
-            conn.close()
             return []
-        user_id = row['id']
-        cur.execute('SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
-        rows = cur.fetchall()
-        conn.close()
-        return [dict(r) for r in rows]
-    return await asyncio.to_thread(_list)
+        sql, params = 'SELECT * FROM orders WHERE user_id = ?', [row['id']]
+        if after:
+            # seeks in ix_orders_user_created_at instead of skipping shown rows
+            sql += ' AND (created_at, id) < (?, ?)'
+            params += list(after)
+        sql += ' ORDER BY created_at DESC, id DESC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+    return await _database().read(_list)
 
 
 async def delete_order_for_telegram(telegram_id, order_id):
-    def _delete():
-        conn = _get_conn()
-        cur = conn.cursor()
+    def _delete(conn):
         # verify ownership
-        cur.execute('SELECT o.id FROM orders o JOIN users u ON o.user_id = u.id WHERE o.id = ? AND u.telegram_id = ?', (order_id, telegram_id))
+        cur = conn.execute('SELECT o.id FROM orders o JOIN users u ON o.user_id = u.id WHERE o.id = ? AND u.telegram_id = ?', (order_id, telegram_id))
         if not cur.fetchone():
-            conn.close()
             return False
-        cur.execute('DELETE FROM orders WHERE id = ?', (order_id,))
-        conn.commit()
-        conn.close()
+        conn.execute('DELETE FROM orders WHERE id = ?', (order_id,))
         return True
-    return await asyncio.to_thread(_delete)
+    return await _database().write(_delete)
 
 
 async def stats_for_telegram(telegram_id):
-    def _stats():
-        conn = _get_conn()
-        cur = conn.cursor()
-        # total orders
-        cur.execute('SELECT COUNT(*) AS cnt FROM orders')
-        total = cur.fetchone()['cnt']
-        # user orders
-        cur.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
-        row = cur.fetchone()
-        user_count = 0
-        if row:
-            uid = row['id']
-            cur.execute('SELECT COUNT(*) AS cnt FROM orders WHERE user_id = ?', (uid,))
-            user_count = cur.fetchone()['cnt']
-        # recent orders sample
-        cur.execute('SELECT o.id, u.username, o.description, o.created_at FROM orders o JOIN users u ON o.user_id=u.id ORDER BY o.created_at DESC LIMIT 5')
+    def _stats(conn):
+        # counters are maintained by triggers, so both lookups are by primary key
+        row = conn.execute('SELECT orders FROM order_counters WHERE user_id = 0').fetchone()
+        total = row['orders'] if row else 0
+        row = conn.execute('SELECT c.orders FROM users u JOIN order_counters c ON c.user_id = u.id WHERE u.telegram_id = ?',
+                           (telegram_id,)).fetchone()
+        user_count = row['orders'] if row else 0
+        # recent orders sample: backwards scan of ix_orders_created_at
+        cur = conn.execute('SELECT o.id, u.username, o.description, o.created_at FROM orders o JOIN users u ON o.user_id=u.id ORDER BY o.created_at DESC LIMIT 5')
         recent = [dict(r) for r in cur.fetchall()]
-        conn.close()
         return {'total_orders': total, 'user_orders': user_count, 'recent': recent}
-    return await asyncio.to_thread(_stats)
+    return await _database().read(_stats)
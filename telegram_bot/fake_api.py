@@ -0,0 +1,140 @@
+"""
+Local stand-in for the Telegram Bot API, for tests and benchmarks.
+
+Serves /bot<token>/<method> like api.telegram.org, so a real aiogram Bot
+talks to it through TelegramAPIServer.from_base(server.url). sendMessage
+calls are recorded in order and checked against Telegram's limits: more
+than global_rate messages in one second, or two messages to one chat
+closer than chat_interval, are answered with 429 and retry_after, as
+Telegram does. Chats in `blocked` get 403. getUpdates hands out the
+updates put into `updates`.
+
+    async with FakeBotAPI() as api:
+        bot = Bot('42:TEST', session=AiohttpSession(api=TelegramAPIServer.from_base(api.url)))
+"""
+import asyncio
+import time
+from collections import deque
+
+from aiohttp import web
+
+# Allowed slack when checking the per-chat interval (client and server clocks differ by the request latency)
+INTERVAL_SLACK = 0.02
+
+
+class FakeBotAPI:
+
+    def __init__(self, global_rate=30, chat_interval=1.0, latency=0.0):
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.latency = latency
+        # (monotonic time, chat id, text) of every accepted sendMessage
+        self.sent = []
+        self.rejected = 0
+        self.blocked = set()
+        # the next `floods` sendMessage calls get 429 whatever the rate
+        self.floods = 0
+        self.flood_retry_after = 1
+        self.updates = []
+        self.url = None
+        self._window = deque()
+        self._last_by_chat = {}
+        self._new_updates = asyncio.Event()
+        self._runner = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        app.router.add_get('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}'
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def add_update(self, update):
+        """Queues an update (a dict in Bot API form) for getUpdates"""
+        self.updates.append(update)
+        self._new_updates.set()
+
+    async def _handle(self, request):
+        params = dict(await request.post())
+        params.update(request.query)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        handler = getattr(self, '_' + request.match_info['method'].lower(), None)
+        if handler is None:
+            return self._error(404, 'Not Found: method not found')
+        return await handler(params)
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({'ok': True, 'result': result})
+
+    @staticmethod
+    def _error(code, description, retry_after=None):
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if retry_after is not None:
+            body['parameters'] = {'retry_after': retry_after}
+        return web.json_response(body, status=code)
+
+    async def _getme(self, params):
+        return self._ok({'id': 42, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'})
+
+    async def _sendmessage(self, params):
+        chat_id = int(params['chat_id'])
+        now = time.monotonic()
+        if chat_id in self.blocked:
+            return self._error(403, 'Forbidden: bot was blocked by the user')
+        if self.floods:
+            self.floods -= 1
+            self.rejected += 1
+            return self._error(429, 'Too Many Requests: retry after', self.flood_retry_after)
+
+        while self._window and self._window[0] <= now - 1:
+            self._window.popleft()
+        last = self._last_by_chat.get(chat_id)
+        if len(self._window) >= self.global_rate or (
+                last is not None and now - last < self.chat_interval - INTERVAL_SLACK):
+            self.rejected += 1
+            return self._error(429, 'Too Many Requests: retry after', 1)
+
+        self._window.append(now)
+        self._last_by_chat[chat_id] = now
+        self.sent.append((now, chat_id, params.get('text')))
+        return self._ok({
+            'message_id': len(self.sent), 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text'),
+        })
+
+    async def _getupdates(self, params):
+        offset = int(params.get('offset') or 0)
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates and float(params.get('timeout') or 0):
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params['timeout']))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit') or 100)
+        return self._ok(self.updates[:limit])
+
+    async def _deletewebhook(self, params):
+        return self._ok(True)
+
+    async def _setwebhook(self, params):
+        return self._ok(True)
+
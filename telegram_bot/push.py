@@ -0,0 +1,185 @@
+"""
+Sends the web app's Telegram notifications (app/push.py, table telegram_outbox).
+
+The sender claims a batch of due messages, sends them concurrently and
+records the outcomes in one transaction. Bot API limits are respected on
+the client side:
+
+* a token bucket caps the whole bot at GLOBAL_RATE messages per second
+  (Telegram allows about 30);
+* messages to one chat go one after another, at least CHAT_INTERVAL
+  seconds apart, in the order they were queued;
+* at most CONCURRENCY requests are in flight.
+
+A 429 answer pauses the bucket for the retry_after Telegram asks for, and
+the message is retried; after RETRY_AFTER_LIMIT such answers in a row it is
+left to the outbox backoff instead. When a message to a chat fails, the
+rest of that chat's batch is released unsent so the order is kept.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from app import db, push
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE = 25
+CHAT_INTERVAL = 1.0
+CONCURRENCY = 10
+
+# 429 answers for one message before it goes back to the outbox with a backoff
+RETRY_AFTER_LIMIT = 5
+
+# Seconds between outbox polls when there is nothing to send
+POLL_SECONDS = 1
+
+
+class TokenBucket:
+    """
+    Allows rate acquisitions per second on average, in bursts of up to
+    capacity. Any one-second window sees at most rate + capacity of them, so
+    the default capacity of 1 keeps a sliding-window limit like Telegram's
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Nothing is acquired for the next seconds, and the burst starts empty after that"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+
+
+class PushSender:
+    """Drains telegram_outbox through a bot; needs the web app for database access"""
+
+    def __init__(self, rate=GLOBAL_RATE, chat_interval=CHAT_INTERVAL, concurrency=CONCURRENCY,
+                 batch_size=push.BATCH_SIZE):
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.app = None
+        # chat id -> monotonic time of the last request to it
+        self._last_sent = {}
+        self._semaphore = None
+        self._stopping = None
+        self._task = None
+
+    def _call(self, fn, *args):
+        with self.app.app_context():
+            try:
+                return fn(*args)
+            finally:
+                db.session.remove()
+
+    async def link(self, code, chat_id):
+        """Binds chat_id to the site user holding code (see /telegram_link). Their username or None"""
+        def link_username():
+            user = push.link(code, chat_id)
+            return user.username if user is not None else None
+        return await asyncio.to_thread(self._call, link_username)
+
+    async def run_once(self, bot):
+        """Sends one claimed batch. Returns the number of messages claimed"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        batch = await asyncio.to_thread(self._call, push.claim, self.batch_size)
+        if not batch:
+            return 0
+
+        chats = defaultdict(list)
+        for item in batch:
+            chats[item.chat_id].append(item)
+        results = {}
+        await asyncio.gather(*(self._send_chat(bot, items, results) for items in chats.values()))
+        await asyncio.to_thread(self._call, push.record, results)
+
+        # chats idle for longer than the interval need no pacing any more
+        horizon = time.monotonic() - self.chat_interval
+        self._last_sent = {chat: sent for chat, sent in self._last_sent.items() if sent > horizon}
+        return len(batch)
+
+    async def _send_chat(self, bot, items, results):
+        for position, item in enumerate(items):
+            results[item.id] = await self._send(bot, item)
+            if results[item.id][0] == push.RETRY:
+                for rest in items[position + 1:]:
+                    results[rest.id] = (push.RELEASED, None)
+                return
+
+    async def _send(self, bot, item):
+        for _ in range(RETRY_AFTER_LIMIT):
+            wait = self._last_sent.get(item.chat_id, float('-inf')) + self.chat_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.bucket.acquire()
+            async with self._semaphore:
+                try:
+                    await bot.send_message(item.chat_id, item.text)
+                    return push.SENT, None
+                except TelegramRetryAfter as e:
+                    logger.warning('Telegram asked to wait %s s', e.retry_after)
+                    self.bucket.pause(e.retry_after)
+                except (TelegramForbiddenError, TelegramBadRequest) as e:
+                    # blocked by the user, chat gone, bad text: retrying will not help
+                    return push.FAILED, str(e)
+                except Exception as e:
+                    logger.warning('Failed to send push %s: %s', item.id, e)
+                    return push.RETRY, str(e)
+                finally:
+                    self._last_sent[item.chat_id] = time.monotonic()
+        return push.RETRY, 'Too many 429 answers'
+
+    async def run(self, bot, interval=POLL_SECONDS):
+        if self._stopping is None:
+            self._stopping = asyncio.Event()
+        while not self._stopping.is_set():
+            try:
+                claimed = await self.run_once(bot)
+            except Exception:
+                logger.exception('Push batch failed')
+                claimed = 0
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def start(self, app, bot):
+        self.app = app
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self.run(bot))
+
+    async def stop(self):
+        """Lets the batch in flight finish and be recorded, so nothing is sent twice"""
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+            self._stopping = None
+
+
+pushes = PushSender()
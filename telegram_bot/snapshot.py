@@ -0,0 +1,210 @@
+"""
+In-memory occupancy snapshot behind the bot's /free and /room commands.
+
+A snapshot holds the active classrooms and their busy slot masks
+(app/occupancy.py: 15-minute slots, 08:00-22:00) for SNAPSHOT_DAYS days from
+today. It is built by one query (classroom LEFT JOIN room_occupancy over the
+date range) every REFRESH_SECONDS and published by replacing a single
+reference. A snapshot is never modified after it is built, so handlers read
+it without locks and without touching the database; answers may lag behind
+the site by up to REFRESH_SECONDS.
+"""
+import asyncio
+import logging
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from types import MappingProxyType
+
+from app import db
+from app.models import Classroom, RoomOccupancy
+from app.occupancy import DAY_END, DAY_START, SLOT_MINUTES, SLOTS_PER_DAY, slot_at, slot_mask
+
+logger = logging.getLogger(__name__)
+
+# Days covered by a snapshot, starting today
+SNAPSHOT_DAYS = 7
+
+REFRESH_SECONDS = 30
+
+# Rooms listed in one /free answer
+FREE_ROOMS_SHOWN = 20
+
+Room = namedtuple('Room', ['id', 'number', 'capacity', 'floor', 'has_projector', 'has_computers'])
+
+# rooms are ordered by (capacity, number) like /api/free_rooms; busy maps (day, room id) -> mask
+Snapshot = namedtuple('Snapshot', ['built_at', 'first_day', 'days', 'rooms', 'by_number', 'busy'])
+
+FreeQuery = namedtuple('FreeQuery', ['day', 'start', 'end', 'min_capacity', 'has_projector', 'has_computers'])
+
+
+def build(now=None, days=SNAPSHOT_DAYS):
+    """Reads classrooms and occupancy masks with one query. Needs an app context"""
+    now = now or datetime.now()
+    first_day = now.date()
+    rows = db.session.query(
+        Classroom.id, Classroom.room_number, Classroom.capacity, Classroom.floor,
+        Classroom.has_projector, Classroom.has_computers, RoomOccupancy.day, RoomOccupancy.busy_mask
+    ).outerjoin(
+        RoomOccupancy,
+        (RoomOccupancy.classroom_id == Classroom.id)
+        & RoomOccupancy.day.between(first_day, first_day + timedelta(days=days - 1))
+    ).filter(Classroom.is_active == True).all()
+
+    rooms, busy = {}, {}
+    for room_id, number, capacity, floor, projector, computers, day, mask in rows:
+        rooms[room_id] = Room(room_id, number, capacity, floor, bool(projector), bool(computers))
+        if day is not None and mask:
+            busy[(day, room_id)] = mask
+    ordered = tuple(sorted(rooms.values(), key=lambda room: (room.capacity, room.number)))
+    return Snapshot(now, first_day, days, ordered,
+                    MappingProxyType({room.number: room for room in ordered}), MappingProxyType(busy))
+
+
+def covers(snapshot, day):
+    return snapshot.first_day <= day < snapshot.first_day + timedelta(days=snapshot.days)
+
+
+def free_rooms(snapshot, query):
+    """Rooms free for the whole interval of query"""
+    mask = slot_mask(query.start, query.end)
+    return [
+        room for room in snapshot.rooms
+        if not snapshot.busy.get((query.day, room.id), 0) & mask
+        and room.capacity >= query.min_capacity
+        and (room.has_projector or not query.has_projector)
+        and (room.has_computers or not query.has_computers)
+    ]
+
+
+def busy_intervals(mask):
+    """[(start, end)] of the busy runs in a slot mask"""
+    intervals, slot = [], 0
+    while slot < SLOTS_PER_DAY:
+        if not mask >> slot & 1:
+            slot += 1
+            continue
+        run = slot
+        while slot < SLOTS_PER_DAY and mask >> slot & 1:
+            slot += 1
+        intervals.append((_slot_time(run), _slot_time(slot)))
+    return intervals
+
+
+def _slot_time(slot):
+    return (datetime.combine(date.min, DAY_START) + timedelta(minutes=slot * SLOT_MINUTES)).time()
+
+
+def parse_free(args, now):
+    """
+    FreeQuery from the /free arguments, e.g. "10:00-12:00 projector 30 завтра".
+    Without an interval the current hour is used. ValueError on bad input
+    """
+    day, start, end = now.date(), None, None
+    min_capacity, projector, computers = 0, False, False
+    for token in args.split():
+        word = token.lower()
+        if '-' in token and ':' in token:
+            first, _, last = token.partition('-')
+            start, end = (datetime.strptime(part, '%H:%M').time() for part in (first, last))
+        elif word in ('projector', 'проектор'):
+            projector = True
+        elif word in ('computers', 'компьютеры', 'pc'):
+            computers = True
+        elif word in ('tomorrow', 'завтра'):
+            day += timedelta(days=1)
+        elif word in ('today', 'сегодня'):
+            pass
+        elif token.isdigit():
+            min_capacity = int(token)
+        else:
+            raise ValueError(f'Непонятный параметр: {token}')
+
+    if start is None:
+        if not slot_at(now.time()):
+            raise ValueError('Сейчас нерабочее время, укажите интервал')
+        minutes = now.minute - now.minute % SLOT_MINUTES
+        start = now.time().replace(minute=minutes, second=0, microsecond=0)
+        end = min(DAY_END, (datetime.combine(day, start) + timedelta(hours=1)).time())
+    if start >= end:
+        raise ValueError('Время окончания должно быть позже времени начала')
+    if start < DAY_START or end > DAY_END:
+        raise ValueError('Интервал должен быть в пределах рабочего дня 08:00-22:00')
+    return FreeQuery(day, start, end, min_capacity, projector, computers)
+
+
+def _room_line(room):
+    extras = [label for flag, label in ((room.has_projector, 'проектор'), (room.has_computers, 'компьютеры')) if flag]
+    return f"{room.number} — {room.capacity} мест, {room.floor} этаж" + ''.join(f', {extra}' for extra in extras)
+
+
+def _footer(snapshot):
+    return f"\n\nДанные на {snapshot.built_at.strftime('%H:%M:%S')}"
+
+
+def free_text(snapshot, query):
+    """Answer to /free"""
+    if not covers(snapshot, query.day):
+        return 'Можно спросить только про ближайшие дни.'
+    rooms = free_rooms(snapshot, query)
+    header = (f"Свободные аудитории {query.day.strftime('%d.%m')} "
+              f"{query.start.strftime('%H:%M')}-{query.end.strftime('%H:%M')}")
+    if not rooms:
+        return f'{header}: нет.' + _footer(snapshot)
+    lines = [_room_line(room) for room in rooms[:FREE_ROOMS_SHOWN]]
+    if len(rooms) > FREE_ROOMS_SHOWN:
+        lines.append(f'…и ещё {len(rooms) - FREE_ROOMS_SHOWN}')
+    return f'{header} ({len(rooms)}):\n' + '\n'.join(lines) + _footer(snapshot)
+
+
+def room_text(snapshot, number, now):
+    """Answer to /room: today's busy intervals and whether the room is free now"""
+    room = snapshot.by_number.get(number)
+    if room is None:
+        return f'Аудитория {number} не найдена.'
+    mask = snapshot.busy.get((now.date(), room.id), 0)
+    lines = [_room_line(room)]
+    if slot_at(now.time()):
+        lines.append('Сейчас занята' if mask & slot_at(now.time()) else 'Сейчас свободна')
+    intervals = busy_intervals(mask)
+    if intervals:
+        lines.append('Занята сегодня:')
+        lines += [f"  {start.strftime('%H:%M')}-{end.strftime('%H:%M')}" for start, end in intervals]
+    else:
+        lines.append('Сегодня весь день свободна')
+    return '\n'.join(lines) + _footer(snapshot)
+
+
+class SnapshotStore:
+    """Holds the current snapshot and rebuilds it on a timer"""
+
+    def __init__(self):
+        self.current = None
+        self._task = None
+
+    def refresh(self, app):
+        with app.app_context():
+            try:
+                self.current = build()
+            finally:
+                db.session.remove()
+
+    async def start(self, app, interval=REFRESH_SECONDS):
+        await asyncio.to_thread(self.refresh, app)
+        self._task = asyncio.create_task(self._run(app, interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, app, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.refresh, app)
+            except Exception:
+                # the previous snapshot keeps serving until the next attempt
+                logger.exception('Failed to rebuild the occupancy snapshot')
+
+
+snapshots = SnapshotStore()
@@ -0,0 +1,177 @@
+"""
+Webhook mode: Telegram POSTs updates to an aiohttp server instead of the bot
+long-polling getUpdates.
+
+The request handler only validates the update and hands it to an
+UpdateWorkers pool, then answers 200 at once. The pool runs up to `workers`
+handlers concurrently, but never two updates of one chat at the same time:
+each chat has its own FIFO, and a chat waits in the ready queue while a
+worker is busy with it, so a slow chat does not hold up the others and
+updates of one chat are handled in the order they arrived. At most
+`queue_size` updates are accepted and not yet handled; past that the
+request handler waits, which slows Telegram down.
+
+On shutdown the server stops accepting updates (503, which Telegram
+retries later) and waits for everything accepted to be handled.
+
+Order is kept for updates in the order this process receives them.
+Telegram may deliver over several connections at once (setWebhook
+max_connections), and processes behind a load balancer each see part of
+a chat's updates; strict order across processes needs max_connections=1
+or routing by chat.
+"""
+import asyncio
+import hmac
+import logging
+from collections import deque
+
+from aiogram.types import Update
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = '/telegram/webhook'
+WORKERS = 16
+QUEUE_SIZE = 1000
+
+# The app's UpdateWorkers, for stats and tests
+WORKERS_KEY = web.AppKey('workers', 'UpdateWorkers')
+
+# Header Telegram sends with the secret_token given to setWebhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def chat_key(update):
+    """The chat an update belongs to (or its user, or the update itself if neither)"""
+    try:
+        event = update.event
+    except Exception:
+        return ('update', update.update_id)
+    chat = getattr(event, 'chat', None) or getattr(getattr(event, 'message', None), 'chat', None)
+    if chat is not None:
+        return ('chat', chat.id)
+    user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+    if user is not None:
+        return ('user', user.id)
+    return ('update', update.update_id)
+
+
+class UpdateWorkers:
+    """Feeds updates to a dispatcher from a fixed pool of tasks, in order per chat"""
+
+    def __init__(self, dispatcher, bot, workers=WORKERS, queue_size=QUEUE_SIZE, **kwargs):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.workers = workers
+        self.queue_size = queue_size
+        # extra keyword arguments for the handlers, as with dp.start_polling(bot, **kwargs)
+        self.kwargs = kwargs
+        self.handled = 0
+        self.closed = False
+        # chat key -> its updates not yet handled; a key is in _ready at most once
+        self._pending = {}
+        self._unfinished = 0
+        self._ready = None
+        self._slots = None
+        self._idle = None
+        self._tasks = []
+
+    def start(self):
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.queue_size)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def submit(self, update):
+        """Queues update. False once the pool is closed: the caller should answer 503"""
+        if self.closed:
+            return False
+        self._unfinished += 1
+        self._idle.clear()
+        await self._slots.acquire()
+        key = chat_key(update)
+        if key in self._pending:
+            self._pending[key].append(update)
+        else:
+            self._pending[key] = deque([update])
+            self._ready.put_nowait(key)
+        return True
+
+    async def _work(self):
+        while True:
+            key = await self._ready.get()
+            updates = self._pending[key]
+            try:
+                await self.dispatcher.feed_update(self.bot, updates[0], **self.kwargs)
+            except Exception:
+                logger.exception('Failed to handle update %s', updates[0].update_id)
+            finally:
+                updates.popleft()
+                self.handled += 1
+                self._slots.release()
+                # the chat goes to the back of the queue, so one busy chat cannot starve the rest
+                if updates:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+                self._unfinished -= 1
+                if not self._unfinished:
+                    self._idle.set()
+
+    async def drain(self):
+        """Refuses new updates, waits until every accepted one is handled and stops the workers"""
+        self.closed = True
+        if self._idle is not None:
+            await self._idle.wait()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def create_app(dispatcher, bot, path=WEBHOOK_PATH, secret=None, workers=WORKERS, queue_size=QUEUE_SIZE,
+               **kwargs):
+    """aiohttp application serving the webhook at path; the pool starts and drains with it"""
+    pool = UpdateWorkers(dispatcher, bot, workers, queue_size, **kwargs)
+
+    async def receive(request):
+        if pool.closed:
+            return web.Response(status=503)
+        if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), secret):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': bot})
+        except ValueError:
+            return web.Response(status=400)
+        if not await pool.submit(update):
+            return web.Response(status=503)
+        return web.Response()
+
+    async def on_startup(app):
+        pool.start()
+
+    async def on_shutdown(app):
+        await pool.drain()
+        logger.info('Webhook stopped after handling %s updates', pool.handled)
+
+    app = web.Application()
+    app[WORKERS_KEY] = pool
+    app.router.add_post(path, receive)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+async def serve(app, host, port, stop):
+    """Serves app until the stop event is set, then shuts it down gracefully"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info('Webhook listening on %s:%s', host, port)
+    try:
+        await stop.wait()
+    finally:
+        # stops listening, runs on_shutdown (drains the pool), then closes connections
+        await runner.cleanup()
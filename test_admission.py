@@ -0,0 +1,119 @@
+"""
+Допуск бронирований: типизированный результат и отсутствие двойного
+бронирования при одновременных заявках на один слот.
+
+Стресс-тест использует файловую SQLite-базу (in-memory база в тестах
+разделяет одно соединение между потоками и не проверяет блокировки).
+Запустить: python -m pytest test_admission.py
+"""
+
+import threading
+import time as timer
+from datetime import date, time, timedelta
+
+import pytest
+
+from app import db, admission
+from app.models import User, Classroom, Booking, BookingQueue
+from conftest import make_app
+
+DAY = date.today() + timedelta(days=2)
+THREADS = 16
+
+
+def _seed():
+    db.session.add_all([Classroom(room_number=str(100 + i), capacity=30, floor=1) for i in range(2)])
+    db.session.add(User(username='teacher', email='teacher@example.com', role='teacher'))
+    db.session.add_all([
+        User(username=f'student{i}', email=f'student{i}@example.com', role='student') for i in range(THREADS)
+    ])
+    db.session.commit()
+
+
+@pytest.fixture
+def app(app):
+    with app.app_context():
+        _seed()
+    return app
+
+
+def test_admission_results(app):
+    with app.app_context():
+        teacher = User.query.filter_by(username='teacher').one()
+        student = User.query.filter_by(username='student0').one()
+
+        result = admission.admit(teacher, 1, DAY, time(10, 0), time(12, 0), 'lecture')
+        assert result.status == admission.OK
+        assert result.booking.status == 'approved'
+
+        # Занятая аудитория: без очереди - конфликт, с очередью - позиция
+        result = admission.admit(student, 1, DAY, time(11, 0), time(12, 0), 'study', enqueue=False)
+        assert result.status == admission.ROOM_CONFLICT
+        assert result.conflict_id == Booking.query.first().id
+        result = admission.admit(student, 1, DAY, time(11, 0), time(12, 0), 'study')
+        assert result.status == admission.QUEUED
+        assert result.position == 1
+
+        # Пересечение с собственным бронированием в другой аудитории
+        result = admission.admit(teacher, 2, DAY, time(11, 0), time(13, 0), 'seminar')
+        assert result.status == admission.USER_CONFLICT
+
+        # Дневная квота студента
+        assert admission.admit(student, 2, DAY, time(8, 0), time(9, 0), 'a').status == admission.OK
+        assert admission.admit(student, 2, DAY, time(9, 0), time(10, 0), 'b').status == admission.OK
+        assert admission.admit(student, 2, DAY, time(14, 0), time(15, 0), 'c').status == admission.QUOTA
+        assert Booking.query.count() == 3
+        assert BookingQueue.query.count() == 1
+
+
+def test_concurrent_submissions_have_exactly_one_winner(tmp_path):
+    app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'stress.db'))
+    with app.app_context():
+        _seed()
+    barrier = threading.Barrier(THREADS)
+    results = []
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def submit(i):
+        with app.app_context():
+            user = User.query.filter_by(username=f'student{i}').one()
+            # Возвращаем соединение в пул, чтобы потоки не исчерпали его до старта
+            db.session.close()
+            barrier.wait()
+            began = timer.perf_counter()
+            try:
+                result = admission.admit(user, 1, DAY, time(10, 0), time(12, 0), 'stress', enqueue=False)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                return
+            finally:
+                db.session.remove()
+            with lock:
+                results.append(result.status)
+                latencies.append(timer.perf_counter() - began)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors, errors
+    assert results.count(admission.OK) == 1
+    assert results.count(admission.ROOM_CONFLICT) == THREADS - 1
+
+    with app.app_context():
+        assert Booking.query.filter_by(classroom_id=1, booking_date=DAY).count() == 1
+
+    # Заявки выстраиваются в очередь на блокировке, а не падают с
+    # "database is locked" и не спят в busy-цикле SQLite: даже последняя
+    # заявка ждёт не больше суммы коротких транзакций перед ней
+    latencies.sort()
+    assert latencies[-1] < 1.0, latencies
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
@@ -0,0 +1,231 @@
+"""
+Сверка индекса занятости с SQL-проверкой пересечений на случайных данных;
+изменения, пришедшие во время загрузки даты, не теряются.
+Запустить: python -m pytest test_availability.py
+"""
+
+import random
+from datetime import date, time, timedelta
+
+import pytest
+
+from app import db, routes
+from app.availability import availability
+from app.models import User, Classroom, Booking
+
+
+def _random_interval(rng):
+    start = rng.randrange(8 * 60, 21 * 60, 15)
+    end = rng.randrange(start + 15, min(start + 4 * 60, 22 * 60) + 1, 15)
+    return time(start // 60, start % 60), time(end // 60, end % 60)
+
+
+def _sql_conflict(classroom_id, booking_date, start, end):
+    return Booking.query.filter(
+        Booking.classroom_id == classroom_id,
+        Booking.booking_date == booking_date,
+        Booking.status.in_(['pending', 'approved']),
+        ((Booking.start_time <= start) & (Booking.end_time > start)) |
+        ((Booking.start_time < end) & (Booking.end_time >= end)) |
+        ((Booking.start_time >= start) & (Booking.end_time <= end))
+    ).first()
+
+
+def test_index_matches_sql_predicate(app_context):
+    rng = random.Random(42)
+    user = User(username='u', email='u@example.com')
+    rooms = [Classroom(room_number=str(i), capacity=20, floor=1) for i in range(5)]
+    db.session.add(user)
+    db.session.add_all(rooms)
+    db.session.commit()
+
+    days = [date(2030, 1, 1) + timedelta(days=i) for i in range(3)]
+    bookings = []
+    for _ in range(300):
+        start, end = _random_interval(rng)
+        bookings.append(Booking(
+            user_id=user.id,
+            classroom_id=rng.choice(rooms).id,
+            booking_date=rng.choice(days),
+            start_time=start,
+            end_time=end,
+            purpose='test',
+            status=rng.choice(['pending', 'approved', 'rejected', 'completed'])
+        ))
+    db.session.add_all(bookings)
+    db.session.commit()
+
+    def check(probes):
+        for _ in range(probes):
+            classroom_id = rng.choice(rooms).id
+            booking_date = rng.choice(days)
+            start, end = _random_interval(rng)
+            expected = _sql_conflict(classroom_id, booking_date, start, end)
+            canonical = Booking.query.filter(
+                Booking.classroom_id == classroom_id,
+                Booking.booking_date == booking_date,
+                Booking.status.in_(['pending', 'approved']),
+                Booking.overlaps(start, end)
+            ).first()
+            assert (canonical is None) == (expected is None)
+            found = availability.find_conflict(classroom_id, booking_date, start, end)
+            assert (found is None) == (expected is None), (classroom_id, booking_date, start, end)
+            if found is not None:
+                conflict = db.session.get(Booking, found.booking_id)
+                assert conflict.start_time < end and conflict.end_time > start
+
+    check(2000)
+
+    # Изменения статусов должны отражаться в уже загруженном индексе
+    for booking in rng.sample(bookings, 100):
+        booking.status = rng.choice(['approved', 'rejected'])
+        db.session.commit()
+        availability.sync(booking)
+    for booking in rng.sample(bookings, 50):
+        db.session.delete(booking)
+        db.session.commit()
+        availability.discard(booking)
+
+    check(2000)
+
+
+def test_add_during_load_is_not_lost(app_context, monkeypatch):
+    day = date(2030, 1, 1)
+    db.session.add(User(username='u', email='u@example.com'))
+    db.session.add(Classroom(room_number='101', capacity=20, floor=1))
+    db.session.commit()
+    load = availability._load
+    added = []
+
+    def racing_load(classroom_id, booking_date):
+        room_day = load(classroom_id, booking_date)
+        if not added:
+            # Другой запрос создаёт бронирование, пока дата загружается
+            booking = Booking(user_id=1, classroom_id=1, booking_date=day, start_time=time(10, 0),
+                              end_time=time(11, 0), purpose='test', status='approved')
+            db.session.add(booking)
+            db.session.commit()
+            availability.add(booking)
+            added.append(booking.id)
+        return room_day
+
+    monkeypatch.setattr(availability, '_load', racing_load)
+    assert availability.find_conflict(1, day, time(10, 30), time(12, 0)).booking_id == added[0]
+    assert availability.find_conflict(1, day, time(10, 30), time(12, 0)).booking_id == added[0]
+
+
+def test_booking_rechecks_database_when_index_is_stale(app):
+    day = date.today() + timedelta(days=3)
+
+    with app.app_context():
+        for username in ('teacher', 'other'):
+            user = User(username=username, email=f'{username}@example.com', role='teacher')
+            user.set_password('secret')
+            db.session.add(user)
+        db.session.add(Classroom(room_number='101', capacity=20, floor=1))
+        db.session.commit()
+
+        # Индекс загружен, пока слот свободен; затем бронирование создаёт
+        # другой процесс - его индекс этого процесса ещё не видит
+        assert availability.is_free(1, day, time(10, 0), time(11, 0))
+        db.session.add(Booking(user_id=2, classroom_id=1, booking_date=day, start_time=time(10, 0),
+                               end_time=time(11, 0), purpose='other worker', status='approved'))
+        db.session.commit()
+        assert availability.is_free(1, day, time(10, 0), time(11, 0))
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'teacher', 'password': 'secret'})
+    client.post('/booking', data={'classroom_id': 1, 'booking_date': day.strftime('%Y-%m-%d'),
+                                  'start_time': '10:00', 'end_time': '11:00', 'purpose': 'lecture'})
+
+    with app.app_context():
+        active = Booking.query.filter(Booking.classroom_id == 1, Booking.booking_date == day,
+                                      Booking.status.in_(['pending', 'approved'])).all()
+        assert [booking.purpose for booking in active] == ['other worker']
+
+
+BATCH_DAYS = [date(2030, 2, 4), date(2030, 2, 5)]
+
+
+def _seed_bookings(app):
+    """Три аудитории; занятость: 101 - 4 февраля 10-12, 102 - 5 февраля 9-10 (заявка)"""
+    with app.app_context():
+        db.session.add(User(username='teacher', email='teacher@example.com', role='teacher'))
+        db.session.add_all([Classroom(room_number=str(101 + i), capacity=20, floor=1) for i in range(3)])
+        db.session.add_all([
+            Booking(user_id=1, classroom_id=1, booking_date=BATCH_DAYS[0], start_time=time(10, 0),
+                    end_time=time(12, 0), purpose='lecture', status='approved'),
+            Booking(user_id=1, classroom_id=2, booking_date=BATCH_DAYS[1], start_time=time(9, 0),
+                    end_time=time(10, 0), purpose='seminar', status='pending'),
+            # Отклонённое бронирование не мешает
+            Booking(user_id=1, classroom_id=3, booking_date=BATCH_DAYS[0], start_time=time(9, 0),
+                    end_time=time(15, 0), purpose='old', status='rejected'),
+        ])
+        db.session.commit()
+
+
+def _probe(classroom_id, day, start, end):
+    return {'classroom_id': classroom_id, 'date': day.strftime('%Y-%m-%d'), 'start_time': start, 'end_time': end}
+
+
+def test_batch_answers_match_single_checks(app):
+    _seed_bookings(app)
+    client = app.test_client()
+    probes = [_probe(classroom_id, day, start, end)
+              for classroom_id in (1, 2, 3) for day in BATCH_DAYS
+              for start, end in (('08:00', '09:00'), ('09:30', '10:30'), ('11:00', '13:00'), ('12:00', '14:00'))]
+
+    answers = client.post('/api/check_availability/batch', json={'probes': probes}).get_json()
+    singles = [client.get('/api/check_availability/{classroom_id}/{date}/{start_time}/{end_time}'.format(**probe))
+               .get_json() for probe in probes]
+    assert answers == singles
+
+    busy = {(answer['classroom_id'], answer['date'], answer['start_time'])
+            for answer in answers if not answer['is_available']}
+    assert busy == {(1, '2030-02-04', '09:30'), (1, '2030-02-04', '11:00'), (2, '2030-02-05', '09:30')}
+    assert answers[probes.index(_probe(1, BATCH_DAYS[0], '11:00', '13:00'))]['conflict'] == {
+        'exists': True, 'user': 'teacher', 'purpose': 'lecture', 'time': '10:00 - 12:00'}
+    # Пакет можно передать и просто списком
+    assert client.post('/api/check_availability/batch', json=probes[:3]).get_json() == answers[:3]
+
+
+def test_batch_reports_malformed_probes_one_by_one(app):
+    _seed_bookings(app)
+    probes = [
+        _probe(1, BATCH_DAYS[0], '08:00', '09:00'),
+        {'classroom_id': 1, 'date': '2030-02-30', 'start_time': '08:00', 'end_time': '09:00'},
+        _probe(1, BATCH_DAYS[0], '25:00', '26:00'),
+        _probe(1, BATCH_DAYS[0], '12:00', '10:00'),
+        _probe(1, BATCH_DAYS[0], '10:00', '10:00'),
+        _probe(99, BATCH_DAYS[0], '08:00', '09:00'),
+        {'classroom_id': 'first', 'date': '2030-02-04', 'start_time': '08:00', 'end_time': '09:00'},
+        {'classroom_id': 1},
+        'garbage',
+        _probe(1, BATCH_DAYS[0], '10:00', '11:00'),
+    ]
+    response = app.test_client().post('/api/check_availability/batch', json={'probes': probes})
+    assert response.status_code == 200
+    answers = response.get_json()
+    assert len(answers) == len(probes)
+    assert answers[0]['is_available'] and not answers[-1]['is_available']
+    assert all(set(answer) == {'error'} for answer in answers[1:-1])
+    assert 'позже' in answers[3]['error'] and 'позже' in answers[4]['error']
+    assert answers[5]['error'] == 'Аудитория 99 не найдена'
+
+
+def test_batch_rejects_too_many_probes_and_bad_payload(app, monkeypatch):
+    _seed_bookings(app)
+    client = app.test_client()
+    monkeypatch.setattr(routes, 'AVAILABILITY_BATCH_LIMIT', 3)
+    probe = _probe(1, BATCH_DAYS[0], '08:00', '09:00')
+
+    assert client.post('/api/check_availability/batch', json={'probes': [probe] * 3}).status_code == 200
+    response = client.post('/api/check_availability/batch', json={'probes': [probe] * 4})
+    assert response.status_code == 400 and 'Не более 3' in response.get_json()['error']
+    for payload in ({'probes': probe}, {'other': []}, 'text'):
+        assert client.post('/api/check_availability/batch', json=payload).status_code == 400
+    assert client.post('/api/check_availability/batch', data='not json').status_code == 400
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
@@ -0,0 +1,166 @@
+"""
+Команды бота /free и /room: снимок занятости строится одним запросом и
+отвечает без обращений к базе. Нагрузочный тест прогоняет тысячи
+обновлений через Dispatcher бота с поддельным транспортом Bot API
+(нужен aiogram, иначе пропускается).
+Запустить: python -m pytest test_bot_snapshot.py
+"""
+
+import asyncio
+import os
+import time as timer
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import db, admission
+from app.models import User, Classroom
+from telegram_bot import snapshot
+
+DAY = date.today() + timedelta(days=1)
+
+
+@pytest.fixture
+def app(app):
+    with app.app_context():
+        db.session.add_all([
+            Classroom(room_number='101', capacity=20, floor=1),
+            Classroom(room_number='405', capacity=30, floor=4, has_projector=True),
+            Classroom(room_number='410', capacity=60, floor=4, has_projector=True, has_computers=True),
+            Classroom(room_number='500', capacity=90, floor=5, is_active=False),
+        ])
+        teacher = User(username='teacher', email='teacher@example.com', role='teacher')
+        teacher.set_password('secret')
+        db.session.add(teacher)
+        db.session.commit()
+        admission.admit(teacher, 2, DAY, time(10, 0), time(11, 30), 'lecture')
+        admission.admit(teacher, 2, DAY, time(14, 0), time(15, 0), 'seminar')
+    return app
+
+
+class _Statements:
+    """Считает SQL-запросы к базе приложения"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def _build(app, now):
+    with app.app_context():
+        statements = _Statements()
+        event.listen(db.engine, 'before_cursor_execute', statements)
+        try:
+            return snapshot.build(now), statements.count
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', statements)
+
+
+def test_snapshot_is_built_with_one_query(app):
+    current, statements = _build(app, datetime.combine(DAY, time(9, 0)))
+    assert statements == 1
+    assert [room.number for room in current.rooms] == ['101', '405', '410']
+
+    query = snapshot.parse_free('10:00-12:00 projector', datetime.combine(DAY, time(9, 0)))
+    assert [room.number for room in snapshot.free_rooms(current, query)] == ['410']
+    query = snapshot.parse_free('11:30-14:00 projector', datetime.combine(DAY, time(9, 0)))
+    assert [room.number for room in snapshot.free_rooms(current, query)] == ['405', '410']
+
+
+def test_room_answer_lists_busy_intervals(app):
+    current, _ = _build(app, datetime.combine(DAY, time(9, 0)))
+    text = snapshot.room_text(current, '405', datetime.combine(DAY, time(10, 15)))
+    assert 'Сейчас занята' in text
+    assert '10:00-11:30' in text and '14:00-15:00' in text
+    assert 'не найдена' in snapshot.room_text(current, '999', datetime.combine(DAY, time(10, 15)))
+
+
+def test_free_arguments_are_validated():
+    now = datetime.combine(DAY, time(9, 20))
+    query = snapshot.parse_free('', now)
+    assert (query.start, query.end) == (time(9, 15), time(10, 15))
+    assert snapshot.parse_free('завтра 8:00-9:00 computers 25', now) == snapshot.FreeQuery(
+        DAY + timedelta(days=1), time(8, 0), time(9, 0), 25, False, True)
+    for args in ('12:00-10:00', '07:00-09:00', 'balcony'):
+        with pytest.raises(ValueError):
+            snapshot.parse_free(args, now)
+    with pytest.raises(ValueError):
+        snapshot.parse_free('', datetime.combine(DAY, time(23, 0)))
+
+
+def test_load_through_dispatcher_uses_only_the_snapshot(app):
+    pytest.importorskip('aiogram')
+    os.environ.setdefault('BOT_TOKEN', '42:TEST')
+    from aiogram import Bot
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage
+    from aiogram.types import Chat, Message, Update, User as TelegramUser
+    from telegram_bot import bot as telegram_bot
+
+    class FakeSession(BaseSession):
+        """Транспорт Bot API в памяти: ответы бота складываются в список"""
+
+        def __init__(self):
+            super().__init__()
+            self.sent = []
+
+        async def make_request(self, bot, method, timeout=None):
+            assert isinstance(method, SendMessage)
+            self.sent.append((method.chat_id, method.text))
+            return Message(message_id=len(self.sent), date=datetime.now(),
+                           chat=Chat(id=method.chat_id, type='private'), text=method.text)
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b''
+
+        async def close(self):
+            pass
+
+    current, _ = _build(app, datetime.now())
+    telegram_bot.snapshots.current = current
+    session = FakeSession()
+    fake_bot = Bot('42:TEST', session=session)
+    commands = ['/free 10:00-12:00 projector', '/room 405', '/free 08:00-22:00', '/room 101']
+
+    def update(i):
+        chat_id = 1000 + i % 2000
+        sender = TelegramUser(id=chat_id, is_bot=False, first_name='student')
+        return Update(update_id=i, message=Message(
+            message_id=i, date=datetime.now(), chat=Chat(id=chat_id, type='private'),
+            from_user=sender, text=commands[i % len(commands)]
+        ))
+
+    latencies = []
+
+    async def handle(item):
+        began = timer.perf_counter()
+        await telegram_bot.dp.feed_update(fake_bot, item)
+        latencies.append(timer.perf_counter() - began)
+
+    async def load(count):
+        await asyncio.gather(*(handle(update(i)) for i in range(count)))
+
+    with app.app_context():
+        statements = _Statements()
+        event.listen(db.engine, 'before_cursor_execute', statements)
+        try:
+            began = timer.perf_counter()
+            asyncio.run(load(5000))
+            elapsed = timer.perf_counter() - began
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', statements)
+
+    assert len(session.sent) == 5000
+    assert statements.count == 0
+    assert all('Данные на' in text for _, text in session.sent)
+    latencies.sort()
+    # Задержка внутри процесса (без сети): p99 далеко от бюджета в 100 мс
+    assert latencies[int(len(latencies) * 0.99)] < 0.1
+    print(f'5000 обновлений за {elapsed:.2f} с, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} мс')
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
@@ -0,0 +1,96 @@
+"""
+Статистика календаря: число бронирований и точные минуты по аудиториям
+одним GROUP BY через Booking.duration_minutes (minutes_of_day в SQL).
+Запустить: python -m pytest test_calendar.py
+"""
+
+from datetime import date, time
+
+import pytest
+from flask import template_rendered
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.models import User, Classroom, Booking, minutes_of_day
+
+# (аудитория, пользователь, дата, начало, конец, статус)
+BOOKINGS = [
+    # Границы не совпадают с 15-минутными слотами
+    (1, 1, date(2030, 2, 4), time(9, 0), time(10, 30), 'approved'),
+    (1, 2, date(2030, 2, 4), time(10, 10), time(11, 50), 'approved'),
+    (1, 2, date(2030, 2, 12), time(13, 7), time(13, 52), 'pending'),
+    (2, 1, date(2030, 2, 28), time(21, 30), time(22, 0), 'pending'),
+    (2, 2, date(2030, 2, 5), time(8, 0), time(22, 0), 'approved'),
+    # Не учитываются: неактивные статусы и соседние месяцы
+    (1, 1, date(2030, 2, 6), time(14, 0), time(16, 0), 'rejected'),
+    (2, 1, date(2030, 2, 7), time(9, 0), time(10, 0), 'completed'),
+    (1, 1, date(2030, 1, 31), time(9, 0), time(10, 0), 'approved'),
+    (2, 1, date(2030, 3, 1), time(9, 0), time(10, 0), 'approved'),
+]
+
+
+@pytest.fixture
+def app(app):
+    with app.app_context():
+        for username, role in [('teacher', 'teacher'), ('student', 'student')]:
+            user = User(username=username, email=f'{username}@example.com', role=role)
+            user.set_password('secret')
+            db.session.add(user)
+        db.session.add_all([Classroom(room_number=str(101 + i), capacity=20, floor=1) for i in range(3)])
+        db.session.add_all([
+            Booking(classroom_id=classroom_id, user_id=user_id, booking_date=day, start_time=start,
+                    end_time=end, purpose='test', status=status)
+            for classroom_id, user_id, day, start, end, status in BOOKINGS
+        ])
+        db.session.commit()
+    return app
+
+
+def _stats(app, username):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': 'secret'})
+    rendered = []
+
+    def record(sender, template, context, **extra):
+        rendered.append(context)
+
+    template_rendered.connect(record, app)
+    try:
+        response = client.get('/calendar?year=2030&month=2')
+    finally:
+        template_rendered.disconnect(record, app)
+    assert response.status_code == 200
+    return {stat['room_number']: (stat['booking_count'], stat['total_minutes'])
+            for stat in rendered[0]['classroom_stats'].values()}
+
+
+def test_month_totals_are_exact_minutes(app):
+    assert _stats(app, 'teacher') == {'101': (3, 90 + 100 + 45), '102': (2, 30 + 840), '103': (0, 0)}
+    # Студент видит только свои бронирования
+    assert _stats(app, 'student') == {'101': (2, 100 + 45), '102': (1, 840), '103': (0, 0)}
+
+
+def test_duration_minutes_expression_matches_instances(app_context):
+    rows = db.session.query(Booking, Booking.duration_minutes).order_by(Booking.id).all()
+    assert [minutes for _, minutes in rows] == [booking.duration_minutes for booking, _ in rows]
+    assert [minutes for _, minutes in rows] == [90, 100, 45, 30, 840, 120, 60, 60, 60]
+
+
+def test_minutes_of_day_compiles_for_sqlite_and_postgres():
+    expression = Booking.duration_minutes
+    assert str(expression.compile(dialect=sqlite.dialect())) == (
+        '(CAST(substr(booking.end_time, 1, 2) AS INTEGER) * 60 + CAST(substr(booking.end_time, 4, 2) AS INTEGER))'
+        ' - (CAST(substr(booking.start_time, 1, 2) AS INTEGER) * 60'
+        ' + CAST(substr(booking.start_time, 4, 2) AS INTEGER))'
+    )
+    assert str(expression.compile(dialect=postgresql.dialect())) == (
+        '(CAST(EXTRACT(EPOCH FROM booking.end_time) AS INTEGER) / 60)'
+        ' - (CAST(EXTRACT(EPOCH FROM booking.start_time) AS INTEGER) / 60)'
+    )
+    # Внутри агрегата конструкция компилируется так же
+    assert 'EXTRACT(EPOCH FROM booking.start_time)' in str(
+        db.func.sum(minutes_of_day(Booking.start_time)).compile(dialect=postgresql.dialect()))
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
@@ -0,0 +1,65 @@
+"""
+Страница /classrooms должна обслуживаться фиксированным числом запросов
+независимо от количества аудиторий.
+Запустить: python -m pytest test_classrooms_queries.py
+"""
+
+from datetime import date, time
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.models import User, Classroom, Booking
+from conftest import make_app
+
+
+def _count_page_queries(room_count):
+    app = make_app()
+
+    with app.app_context():
+        rooms = [Classroom(room_number=str(i), capacity=20, floor=1) for i in range(room_count)]
+        db.session.add_all(rooms)
+        db.session.commit()
+
+        for i, room in enumerate(rooms):
+            user = User(username=f'user{i}', email=f'user{i}@example.com')
+            db.session.add(user)
+            db.session.flush()
+            # Половина аудиторий занята прямо сейчас, у остальных бронь на утро
+            db.session.add(Booking(
+                user_id=user.id,
+                classroom_id=room.id,
+                booking_date=date.today(),
+                start_time=time(0, 0),
+                end_time=time(23, 59, 59) if i % 2 else time(0, 1),
+                purpose='lecture',
+                status='approved'
+            ))
+        db.session.commit()
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = app.test_client().get('/classrooms')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+        assert response.status_code == 200
+        assert 'user1'.encode() in response.data
+        return len(statements)
+
+
+def test_classrooms_page_query_count_is_constant():
+    small = _count_page_queries(5)
+    large = _count_page_queries(60)
+    assert small == large, f'{small} запросов для 5 аудиторий, {large} для 60'
+    assert large <= 3
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
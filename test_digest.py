@@ -0,0 +1,117 @@
+"""
+Сводки уведомлений: уведомления одному адресату в пределах
+EMAIL_DIGEST_WINDOW уходят одним письмом, тела писем строятся по
+шаблонам app/templates/email.
+Запустить: python -m pytest test_digest.py
+"""
+
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from app import db, mail, outbox
+from app.email import send_booking_cancelled_email, send_booking_rejected_email
+from app.mailer import dispatcher
+from app.models import User, Classroom, Booking, EmailOutbox
+from conftest import TestingConfig
+
+DAY = date.today() + timedelta(days=2)
+
+
+@pytest.fixture
+def app(app):
+    with app.app_context():
+        db.session.add(Classroom(room_number='101', capacity=30, floor=1))
+        for name, role in [('admin', 'admin'), ('student', 'student'), ('other', 'student')]:
+            user = User(username=name, email=f'{name}@example.com', role=role)
+            user.set_password('secret')
+            db.session.add(user)
+        db.session.commit()
+    return app
+
+
+def _later():
+    return datetime.utcnow() + timedelta(seconds=TestingConfig.EMAIL_DIGEST_WINDOW + 1)
+
+
+def _drain():
+    """Отправляет всё накопленное и возвращает (число строк, отправленные письма)"""
+    with mail.record_messages() as outgoing:
+        sent = outbox.drain(now=_later())
+        assert dispatcher.flush(timeout=10)
+    return sent, outgoing
+
+
+def _notify(send, email, username, hour):
+    send(user_email=email, username=username, classroom_number='101',
+         booking_date=DAY.strftime('%d.%m.%Y'), start_time=f'{hour:02d}:00', end_time=f'{hour + 1:02d}:00')
+
+
+def test_bulk_rejection_sends_one_digest(app):
+    with app.app_context():
+        student = User.query.filter_by(username='student').one()
+        booking_ids = []
+        for i in range(20):
+            booking = Booking(user_id=student.id, classroom_id=1, booking_date=DAY + timedelta(days=i // 10),
+                              start_time=time(8 + i % 10, 0), end_time=time(9 + i % 10, 0), purpose='study')
+            db.session.add(booking)
+            db.session.flush()
+            booking_ids.append(booking.id)
+        db.session.commit()
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'secret'})
+    for booking_id in booking_ids:
+        client.get(f'/admin/reject_booking/{booking_id}')
+
+    with app.app_context():
+        assert EmailOutbox.query.count() == 20
+        # Окно сводки ещё открыто - ничего не отправляется
+        assert outbox.drain() == 0
+
+        sent, outgoing = _drain()
+        assert sent == 20
+        assert len(outgoing) == 1
+        message = outgoing[0]
+        assert message.recipients == ['student@example.com']
+        assert message.subject == 'Уведомления о бронированиях: 20'
+        assert message.body.count('Бронирование отклонено') == 20
+        assert 'Здравствуйте, student!' in message.body and '<html' in message.html
+        assert EmailOutbox.query.filter_by(status='sent').count() == 20
+        dispatcher.stop(timeout=1)
+
+
+def test_single_notification_uses_its_template(app):
+    with app.app_context():
+        _notify(send_booking_cancelled_email, 'student@example.com', 'student', 10)
+        db.session.commit()
+
+        sent, outgoing = _drain()
+        assert sent == 1 and len(outgoing) == 1
+        assert outgoing[0].subject == 'Бронирование отменено - Аудитория 101'
+        assert '10:00 - 11:00' in outgoing[0].body
+        assert 'email/booking_cancelled.txt' in {key[1] for key in app.jinja_env.cache}
+        dispatcher.stop(timeout=1)
+
+
+def test_recipients_are_not_merged(app):
+    with app.app_context():
+        for hour in (10, 12):
+            _notify(send_booking_rejected_email, 'student@example.com', 'student', hour)
+            _notify(send_booking_cancelled_email, 'other@example.com', 'other', hour)
+        db.session.commit()
+
+        # Уведомления, добавленные позже, присоединяются к открытому окну
+        assert len({entry.next_attempt_at for entry in EmailOutbox.query.filter_by(recipients='other@example.com')}) == 1
+
+        sent, outgoing = _drain()
+        assert sent == 4
+        by_recipient = {message.recipients[0]: message for message in outgoing}
+        assert set(by_recipient) == {'student@example.com', 'other@example.com'}
+        assert by_recipient['student@example.com'].body.count('Бронирование отклонено') == 2
+        assert 'Здравствуйте, other!' in by_recipient['other@example.com'].body
+        dispatcher.stop(timeout=1)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
@@ -94,7 +94,7 @@ def test_email_config():
 
 def test_email_send():
     """Пытается отправить тестовое письмо"""
-    from app import create_app
+    from app import create_app, db, outbox
     from app.email import send_email
     
     print("\n" + "=" * 60)
@@ -111,7 +111,11 @@ def test_email_send():
                 text_body='Это тестовое письмо. Если вы его получили, то конфигурация email работает корректно!',
                 html_body='<h2>🎉 Тест успешен!</h2><p>Email конфигурация работает корректно.</p>'
             )
-            print("✓ Письмо отправлено в асинхронный процесс")
+            db.session.commit()
+            if not outbox.drain():
+                print("✗ Письмо не отправлено, см. email_outbox.last_error")
+                return False
+            print("✓ Письмо отправлено")
             print("✓ Проверьте вашу почту (может быть в SPAM)")
             return True
         except Exception as e:
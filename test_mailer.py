@@ -0,0 +1,132 @@
+"""
+Пул отправки писем: переиспользование SMTP-соединений, обратное давление
+при переполнении очереди и размыкатель цепи при недоступном сервере.
+
+Тест доставки использует локальный SMTP-сервер aiosmtpd (pip install aiosmtpd).
+Запустить: python -m pytest test_mailer.py
+"""
+
+import socket
+import time
+
+import pytest
+from flask_mail import Message
+
+from app.mailer import dispatcher, CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from conftest import make_app
+
+# Письма действительно уходят на SMTP-сервер, поднятый тестом
+SMTP_CONFIG = dict(MAIL_SERVER='localhost', MAIL_USE_TLS=False, MAIL_USERNAME=None, MAIL_PASSWORD=None,
+                   MAIL_SUPPRESS_SEND=False)
+
+
+def _app(**config):
+    return make_app(**SMTP_CONFIG, **config)
+
+
+def _submit(subject, recipient):
+    return dispatcher.submit(Message(subject=subject, recipients=[recipient], body='body'))
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def test_circuit_breaker_transitions():
+    breaker = CircuitBreaker(threshold=2, cooldown=0.1)
+    breaker.failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    time.sleep(0.15)
+    assert breaker.state == HALF_OPEN
+    # В half_open пропускается одна проба; её неудача снова открывает цепь
+    assert breaker.allow() and not breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN
+
+    time.sleep(0.15)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_pool_reuses_smtp_connections():
+    controller_module = pytest.importorskip('aiosmtpd.controller')
+
+    class Sink:
+        def __init__(self):
+            self.messages = 0
+            self.connections = 0
+
+        async def handle_EHLO(self, server, session, envelope, hostname, responses):
+            self.connections += 1
+            session.host_name = hostname
+            return responses
+
+        async def handle_DATA(self, server, session, envelope):
+            self.messages += 1
+            return '250 OK'
+
+    sink = Sink()
+    port = _free_port()
+    controller = controller_module.Controller(sink, hostname='localhost', port=port)
+    controller.start()
+    try:
+        app = _app(MAIL_PORT=port, MAIL_WORKERS=3)
+        with app.app_context():
+            for i in range(200):
+                assert _submit(f'test {i}', 'student@example.com')
+            assert dispatcher.flush(timeout=30)
+            assert dispatcher.stop(timeout=5)
+    finally:
+        controller.stop()
+
+    assert sink.messages == 200
+    assert dispatcher.sent == 200
+    assert sink.connections <= 3
+
+
+def test_full_queue_applies_backpressure():
+    # Сервер принимает соединение, но не отвечает: поток пула занят первым письмом
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    listener.listen()
+    app = _app(MAIL_PORT=listener.getsockname()[1], MAIL_WORKERS=1, MAIL_BATCH_SIZE=1,
+               MAIL_QUEUE_SIZE=2, MAIL_SUBMIT_TIMEOUT=0.05)
+    try:
+        with app.app_context():
+            assert _submit('first', 'a@example.com')
+            time.sleep(0.2)
+            assert _submit('second', 'a@example.com')
+            assert _submit('third', 'a@example.com')
+
+            began = time.monotonic()
+            assert not _submit('fourth', 'a@example.com')
+            assert time.monotonic() - began < 1
+            assert dispatcher.rejected == 1
+    finally:
+        listener.close()
+        dispatcher.stop(timeout=0)
+
+
+def test_breaker_opens_when_smtp_is_down():
+    app = _app(MAIL_PORT=_free_port(), MAIL_WORKERS=1, MAIL_BREAKER_THRESHOLD=3, MAIL_BREAKER_COOLDOWN=60)
+    with app.app_context():
+        for i in range(3):
+            assert _submit(f'test {i}', 'a@example.com')
+        assert dispatcher.flush(timeout=10)
+        assert dispatcher.failed == 3
+        assert dispatcher.breaker.state == OPEN
+
+        # Пока цепь разомкнута, письма отклоняются сразу, без обращения к серверу
+        assert not _submit('rejected', 'a@example.com')
+        assert dispatcher.rejected == 1
+        dispatcher.stop(timeout=1)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
@@ -0,0 +1,165 @@
+"""
+Инкрементально обновляемые маски занятости должны совпадать с полной
+перестройкой по таблице booking.
+Запустить: python -m pytest test_occupancy.py
+"""
+
+import random
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from flask import url_for
+
+from app import db, occupancy
+from app.models import User, Classroom, Booking, RoomOccupancy
+
+
+def _snapshot():
+    return {
+        (row.day, row.classroom_id): (row.busy_mask, row.approved_mask)
+        for row in RoomOccupancy.query.all()
+        if row.busy_mask or row.approved_mask
+    }
+
+
+def test_slot_mask():
+    assert occupancy.slot_mask(time(8, 0), time(9, 0)) == 0b1111
+    assert occupancy.slot_mask(time(10, 10), time(10, 20)) == 0b11 << 8
+    assert occupancy.slot_mask(time(6, 0), time(8, 0)) == 0
+    assert occupancy.slot_mask(time(8, 0), time(23, 0)) == (1 << occupancy.SLOTS_PER_DAY) - 1
+    assert occupancy.slot_at(time(8, 20)) == 0b10
+    assert occupancy.slot_at(time(22, 0)) == 0
+
+
+def test_incremental_refresh_matches_rebuild(app_context):
+    rng = random.Random(7)
+    user = User(username='u', email='u@example.com')
+    rooms = [Classroom(room_number=str(i), capacity=20, floor=1) for i in range(4)]
+    db.session.add(user)
+    db.session.add_all(rooms)
+    db.session.commit()
+
+    days = [date(2030, 1, 1) + timedelta(days=i) for i in range(3)]
+    bookings = []
+    for _ in range(200):
+        start = rng.randrange(8, 21)
+        booking = Booking(
+            user_id=user.id,
+            classroom_id=rng.choice(rooms).id,
+            booking_date=rng.choice(days),
+            start_time=time(start, rng.choice([0, 15, 30, 45])),
+            end_time=time(rng.randrange(start + 1, 23), 0),
+            purpose='test',
+            status='pending'
+        )
+        db.session.add(booking)
+        occupancy.refresh(booking.classroom_id, booking.booking_date)
+        db.session.commit()
+        bookings.append(booking)
+
+    for booking in rng.sample(bookings, 120):
+        classroom_id, booking_date = booking.classroom_id, booking.booking_date
+        if rng.random() < 0.3:
+            db.session.delete(booking)
+        else:
+            booking.status = rng.choice(['approved', 'rejected', 'completed'])
+        occupancy.refresh(classroom_id, booking_date)
+        db.session.commit()
+
+    incremental = _snapshot()
+    occupancy.rebuild()
+    db.session.commit()
+    assert _snapshot() == incremental
+    assert incremental
+
+    # Векторная матрица занятости должна давать те же маски
+    matrix = occupancy.occupancy_matrix([room.id for room in rooms], days[0], len(days))
+    masks = occupancy.to_bitmasks(matrix)
+    for room_idx, room in enumerate(sorted(rooms, key=lambda r: r.id)):
+        for day_idx, day in enumerate(days):
+            expected = incremental.get((day, room.id), (0, 0))[0]
+            assert int(masks[room_idx, day_idx]) == expected
+            runs = occupancy.to_runs(matrix)[room_idx][day_idx]
+            assert sum(((1 << length) - 1) << first for first, length in runs) == expected
+
+
+def test_status_filter_matches_occupied_badge(app):
+    now = datetime.now()
+    # Интервал вокруг текущего момента, не переходящий через полночь
+    start = max(now - timedelta(minutes=5), datetime.combine(now.date(), time.min)).time()
+    end = min(now + timedelta(minutes=5), datetime.combine(now.date(), time.max)).time()
+
+    with app.app_context():
+        user = User(username='u', email='u@example.com')
+        rooms = [Classroom(room_number=f'10{i}', capacity=20, floor=1) for i in range(3)]
+        db.session.add(user)
+        db.session.add_all(rooms)
+        db.session.commit()
+        # Занята только 100; у 101 завершённое бронирование - маска слота его учитывает, отметка нет
+        for room, status in [(rooms[0], 'approved'), (rooms[1], 'completed')]:
+            db.session.add(Booking(user_id=user.id, classroom_id=room.id, booking_date=now.date(),
+                                   start_time=start, end_time=end, purpose='test', status=status))
+            occupancy.refresh(room.id, now.date())
+        db.session.commit()
+
+    client = app.test_client()
+    occupied = client.get('/classrooms?status=occupied').get_data(as_text=True)
+    free = client.get('/classrooms?status=free').get_data(as_text=True)
+    assert 'Аудитория 100' in occupied and 'Аудитория 100' not in free
+    for number in ('101', '102'):
+        assert f'Аудитория {number}' in free and f'Аудитория {number}' not in occupied
+
+
+def test_occupancy_matrix_endpoint(app):
+    with app.app_context():
+        db.session.add(User(username='u', email='u@example.com'))
+        db.session.add(Classroom(room_number='101', capacity=20, floor=1))
+        db.session.add(Booking(user_id=1, classroom_id=1, booking_date=date(2030, 1, 1), start_time=time(8, 0),
+                               end_time=time(9, 0), purpose='test', status='approved'))
+        occupancy.refresh(1, date(2030, 1, 1))
+        db.session.commit()
+        with app.test_request_context():
+            url = url_for('main.occupancy_matrix', start_date='2030-01-01', days=2, format='runs')
+
+    data = app.test_client().get(url).get_json()
+    assert data['rooms'] == [{'classroom_id': 1, 'room_number': '101', 'days': [[[0, 4]], []]}]
+
+
+def _free_rooms(client, start, end, **params):
+    response = client.get('/api/free_rooms', query_string={'date': '2030-01-01', 'start_time': start,
+                                                           'end_time': end, **params})
+    assert response.status_code == 200, response.get_json()
+    return [room['room_number'] for room in response.get_json()['rooms']]
+
+
+def test_free_rooms_endpoint(app):
+    day = date(2030, 1, 1)
+    with app.app_context():
+        db.session.add(User(username='u', email='u@example.com'))
+        # Порядок вставки не совпадает с порядком вместимости
+        db.session.add_all([Classroom(room_number=number, capacity=capacity, floor=1)
+                            for number, capacity in (('301', 30), ('101', 10), ('201', 20))])
+        # 301 занята 10:00-11:00, 101 - 12:00-13:00, у 201 строки маски нет вовсе
+        for classroom_id, start, end in ((1, time(10, 0), time(11, 0)), (2, time(12, 0), time(13, 0))):
+            db.session.add(Booking(user_id=1, classroom_id=classroom_id, booking_date=day, start_time=start,
+                                   end_time=end, purpose='test', status='approved'))
+            occupancy.refresh(classroom_id, day)
+        db.session.commit()
+        assert RoomOccupancy.query.filter_by(classroom_id=3).count() == 0
+
+    client = app.test_client()
+    # Интервал вплотную к чужим бронированиям с обеих сторон не пересекается с ними
+    assert _free_rooms(client, '10:30', '12:00') == ['101', '201']
+    assert _free_rooms(client, '11:00', '12:15') == ['201', '301']
+    assert _free_rooms(client, '08:00', '22:00') == ['201']
+    assert _free_rooms(client, '13:00', '14:00') == ['101', '201', '301']
+    assert _free_rooms(client, '13:00', '14:00', min_capacity=15) == ['201', '301']
+
+    for params in ({'min_capacity': 'ten'}, {'min_capacity': '1.5'}, {'floor': 'first'}):
+        response = client.get('/api/free_rooms', query_string={'date': '2030-01-01', 'start_time': '13:00',
+                                                               'end_time': '14:00', **params})
+        assert response.status_code == 400
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
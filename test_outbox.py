@@ -0,0 +1,161 @@
+"""
+Транзакционная очередь писем: письмо фиксируется вместе с изменением,
+обработчик запроса не трогает SMTP, разборщик захватывает пачки без
+пересечений и повторяет неудачные отправки с растущей задержкой.
+Запустить: python -m pytest test_outbox.py
+"""
+
+import socket
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from app import db, admission, mail, outbox
+from app.email import send_email
+from app.jobs import drain_email_outbox
+from app.mailer import dispatcher
+from app.models import User, Classroom, Booking, EmailOutbox
+from conftest import make_app
+
+DAY = date.today() + timedelta(days=2)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def _setup(**config):
+    # Сводки проверяет test_digest.py, здесь уведомления уходят сразу
+    app = make_app(EMAIL_DIGEST_WINDOW=0, **config)
+    with app.app_context():
+        db.session.add(Classroom(room_number='101', capacity=30, floor=1))
+        for name, role in [('teacher', 'teacher'), ('student', 'student')]:
+            user = User(username=name, email=f'{name}@example.com', role=role)
+            user.set_password('secret')
+            db.session.add(user)
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def app():
+    return _setup()
+
+
+def test_email_is_written_in_the_same_transaction(app):
+    with app.app_context():
+        send_email('rolled back', 'a@example.com', 'body')
+        db.session.rollback()
+        assert EmailOutbox.query.count() == 0
+
+        teacher = User.query.filter_by(username='teacher').one()
+        student = User.query.filter_by(username='student').one()
+        assert admission.admit(teacher, 1, DAY, time(10, 0), time(12, 0), 'lecture').status == admission.OK
+        result = admission.admit(student, 1, DAY, time(10, 0), time(11, 0), 'study')
+        assert result.status == admission.QUEUED
+
+        entry = EmailOutbox.query.one()
+        assert entry.recipients == 'student@example.com'
+        assert entry.status == 'pending'
+        assert 'Позиция #1' in entry.subject
+        # Запрос в SMTP не ходил
+        assert not dispatcher._threads
+
+        assert drain_email_outbox() == 1
+        assert entry.status == 'sent' and entry.sent_at is not None
+        assert drain_email_outbox() == 0
+
+
+def test_cancel_route_queues_promotion_email(app):
+    with app.app_context():
+        teacher = User.query.filter_by(username='teacher').one()
+        student = User.query.filter_by(username='student').one()
+        booking_id = admission.admit(teacher, 1, DAY, time(10, 0), time(12, 0), 'lecture').booking.id
+        admission.admit(student, 1, DAY, time(10, 0), time(12, 0), 'study')
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'teacher', 'password': 'secret'})
+    client.get(f'/cancel_booking/{booking_id}')
+
+    with app.app_context():
+        assert Booking.query.count() == 0
+        subjects = [entry.subject for entry in EmailOutbox.query.order_by(EmailOutbox.id)]
+        assert len(subjects) == 2 and 'свободна' in subjects[1]
+        assert not dispatcher._threads
+
+
+def test_claims_do_not_overlap_and_expire(app):
+    with app.app_context():
+        for i in range(5):
+            send_email(f'test {i}', 'a@example.com', 'body')
+        db.session.commit()
+        now = datetime.utcnow()
+
+        first = outbox.claim(3, now)
+        second = outbox.claim(3, now)
+        assert len(first) == 3 and len(second) == 2
+        assert not {entry.id for entry in first} & {entry.id for entry in second}
+        assert outbox.claim(3, now) == []
+
+        # Захват умершего разборщика истекает
+        later = now + timedelta(seconds=outbox.CLAIM_SECONDS + 1)
+        assert len(outbox.claim(10, later)) == 5
+
+
+def test_broken_notification_does_not_block_the_batch(app):
+    with app.app_context():
+        poisoned = outbox.add_notification('a@example.com', 'broken', 'booking_cancelled', {})
+        poisoned.context = '{not json'
+        good = send_email('good', 'b@example.com', 'body')
+        db.session.commit()
+        now = datetime.utcnow()
+
+        with mail.record_messages() as outgoing:
+            assert outbox.drain(now=now) == 1
+            assert dispatcher.flush(timeout=10)
+        assert [message.subject for message in outgoing] == ['good']
+        assert good.status == 'sent'
+        # Битое письмо освобождено и ждёт повтора, как после ошибки SMTP
+        assert poisoned.status == 'pending' and poisoned.attempts == 1 and poisoned.claim_token is None
+        assert 'JSONDecodeError' in poisoned.last_error
+
+        poisoned.attempts = outbox.MAX_ATTEMPTS - 1
+        poisoned.next_attempt_at = now
+        db.session.commit()
+        assert outbox.drain(now=now) == 0
+        assert poisoned.status == 'failed'
+        dispatcher.stop(timeout=1)
+
+
+def test_failed_delivery_is_retried_with_backoff():
+    app = _setup(MAIL_SUPPRESS_SEND=False, MAIL_SERVER='localhost', MAIL_PORT=_free_port(), MAIL_USE_TLS=False,
+                 MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_BREAKER_THRESHOLD=100)
+    with app.app_context():
+        entry = send_email('retry', 'a@example.com', 'body')
+        db.session.commit()
+        now = datetime.utcnow()
+
+        assert outbox.drain(now=now) == 0
+        assert entry.attempts == 1 and entry.status == 'pending'
+        assert entry.next_attempt_at == now + timedelta(seconds=outbox.BACKOFF_SECONDS)
+        assert 'ConnectionRefusedError' in entry.last_error
+
+        # До срока письмо не берётся, после - вторая попытка и удвоенная задержка
+        assert outbox.claim(10, now) == []
+        retry_at = entry.next_attempt_at
+        outbox.drain(now=retry_at)
+        assert entry.attempts == 2
+        assert entry.next_attempt_at == retry_at + timedelta(seconds=2 * outbox.BACKOFF_SECONDS)
+
+        entry.attempts = outbox.MAX_ATTEMPTS - 1
+        entry.next_attempt_at = now
+        db.session.commit()
+        outbox.drain(now=now)
+        assert entry.status == 'failed'
+        dispatcher.stop(timeout=1)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
@@ -0,0 +1,112 @@
+"""
+Постраничный профиль: курсор по (booking_date, start_time, id), страницы
+без пропусков и повторов, поиск по индексу вместо OFFSET.
+Запустить: python -m pytest test_pagination.py
+"""
+
+from datetime import date, time, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from app import db, pagination
+from app.models import User, Classroom, Booking, BookingQueue
+
+DAY = date.today() + timedelta(days=2)
+
+
+@pytest.fixture
+def app(app):
+    with app.app_context():
+        db.session.add_all([Classroom(room_number=str(100 + i), capacity=30, floor=1) for i in range(3)])
+        for name in ('student', 'other'):
+            user = User(username=name, email=f'{name}@example.com', role='student')
+            user.set_password('secret')
+            db.session.add(user)
+        db.session.flush()
+        for i in range(45):
+            # По три бронирования на один (день, время) - курсору нужен id для однозначности
+            db.session.add(Booking(user_id=1, classroom_id=1 + i % 3, booking_date=DAY + timedelta(days=i // 9),
+                                   start_time=time(8 + i // 3 % 3, 0), end_time=time(9 + i // 3 % 3, 0),
+                                   purpose=f'study {i}', status='approved'))
+        db.session.add(Booking(user_id=2, classroom_id=1, booking_date=DAY, start_time=time(8, 0),
+                               end_time=time(9, 0), purpose='other', status='approved'))
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'student', 'password': 'secret'})
+    return client
+
+
+def test_pages_cover_all_bookings_in_order(app, client):
+    seen, cursor = [], None
+    while True:
+        data = client.get('/api/my_bookings', query_string={'cursor': cursor or '', 'limit': 10}).get_json()
+        assert len(data['bookings']) <= 10
+        seen += [row['id'] for row in data['bookings']]
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+
+    with app.app_context():
+        expected = [b.id for b in Booking.query.filter_by(user_id=1).order_by(
+            Booking.booking_date.desc(), Booking.start_time.desc(), Booking.id.desc())]
+    assert seen == expected and len(seen) == 45
+
+
+def test_insert_between_pages_does_not_shift_them(app, client):
+    first = client.get('/api/my_bookings?limit=5').get_json()
+    with app.app_context():
+        # Новое бронирование в начале списка не сдвигает следующую страницу, как сдвинуло бы OFFSET
+        db.session.add(Booking(user_id=1, classroom_id=1, booking_date=DAY + timedelta(days=30),
+                               start_time=time(8, 0), end_time=time(9, 0), purpose='new', status='pending'))
+        db.session.commit()
+    second = client.get('/api/my_bookings', query_string={'cursor': first['next_cursor'], 'limit': 5}).get_json()
+    ids = [row['id'] for row in first['bookings'] + second['bookings']]
+    assert len(set(ids)) == 10
+    assert 'new' not in [row['purpose'] for row in second['bookings']]
+
+
+def test_bad_cursor_and_limit_are_rejected(client):
+    assert client.get('/api/my_bookings?cursor=garbage').status_code == 400
+    assert client.get('/api/my_bookings?limit=0').status_code == 400
+    assert client.get(f'/api/my_bookings?limit={pagination.MAX_PAGE_SIZE + 1}').status_code == 400
+
+
+def test_profile_renders_first_page_with_totals(app, client):
+    with app.app_context():
+        db.session.add_all([
+            BookingQueue(user_id=1, classroom_id=1, booking_date=DAY + timedelta(days=i), start_time=time(8, 0),
+                         end_time=time(9, 0), order_key=i)
+            for i in range(pagination.PAGE_SIZE + 3)
+        ])
+        db.session.commit()
+
+    page = client.get('/profile').get_data(as_text=True)
+    assert page.count('<tr class=') == pagination.PAGE_SIZE
+    assert 'Все (45)' in page and 'Одобрено: 45' in page
+    assert page.count('data-cursor=') == 2
+
+    data = client.get('/api/my_queue').get_json()
+    assert len(data['queue']) == pagination.PAGE_SIZE and data['next_cursor']
+    rest = client.get('/api/my_queue', query_string={'cursor': data['next_cursor']}).get_json()
+    assert len(rest['queue']) == 3 and rest['next_cursor'] is None
+    assert 'Удалить из очереди' in rest['html']
+
+
+def test_next_page_seeks_the_index(app_context):
+    cursor = pagination.encode_cursor(Booking(id=5, booking_date=DAY, start_time=time(10, 0)))
+    for model in (Booking, BookingQueue):
+        query = pagination.page_query(model.query.filter(model.user_id == 1), model, cursor)
+        sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        details = ' | '.join(row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql)))
+        assert f'SEARCH {model.__tablename__} USING INDEX' in details, details
+        assert 'TEMP B-TREE' not in details, details
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
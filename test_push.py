@@ -0,0 +1,200 @@
+"""
+Push-уведомления в Telegram: очередь telegram_outbox заполняется при
+выдаче удержания из очереди и напоминаниями о бронированиях, а бот
+отправляет её с учётом лимитов Bot API. Нагрузочный тест прогоняет 10 000
+сообщений через поддельный сервер Bot API (telegram_bot/fake_api.py; нужен
+aiogram, иначе пропускается).
+Запустить: python -m pytest test_push.py
+"""
+
+import asyncio
+import time as timer
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from app import db, push, waitlist
+from app.jobs import send_booking_reminders
+from app.models import User, Classroom, Booking, BookingQueue, TelegramOutbox
+from app.outbox import backoff
+
+DAY = date.today() + timedelta(days=3)
+
+
+@pytest.fixture
+def app(app):
+    app.config['BOOKING_REMINDER_MINUTES'] = 30
+    with app.app_context():
+        db.session.add(Classroom(room_number='101', capacity=30, floor=1))
+        for name, role in [('teacher', 'teacher'), ('student', 'student'), ('other', 'student')]:
+            user = User(username=name, email=f'{name}@example.com', role=role)
+            user.set_password('secret')
+            db.session.add(user)
+        db.session.commit()
+    return app
+
+
+def _link(app, username, chat_id):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': 'secret'})
+    client.get('/telegram_link')
+    with app.app_context():
+        code = User.query.filter_by(username=username).one().telegram_link_code
+        assert push.link(code, chat_id).username == username
+    return client
+
+
+def _book(user_id, start, end, day=DAY):
+    booking = Booking(user_id=user_id, classroom_id=1, booking_date=day, start_time=start, end_time=end,
+                      purpose='lecture', status='approved')
+    db.session.add(booking)
+    db.session.commit()
+    return booking
+
+
+def test_promotion_is_pushed_to_linked_chat(app):
+    teacher = _link(app, 'teacher', 500)
+    _link(app, 'student', 777)
+    with app.app_context():
+        assert User.query.filter_by(username='student').one().telegram_link_code is None
+        booking_id = _book(1, time(10, 0), time(12, 0)).id
+        waitlist.enqueue(2, 1, DAY, time(10, 0), time(11, 0))
+        waitlist.enqueue(3, 1, DAY, time(11, 0), time(12, 0))
+        db.session.commit()
+
+    teacher.get(f'/cancel_booking/{booking_id}')
+
+    with app.app_context():
+        # У other Telegram не привязан - ему только письмо
+        assert BookingQueue.query.filter_by(status='notified').count() == 2
+        (entry,) = TelegramOutbox.query.all()
+        assert entry.chat_id == 777 and 'Аудитория 101 свободна' in entry.text
+        # Старый код больше не подходит, чат можно перепривязать к другому пользователю
+        assert push.link('unknown', 777) is None
+
+
+def test_claim_keeps_chat_order_behind_retry(app):
+    with app.app_context():
+        student, other = User.query.filter(User.username.in_(['student', 'other'])).order_by(User.id)
+        student.telegram_chat_id, other.telegram_chat_id = 1, 2
+        for text in ('a1', 'b1', 'a2', 'a3'):
+            push.add(student if text[0] == 'a' else other, text)
+        db.session.commit()
+        now = datetime.utcnow()
+
+        batch = push.claim(now=now)
+        assert [item.text for item in batch] == ['a1', 'b1', 'a2', 'a3']
+        assert push.claim(now=now) == []
+        ids = {item.text: item.id for item in batch}
+        push.record({ids['a1']: (push.RETRY, 'timeout'), ids['a2']: (push.RELEASED, None),
+                     ids['a3']: (push.RELEASED, None), ids['b1']: (push.SENT, None)}, now=now)
+
+        # a2 и a3 свободны, но ждут повтора a1, чтобы не обогнать его
+        push.add(other, 'b2')
+        db.session.commit()
+        assert [item.text for item in push.claim()] == ['b2']
+        later = now + backoff(1) + timedelta(seconds=1)
+        assert [item.text for item in push.claim(now=later)] == ['a1', 'a2', 'a3']
+
+
+def test_reminders_are_queued_once(app):
+    now = datetime.combine(DAY, time(9, 40))
+    with app.app_context():
+        User.query.filter_by(username='student').one().telegram_chat_id = 777
+        soon = _book(2, time(10, 0), time(11, 0)).id
+        _book(2, time(11, 0), time(12, 0))
+        unlinked = _book(3, time(10, 0), time(11, 0)).id
+
+        assert send_booking_reminders(now=now) == 1
+        (entry,) = TelegramOutbox.query.all()
+        assert entry.chat_id == 777 and '10:00' in entry.text
+        assert db.session.get(Booking, soon).reminder_sent
+        assert db.session.get(Booking, unlinked).reminder_sent
+        assert send_booking_reminders(now=now) == 0
+        assert send_booking_reminders(now=now + timedelta(minutes=50)) == 1
+
+
+def test_booking_approved_during_reminders_is_not_skipped(app, monkeypatch):
+    now = datetime.combine(DAY, time(9, 40))
+    add = push.add
+    late = []
+
+    def add_and_book(user, text):
+        add(user, text)
+        if not late:
+            # Бронирование одобрили, пока задача ставила напоминания
+            late.append(_book(2, time(10, 5), time(11, 0)).id)
+
+    with app.app_context():
+        User.query.filter_by(username='student').one().telegram_chat_id = 777
+        _book(2, time(10, 0), time(10, 5))
+        monkeypatch.setattr(push, 'add', add_and_book)
+        assert send_booking_reminders(now=now) == 1
+        assert not db.session.get(Booking, late[0]).reminder_sent
+        assert send_booking_reminders(now=now) == 1
+        assert [entry.text[:20] for entry in TelegramOutbox.query.order_by(TelegramOutbox.id)] == [
+            'Напоминание: в 10:00', 'Напоминание: в 10:05']
+
+
+def test_sender_respects_limits_at_10k_messages(app):
+    pytest.importorskip('aiogram')
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from telegram_bot.fake_api import FakeBotAPI
+    from telegram_bot.push import PushSender
+
+    chats, per_chat, blocked = 1000, 10, 13
+    # Лимиты Telegram (30 в секунду, 1 в секунду в чат) ужаты по времени, чтобы тест шёл секунды
+    rate, interval = 3000, 0.05
+    with app.app_context():
+        db.session.execute(insert(TelegramOutbox), [
+            {'chat_id': chat, 'text': f'{chat}:{seq}', 'next_attempt_at': datetime.utcnow()}
+            for seq in range(per_chat) for chat in range(1, chats + 1)
+        ])
+        db.session.commit()
+
+    async def run():
+        async with FakeBotAPI(global_rate=rate, chat_interval=interval) as api:
+            api.blocked.add(blocked)
+            api.floods = 3
+            api.flood_retry_after = 1
+            bot = Bot('42:TEST', session=AiohttpSession(api=TelegramAPIServer.from_base(api.url)))
+            sender = PushSender(rate=rate * 0.9, chat_interval=interval, concurrency=100)
+            sender.app = app
+            began = timer.perf_counter()
+            while await sender.run_once(bot):
+                pass
+            elapsed = timer.perf_counter() - began
+            await bot.session.close()
+            return api, elapsed
+
+    api, elapsed = asyncio.run(run())
+
+    delivered = chats * per_chat - per_chat
+    assert len(api.sent) == delivered
+    # 429 были только подброшенные: клиентские лимиты не превышались
+    assert api.rejected == 3
+    by_chat = defaultdict(list)
+    for sent_at, chat, text in api.sent:
+        by_chat[chat].append((sent_at, int(text.partition(':')[2])))
+    for chat, sends in by_chat.items():
+        assert [seq for _, seq in sends] == list(range(per_chat))
+        assert all(b[0] - a[0] >= interval * 0.6 for a, b in zip(sends, sends[1:]))
+    times = [sent_at for sent_at, _, _ in api.sent]
+    start = 0
+    for end, moment in enumerate(times):
+        while times[start] <= moment - 1:
+            start += 1
+        assert end - start + 1 <= rate
+
+    with app.app_context():
+        assert TelegramOutbox.query.filter_by(status='sent').count() == delivered
+        assert TelegramOutbox.query.filter_by(status='failed', chat_id=blocked).count() == per_chat
+    print(f'{delivered} сообщений за {elapsed:.2f} с ({delivered / elapsed:.0f} в секунду)')
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
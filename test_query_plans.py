@@ -0,0 +1,83 @@
+"""
+Проверка планов запросов: горячие фильтры по booking и booking_queue
+должны идти через составные индексы, а не полным сканированием таблицы.
+
+SQLite проверяется всегда (in-memory база). Для Postgres укажите
+TEST_POSTGRES_URL - тесты создадут таблицы в этой базе, поэтому
+используйте отдельную тестовую базу.
+
+Запустить: python -m pytest test_query_plans.py
+"""
+
+import os
+from datetime import date, datetime, time
+
+import pytest
+from sqlalchemy import text
+
+from app import db
+from app.jobs import _expired_filter
+from app.models import Booking, BookingQueue
+from conftest import make_app
+
+DAY = date(2030, 1, 1)
+START = time(10, 0)
+END = time(12, 0)
+
+
+def hot_queries():
+    """Запросы, которые выполняются на каждое бронирование / проверку доступности
+    и раз в минуту фоновой задачей"""
+    return {
+        'ix_booking_classroom_date_status': Booking.query.filter(
+            Booking.classroom_id == 1,
+            Booking.booking_date == DAY,
+            Booking.status.in_(['pending', 'approved']),
+            Booking.overlaps(START, END)
+        ),
+        'ix_booking_user_date': Booking.query.filter(
+            Booking.user_id == 1,
+            Booking.booking_date == DAY,
+            Booking.status.in_(['pending', 'approved']),
+            Booking.overlaps(START, END)
+        ),
+        'ix_booking_queue_waiting': BookingQueue.query.filter(
+            BookingQueue.classroom_id == 1,
+            BookingQueue.booking_date == DAY,
+            BookingQueue.status == 'waiting',
+            BookingQueue.overlaps(START, END)
+        ).order_by(BookingQueue.order_key),
+        'ix_booking_active_date': Booking.query.filter(_expired_filter(datetime.combine(DAY, START))),
+    }
+
+
+def _compile(query):
+    return str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+
+
+def test_sqlite_query_plans_use_indexes(app_context):
+    for index_name, query in hot_queries().items():
+        plan = db.session.execute(text('EXPLAIN QUERY PLAN ' + _compile(query))).fetchall()
+        details = ' | '.join(row[-1] for row in plan)
+        assert index_name in details, details
+        assert 'SCAN booking' not in details, details
+
+
+@pytest.mark.skipif(not os.environ.get('TEST_POSTGRES_URL'), reason='TEST_POSTGRES_URL не задан')
+def test_postgres_query_plans_use_indexes():
+    app = make_app(SQLALCHEMY_DATABASE_URI=os.environ['TEST_POSTGRES_URL'])
+
+    with app.app_context():
+        # На пустых таблицах Postgres всегда выбирает Seq Scan как самый дешёвый,
+        # поэтому запрещаем его и проверяем, что индекс вообще применим
+        db.session.execute(text('SET enable_seqscan = off'))
+        for index_name, query in hot_queries().items():
+            plan = db.session.execute(text('EXPLAIN ' + _compile(query))).fetchall()
+            details = ' | '.join(row[0] for row in plan)
+            assert index_name in details, details
+            assert 'Seq Scan' not in details, details
+        db.session.rollback()
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
@@ -0,0 +1,363 @@
+"""
+Развёртывание регулярных бронирований: все даты серии, отчёт о конфликтах
+и фиксированное число запросов независимо от длины серии. Гонка с
+admission.admit проверяется на файловой SQLite-базе.
+Запустить: python -m pytest test_recurrence.py
+"""
+
+import threading
+import time as timer
+from datetime import date, datetime, time, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+from app import db, admission, occupancy, recurrence, rollup, waitlist
+from app.jobs import extend_recurring_series
+from app.models import (User, Classroom, Booking, BookingQueue, RecurringBooking, BookingDailyRollup,
+                        RoomOccupancy)
+from conftest import make_app
+
+MONDAY = date(2030, 1, 7)
+
+
+def _rows(model):
+    return sorted(row for row in db.session.execute(model.__table__.select()).all() if any(row[2:]))
+
+
+def _seed():
+    teacher = User(username='teacher', email='teacher@example.com', role='teacher')
+    teacher.set_password('secret')
+    db.session.add(teacher)
+    db.session.add(User(username='student', email='student@example.com', role='student'))
+    db.session.add_all([Classroom(room_number=str(100 + i), capacity=30, floor=1) for i in range(2)])
+    db.session.commit()
+
+
+def _setup(**config):
+    app = make_app(**config)
+    with app.app_context():
+        _seed()
+    return app
+
+
+@pytest.fixture
+def app():
+    return _setup()
+
+
+def _series(weeks, **kwargs):
+    values = dict(user_id=1, classroom_id=1, start_date=MONDAY, end_date=MONDAY + timedelta(weeks=weeks),
+                  day_of_week=2, start_time=time(10, 0), end_time=time(12, 0), purpose='lecture',
+                  recurrence_type='weekly')
+    values.update(kwargs)
+    series = RecurringBooking(**values)
+    db.session.add(series)
+    db.session.flush()
+    return series
+
+
+def test_occurrence_dates():
+    series = RecurringBooking(start_date=MONDAY, end_date=MONDAY + timedelta(days=29),
+                              day_of_week=2, recurrence_type='biweekly')
+    assert recurrence.occurrence_dates(series) == [date(2030, 1, 9), date(2030, 1, 23)]
+    # Чередование недель сохраняется при сдвиге начала окна
+    assert recurrence.occurrence_dates(series, date_from=date(2030, 1, 10)) == [date(2030, 1, 23)]
+    series.recurrence_type = 'weekly'
+    assert recurrence.occurrence_dates(series, date_to=date(2030, 1, 20)) == [date(2030, 1, 9), date(2030, 1, 16)]
+
+
+def test_materialize_reports_conflicts_and_stays_consistent(app):
+
+    with app.app_context():
+        busy_day = date(2030, 1, 23)
+        db.session.add(Booking(user_id=1, classroom_id=1, booking_date=busy_day, start_time=time(11, 0),
+                               end_time=time(13, 0), purpose='exam', status='approved'))
+        db.session.add(Booking(user_id=1, classroom_id=1, booking_date=busy_day + timedelta(days=7),
+                               start_time=time(11, 0), end_time=time(13, 0), purpose='old', status='rejected'))
+        db.session.commit()
+        rollup.rebuild()
+        occupancy.rebuild()
+        db.session.commit()
+
+        first = _series(8)
+        # Вторая серия той же пачки пересекается с первой в каждую дату
+        second = _series(8, start_time=time(11, 0), end_time=time(12, 30))
+        occurrences = recurrence.materialize([first, second])
+        db.session.commit()
+
+        report = {(o.series.id, o.day): o.conflict for o in occurrences}
+        assert len(report) == 16
+        assert report[(first.id, busy_day)] is not None
+        assert all(report[(second.id, o.day)] is not None for o in occurrences)
+        created = Booking.query.filter_by(recurring_booking_id=first.id).all()
+        assert len(created) == 7
+        assert busy_day not in {booking.booking_date for booking in created}
+        assert {booking.status for booking in created} == {'approved'}
+
+        # Приращения сводки и масок совпадают с полным пересчётом
+        for model, rebuild in ((BookingDailyRollup, rollup.rebuild), (RoomOccupancy, occupancy.rebuild)):
+            before = _rows(model)
+            rebuild()
+            db.session.commit()
+            assert _rows(model) == before
+
+
+def _count_materialize_queries(weeks):
+    app = _setup()
+
+    with app.app_context():
+        series = _series(weeks)
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            occurrences = recurrence.materialize([series])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        db.session.commit()
+        assert Booking.query.count() == len(occurrences)
+        return len(statements)
+
+
+def test_query_count_does_not_depend_on_series_length():
+    short = _count_materialize_queries(4)
+    semester = _count_materialize_queries(18)
+    assert short == semester, f'{short} запросов для 4 недель, {semester} для 18'
+
+
+class _PostgresLocks:
+    """
+    Соединение для admission, выдающее себя за Postgres: запросы блокировок
+    записываются и не выполняются (SQLite берёт одну блокировку на всю базу)
+    """
+
+    def __init__(self):
+        self.dialect = SimpleNamespace(name='postgresql')
+        self.statements = []
+
+    def execute(self, statement, parameters=None):
+        self.statements.append((str(statement), parameters))
+
+
+def _postgres_lock_statements(app, weeks, monkeypatch):
+    with app.app_context():
+        series = _series(weeks)
+        locks = _PostgresLocks()
+        monkeypatch.setattr(db.session, 'connection', lambda: locks)
+        occurrences = recurrence.materialize([series])
+        monkeypatch.undo()
+        db.session.rollback()
+        return locks.statements, occurrences
+
+
+def test_postgres_locks_are_taken_in_one_statement(app, monkeypatch):
+    short, _ = _postgres_lock_statements(app, 4, monkeypatch)
+    semester, occurrences = _postgres_lock_statements(app, 18, monkeypatch)
+    assert len(short) == len(semester) == 1
+    statement, parameters = semester[0]
+    assert 'pg_advisory_xact_lock' in statement and 'ORDER BY n' in statement
+    # Пары в том же порядке, что у последовательных admission.lock
+    assert parameters == {'a': [1] * len(occurrences),
+                          'b': sorted(occurrence.day.toordinal() for occurrence in occurrences)}
+
+
+def test_recurring_booking_route_creates_series_up_to_horizon(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'teacher', 'password': 'secret'})
+    start = date.today() + timedelta(days=1)
+
+    response = client.post('/recurring_booking', data={
+        'classroom_id': 1,
+        'start_date': start.isoformat(),
+        'end_date': (start + timedelta(weeks=18)).isoformat(),
+        'day_of_week': start.weekday(),
+        'start_time': '10:00',
+        'end_time': '12:00',
+        'recurrence_type': 'weekly',
+        'purpose': 'semester lecture'
+    })
+    assert response.status_code == 302
+
+    with app.app_context():
+        bookings = Booking.query.order_by(Booking.booking_date).all()
+        horizon = recurrence.horizon()
+        assert len(bookings) == (horizon - start).days // 7 + 1
+        assert bookings[0].booking_date == start
+        assert all(booking.booking_date.weekday() == start.weekday() for booking in bookings)
+        assert RecurringBooking.query.one().materialized_until == horizon
+
+
+def test_recurring_booking_route_skips_held_dates(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'teacher', 'password': 'secret'})
+    start = date.today() + timedelta(days=1)
+    with app.app_context():
+        entry = waitlist.enqueue(2, 1, start, time(11, 0), time(12, 0))
+        entry.status = 'notified'
+        entry.hold_expires_at = datetime.now() + timedelta(hours=1)
+        db.session.commit()
+
+    response = client.post('/recurring_booking', data={
+        'classroom_id': 1,
+        'start_date': start.isoformat(),
+        'end_date': (start + timedelta(weeks=2)).isoformat(),
+        'day_of_week': start.weekday(),
+        'start_time': '10:00',
+        'end_time': '12:00',
+        'recurrence_type': 'weekly',
+        'purpose': 'lecture'
+    }, follow_redirects=True)
+    assert 'они пропущены: ' + start.strftime('%d.%m.%Y') in response.get_data(as_text=True)
+
+    with app.app_context():
+        assert [b.booking_date for b in Booking.query.order_by(Booking.booking_date)] == [
+            start + timedelta(weeks=1), start + timedelta(weeks=2)]
+
+
+def test_recurring_preview_is_cached_until_bookings_change(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'teacher', 'password': 'secret'})
+    start = date.today() + timedelta(days=1)
+    params = {
+        'classroom_id': 1,
+        'start_date': start.isoformat(),
+        'end_date': (start + timedelta(weeks=104)).isoformat(),
+        'day_of_week': start.weekday(),
+        'start_time': '10:00',
+        'end_time': '12:00',
+        'recurrence_type': 'weekly'
+    }
+
+    with app.app_context():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            first = client.get('/api/recurring_preview', query_string=params).get_json()['preview']
+            booking_queries = sum('FROM booking' in statement for statement in statements)
+            # Другое время в том же периоде берётся из кэша, без запроса к booking
+            client.get('/api/recurring_preview', query_string={**params, 'start_time': '11:00'})
+            assert sum('FROM booking' in statement for statement in statements) == booking_queries == 1
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    assert len(first) == 105
+    assert all(item['available'] for item in first)
+
+    # Новое бронирование меняет версию аудитории, и кэш больше не используется
+    client.post('/booking', data={
+        'classroom_id': 1, 'booking_date': (start + timedelta(weeks=1)).isoformat(),
+        'start_time': '11:00', 'end_time': '13:00', 'purpose': 'exam'
+    })
+    second = client.get('/api/recurring_preview', query_string=params).get_json()['preview']
+    assert [item['conflict'] for item in second[:3]] == [False, True, False]
+
+    response = client.get('/api/recurring_preview', query_string={**params, 'end_time': '09:00'})
+    assert response.status_code == 400
+
+
+def test_extend_recurring_series_generates_only_new_tail(app):
+
+    with app.app_context():
+        today = MONDAY
+        for room in (1, 2):
+            for weekday in range(5):
+                _series(18, classroom_id=room, day_of_week=weekday)
+        db.session.commit()
+
+        first_run = extend_recurring_series(today=today, batch_size=3)
+        horizon = recurrence.horizon(today)
+        assert first_run == Booking.query.count()
+        assert all(booking.booking_date <= horizon for booking in Booking.query)
+        # Повторный запуск в тот же день ничего не создаёт
+        assert extend_recurring_series(today=today, batch_size=3) == 0
+
+        # Через неделю появляется ровно одна новая неделя для каждой из 10 серий
+        assert extend_recurring_series(today=today + timedelta(days=7), batch_size=3) == 10
+        duplicates = db.session.query(Booking.classroom_id, Booking.booking_date, Booking.start_time).group_by(
+            Booking.classroom_id, Booking.booking_date, Booking.start_time
+        ).having(db.func.count() > 1).all()
+        assert not duplicates
+
+        # Хвост серии не выходит за её end_date
+        for week in range(2, 16):
+            extend_recurring_series(today=today + timedelta(weeks=week))
+        series = db.session.get(RecurringBooking, 1)
+        assert Booking.query.filter_by(recurring_booking_id=1).count() == len(recurrence.occurrence_dates(series)) == 19
+        assert series.materialized_until == series.end_date
+        assert extend_recurring_series(today=today + timedelta(weeks=16)) == 0
+
+
+def test_live_holds_of_others_block_occurrences(app):
+    first_day = date(2030, 1, 9)
+
+    with app.app_context():
+        now = datetime(2030, 1, 1, 9, 0)
+        for user_id, day, expires in ((2, first_day, now + timedelta(hours=1)),
+                                      (2, first_day + timedelta(days=7), now - timedelta(minutes=1)),
+                                      (1, first_day + timedelta(days=14), now + timedelta(hours=1))):
+            entry = waitlist.enqueue(user_id, 1, day, time(11, 0), time(12, 0))
+            entry.status = 'notified'
+            entry.hold_expires_at = expires
+        db.session.commit()
+
+        occurrences = recurrence.materialize([_series(3)], now=now)
+        db.session.commit()
+        # Блокирует только действующее чужое удержание; истёкшее и своё - нет
+        assert [o.day for o in occurrences if o.conflict] == [first_day]
+        assert Booking.query.count() == 2
+        assert BookingQueue.query.count() == 3
+
+
+def test_admit_cannot_slip_in_while_series_is_materialized(tmp_path):
+    app = _setup(SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'race.db'))
+    first_day = date(2030, 1, 9)
+    reading = threading.Event()
+    results = []
+    booked_slots = recurrence._booked_slots
+
+    def slow_booked_slots(keys):
+        # Заявка стартует, когда серия уже прочитала занятость, но ещё не вставила бронирования
+        slots = booked_slots(keys)
+        reading.set()
+        timer.sleep(0.3)
+        return slots
+
+    def submit():
+        with app.app_context():
+            student = User.query.filter_by(username='student').one()
+            db.session.close()
+            assert reading.wait(10)
+            try:
+                results.append(admission.admit(student, 1, first_day, time(10, 0), time(11, 0), 'study',
+                                               enqueue=False).status)
+            finally:
+                db.session.remove()
+
+    with app.app_context():
+        _series(3)
+        db.session.commit()
+        thread = threading.Thread(target=submit)
+        thread.start()
+        recurrence._booked_slots = slow_booked_slots
+        try:
+            extend_recurring_series(today=MONDAY)
+        finally:
+            recurrence._booked_slots = booked_slots
+        thread.join()
+
+        assert results == [admission.ROOM_CONFLICT]
+        day = Booking.query.filter_by(classroom_id=1, booking_date=first_day).all()
+        assert [booking.purpose for booking in day] == ['lecture']
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
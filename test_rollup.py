@@ -0,0 +1,81 @@
+"""
+Дневная сводка, обновляемая приращениями в маршрутах, должна совпадать
+с полным пересчётом по таблице booking.
+Запустить: python -m pytest test_rollup.py
+"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from app import db, rollup
+from app.models import User, Classroom, Booking, BookingDailyRollup
+
+
+def _snapshot():
+    return {
+        (row.day, row.classroom_id): (
+            row.booking_count, row.booked_minutes, row.pending_count,
+            row.approved_count, row.rejected_count, row.completed_count
+        )
+        for row in BookingDailyRollup.query.all()
+        if row.booking_count or row.pending_count or row.approved_count
+        or row.rejected_count or row.completed_count
+    }
+
+
+def _login(app, username):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': 'secret'})
+    return client
+
+
+def test_route_transitions_match_rebuild(app):
+    with app.app_context():
+        db.session.add_all([Classroom(room_number=str(400 + i), capacity=30, floor=4) for i in range(3)])
+        for username, role in [('teacher', 'teacher'), ('student', 'student')]:
+            user = User(username=username, email=f'{username}@example.com', role=role)
+            user.set_password('secret')
+            db.session.add(user)
+        db.session.commit()
+
+    teacher = _login(app, 'teacher')
+    student = _login(app, 'student')
+    day = (date.today() + timedelta(days=3)).strftime('%Y-%m-%d')
+
+    def book(client, classroom_id, start, end):
+        client.post('/booking', data={
+            'classroom_id': classroom_id, 'booking_date': day,
+            'start_time': start, 'end_time': end, 'purpose': 'test'
+        })
+
+    book(teacher, 1, '08:00', '10:00')
+    book(student, 2, '10:00', '12:00')
+    book(student, 3, '13:00', '14:00')
+    book(teacher, 3, '15:00', '18:00')
+
+    with app.app_context():
+        pending = Booking.query.filter_by(status='pending').order_by(Booking.id).all()
+        assert len(pending) == 2
+        first_id, second_id = pending[0].id, pending[1].id
+        teacher_booking_id = Booking.query.filter_by(classroom_id=1).first().id
+
+    teacher.get(f'/admin/approve_booking/{first_id}')
+    teacher.get(f'/admin/reject_booking/{second_id}')
+    teacher.get(f'/cancel_booking/{teacher_booking_id}')
+
+    with app.app_context():
+        incremental = _snapshot()
+        assert sum(counters[0] for counters in incremental.values()) == 2
+        rollup.rebuild()
+        db.session.commit()
+        assert _snapshot() == incremental
+
+    stats = teacher.get('/api/admin_stats').get_json()
+    assert stats['total_bookings'] == 2
+    assert stats['rejected_bookings'] == 1
+    assert stats['booked_minutes'] == 5 * 60
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
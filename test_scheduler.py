@@ -0,0 +1,130 @@
+"""
+Планировщик: выбор лидера через аренду в БД и задача завершения прошедших
+бронирований. Страница профиля не должна ничего писать в БД.
+Запустить: python -m pytest test_scheduler.py
+"""
+
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import db, occupancy, rollup
+from app.jobs import complete_past_bookings
+from app.models import User, Classroom, Booking, BookingDailyRollup, RoomOccupancy, SchedulerLease
+from app.scheduler import Scheduler
+
+NOW = datetime(2030, 1, 10, 12, 0)
+
+
+def _rows(model):
+    # Нулевые строки сводки и масок эквивалентны отсутствующим
+    return sorted(row for row in db.session.execute(model.__table__.select()).all() if any(row[2:]))
+
+
+def test_only_one_scheduler_holds_the_lease(app_context):
+    first, second = Scheduler(), Scheduler()
+
+    assert first.acquire('job', ttl=60)
+    assert not second.acquire('job', ttl=60)
+    # Лидер продлевает свою аренду
+    assert first.acquire('job', ttl=60)
+
+    # Лидер пропал - после истечения аренды её забирает другой процесс
+    SchedulerLease.query.filter_by(name='job').update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert second.acquire('job', ttl=60)
+    assert not first.acquire('job', ttl=60)
+
+    second.release('job')
+    assert first.acquire('job', ttl=60)
+
+
+def test_run_pending_runs_job_only_on_leader(app_context):
+    calls = []
+    leader, follower = Scheduler(), Scheduler()
+    for scheduler in (leader, follower):
+        scheduler.job('tick', interval=60)(lambda: calls.append(1))
+
+    leader.run_pending(NOW)
+    follower.run_pending(NOW)
+    assert len(calls) == 1
+    # До следующего интервала задача не запускается повторно
+    leader.run_pending(NOW + timedelta(seconds=30))
+    assert len(calls) == 1
+    leader.run_pending(NOW + timedelta(seconds=61))
+    assert len(calls) == 2
+
+
+def test_complete_past_bookings_keeps_rollup_and_occupancy_consistent(app_context):
+    user = User(username='u', email='u@example.com')
+    rooms = [Classroom(room_number=str(i), capacity=20, floor=1) for i in range(2)]
+    db.session.add(user)
+    db.session.add_all(rooms)
+    db.session.commit()
+
+    cases = [
+        (NOW.date() - timedelta(days=1), time(9, 0), time(10, 0), 'pending', 'completed'),
+        (NOW.date() - timedelta(days=1), time(10, 0), time(12, 0), 'approved', 'completed'),
+        (NOW.date(), time(8, 0), time(11, 0), 'approved', 'completed'),
+        (NOW.date(), time(11, 0), time(13, 0), 'pending', 'pending'),
+        (NOW.date() - timedelta(days=2), time(9, 0), time(10, 0), 'rejected', 'rejected'),
+        (NOW.date() + timedelta(days=1), time(9, 0), time(10, 0), 'approved', 'approved'),
+    ]
+    bookings = []
+    for i, (day, start, end, status, _) in enumerate(cases):
+        booking = Booking(user_id=user.id, classroom_id=rooms[i % 2].id, booking_date=day,
+                          start_time=start, end_time=end, purpose='test', status=status)
+        db.session.add(booking)
+        db.session.flush()
+        rollup.record(booking, None, status)
+        bookings.append(booking)
+    occupancy.refresh_for(bookings)
+    db.session.commit()
+
+    # Пачками по две: сводка и маски всё равно сходятся с пересчётом
+    assert complete_past_bookings(NOW, batch_size=2) == 3
+    assert complete_past_bookings(NOW) == 0
+    db.session.expire_all()
+    assert [booking.status for booking in bookings] == [case[-1] for case in cases]
+
+    # Приращения совпадают с полным пересчётом
+    for model, rebuild in ((BookingDailyRollup, rollup.rebuild), (RoomOccupancy, occupancy.rebuild)):
+        before = _rows(model)
+        rebuild()
+        db.session.commit()
+        assert _rows(model) == before
+
+
+def test_profile_does_not_write(app):
+    with app.app_context():
+        user = User(username='student', email='student@example.com')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.add(Classroom(room_number='101', capacity=20, floor=1))
+        db.session.commit()
+        db.session.add(Booking(user_id=user.id, classroom_id=1, booking_date=date.today() - timedelta(days=1),
+                               start_time=time(9, 0), end_time=time(10, 0), purpose='test', status='approved'))
+        db.session.commit()
+
+        client = app.test_client()
+        client.post('/login', data={'username': 'student', 'password': 'secret'})
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = client.get('/profile')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+        assert response.status_code == 200
+        writes = [s for s in statements if s.lstrip().split()[0].upper() in ('INSERT', 'UPDATE', 'DELETE')]
+        assert not writes, writes
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
@@ -0,0 +1,196 @@
+"""
+Слой доступа к базе бота: WAL, один поток записи с пакетными коммитами,
+пул читающих соединений.
+Запустить: python -m pytest test_telegram_db.py
+"""
+
+import asyncio
+import os
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from telegram_bot import db
+
+
+def _run(path, scenario):
+    async def main():
+        await db.init_db(path)
+        try:
+            return await scenario()
+        finally:
+            await db.close_db()
+    return asyncio.run(main())
+
+
+def test_database_uses_wal(tmp_path):
+    path = tmp_path / 'bot.db'
+    _run(path, lambda: db.create_user(1, 'student'))
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_concurrent_adds_are_committed_in_batches(tmp_path):
+    async def scenario():
+        await asyncio.gather(*(db.create_user(i, f'user{i}') for i in range(50)))
+        orders = await asyncio.gather(*(db.add_order_for_telegram(i % 50, f'order {i}') for i in range(500)))
+        commits = db._db.commits
+        return orders, commits, await db.list_orders_for_telegram(7), await db.stats_for_telegram(7)
+
+    orders, commits, listed, stats = _run(tmp_path / 'bot.db', scenario)
+    assert len({order['id'] for order in orders}) == 500
+    # 550 записей уложились в заметно меньшее число транзакций
+    assert commits < 100
+    assert len(listed) == 10
+    assert stats['total_orders'] == 500 and stats['user_orders'] == 10
+
+
+def test_failed_write_does_not_roll_back_the_batch(tmp_path):
+    async def scenario():
+        await db.create_user(1, 'student')
+
+        def broken(conn):
+            conn.execute("INSERT INTO orders (user_id, description, created_at) VALUES (1, 'lost', 'now')")
+            raise ValueError('boom')
+
+        results = await asyncio.gather(
+            db.add_order_for_telegram(1, 'first'),
+            db._database().write(broken),
+            db.add_order_for_telegram(1, 'second'),
+            return_exceptions=True
+        )
+        return results, await db.list_orders_for_telegram(1)
+
+    results, listed = _run(tmp_path / 'bot.db', scenario)
+    assert isinstance(results[1], ValueError)
+    assert sorted(order['description'] for order in listed) == ['first', 'second']
+
+
+def test_helpers_keep_their_contract(tmp_path):
+    async def scenario():
+        assert await db.add_order_for_telegram(1, 'nobody') is None
+        user = await db.create_user(1, 'student', 'Student')
+        assert (await db.create_user(1, 'student'))['id'] == user['id']
+        assert (await db.get_user_by_telegram_id(1))['full_name'] == 'Student'
+        order = await db.add_order_for_telegram(1, 'lecture notes')
+        await db.create_user(2, 'other')
+        assert not await db.delete_order_for_telegram(2, order['id'])
+        assert await db.delete_order_for_telegram(1, order['id'])
+        assert await db.list_orders_for_telegram(1) == []
+
+    _run(tmp_path / 'bot.db', scenario)
+
+
+def test_stats_counters_follow_adds_and_deletes(tmp_path):
+    async def scenario():
+        await db.create_user(1, 'student')
+        await db.create_user(2, 'other')
+        orders = [await db.add_order_for_telegram(1 + i % 2, f'order {i}') for i in range(6)]
+        await db.delete_order_for_telegram(1, orders[0]['id'])
+        return await db.stats_for_telegram(1), await db.stats_for_telegram(2), await db.stats_for_telegram(3)
+
+    mine, other, unknown = _run(tmp_path / 'bot.db', scenario)
+    assert (mine['total_orders'], mine['user_orders']) == (5, 2)
+    assert other['user_orders'] == 3
+    assert unknown['user_orders'] == 0
+    assert [r['description'] for r in mine['recent']] == [f'order {i}' for i in range(5, 0, -1)]
+
+
+def test_counters_are_backfilled_for_an_existing_database(tmp_path):
+    path = tmp_path / 'bot.db'
+    with sqlite3.connect(path) as conn:
+        conn.executescript(db.SCHEMA.split('CREATE INDEX')[0])
+        conn.execute("INSERT INTO users (telegram_id, username) VALUES (1, 'student')")
+        conn.executemany("INSERT INTO orders (user_id, description, created_at) VALUES (1, ?, '2024-01-01')",
+                         [(f'order {i}',) for i in range(3)])
+    conn.close()
+
+    stats = _run(path, lambda: db.stats_for_telegram(1))
+    assert (stats['total_orders'], stats['user_orders']) == (3, 3)
+    # Повторный запуск не считает заказы второй раз
+    assert _run(path, lambda: db.stats_for_telegram(1))['total_orders'] == 3
+
+
+def test_stats_queries_do_not_scan_orders(tmp_path):
+    path = tmp_path / 'bot.db'
+    _run(path, lambda: db.create_user(1, 'student'))
+    with sqlite3.connect(path) as conn:
+        plan = ' '.join(row[3] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT o.id, u.username, o.description, o.created_at FROM orders o '
+            'JOIN users u ON o.user_id=u.id ORDER BY o.created_at DESC LIMIT 5'))
+    conn.close()
+    assert 'ix_orders_created_at' in plan and 'TEMP B-TREE' not in plan
+
+
+def test_orders_are_paged_by_created_at_and_id(tmp_path):
+    path = tmp_path / 'bot.db'
+
+    async def scenario():
+        await db.create_user(1, 'student')
+
+        def add_same_second(conn):
+            # Заказы с одинаковым created_at различает только id
+            conn.executemany("INSERT INTO orders (user_id, description, created_at) VALUES (1, ?, '2024-01-01T10:00:00')",
+                             [(f'order {i}',) for i in range(7)])
+        await db._database().write(add_same_second)
+
+        pages, after = [], None
+        while True:
+            page = await db.list_orders_for_telegram(1, after=after, limit=3)
+            if not page:
+                return pages, await db.list_orders_for_telegram(1)
+            pages.append([order['id'] for order in page])
+            after = (page[-1]['created_at'], page[-1]['id'])
+
+    pages, everything = _run(path, scenario)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == [order['id'] for order in everything] == list(range(7, 0, -1))
+
+
+def test_forged_orders_button_is_answered_without_paging(tmp_path):
+    pytest.importorskip('aiogram')
+    os.environ.setdefault('BOT_TOKEN', '42:TEST')
+    from aiogram import Bot
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import AnswerCallbackQuery
+    from aiogram.types import CallbackQuery, Chat, Message, Update, User as TelegramUser
+    from telegram_bot import bot as telegram_bot
+
+    class FakeSession(BaseSession):
+        """Транспорт Bot API в памяти: запоминает вызванные методы"""
+
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls.append(method)
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b''
+
+        async def close(self):
+            pass
+
+    session = FakeSession()
+    fake_bot = Bot('42:TEST', session=session)
+    sender = TelegramUser(id=1, is_bot=False, first_name='student')
+    shown = Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type='private'), text='1. order')
+
+    async def scenario():
+        await db.create_user(1, 'student')
+        for i, data in enumerate(['orders:garbage', 'orders:2024-01-01T10:00:00|1x', 'orders:|7']):
+            query = CallbackQuery(id=str(i), from_user=sender, chat_instance='1', message=shown, data=data)
+            await telegram_bot.dp.feed_update(fake_bot, Update(update_id=i, callback_query=query))
+        return session.calls
+
+    calls = _run(tmp_path / 'bot.db', scenario)
+    # Только ответ на нажатие: ни новой страницы, ни правки кнопки
+    assert [type(call) for call in calls] == [AnswerCallbackQuery] * 3
+    assert all('Некорректная кнопка' in call.text for call in calls)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
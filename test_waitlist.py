@@ -0,0 +1,242 @@
+"""
+Очередь ожидания: постановка и удаление меняют одну строку, позиции
+считаются при чтении, освободившийся слот достаётся первому ожидающему
+с пересекающимся и теперь свободным интервалом и удерживается за ним до
+подтверждения или истечения срока.
+Запустить: python -m pytest test_waitlist.py
+"""
+
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from sqlalchemy import event, insert
+
+from app import db, admission, waitlist
+from app.jobs import expire_queue_holds
+from app.models import User, Classroom, Booking, BookingQueue
+
+DAY = date.today() + timedelta(days=3)
+
+
+@pytest.fixture
+def app(app):
+    with app.app_context():
+        db.session.add(Classroom(room_number='101', capacity=30, floor=1))
+        for name, role in [('teacher', 'teacher')] + [(f'student{i}', 'student') for i in range(5)]:
+            user = User(username=name, email=f'{name}@example.com', role=role)
+            user.set_password('secret')
+            db.session.add(user)
+        db.session.commit()
+    return app
+
+
+def _book(user_id, start, end):
+    booking = Booking(user_id=user_id, classroom_id=1, booking_date=DAY, start_time=start, end_time=end,
+                      purpose='lecture', status='approved')
+    db.session.add(booking)
+    db.session.commit()
+    return booking
+
+
+def _enqueue(user_id, start, end):
+    entry = waitlist.enqueue(user_id, 1, DAY, start, end)
+    db.session.commit()
+    return entry
+
+
+def _user(name):
+    return User.query.filter_by(username=name).one()
+
+
+def _hold(user_id, start, end, expires_at):
+    entry = _enqueue(user_id, start, end)
+    entry.status = 'notified'
+    entry.hold_expires_at = expires_at
+    db.session.commit()
+    return entry
+
+
+def _statements(action):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        action()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return statements
+
+
+def _writes(action):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        action()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return statements
+
+
+def test_enqueue_and_remove_touch_one_row(app):
+    with app.app_context():
+        entries = [_enqueue(2 + i, time(10, 0), time(12, 0)) for i in range(4)]
+
+        writes = _writes(lambda: _enqueue(6, time(10, 0), time(12, 0)))
+        assert len(writes) == 1 and writes[0].lstrip().upper().startswith('INSERT')
+
+        middle = entries[1]
+
+        def remove():
+            db.session.delete(middle)
+            db.session.commit()
+
+        writes = _writes(remove)
+        assert len(writes) == 1 and writes[0].lstrip().upper().startswith('DELETE')
+
+        remaining = BookingQueue.query.order_by(BookingQueue.order_key).all()
+        positions = waitlist.positions(remaining)
+        assert [positions[entry.id] for entry in remaining] == [1, 2, 3, 4]
+        assert positions[entries[2].id] == 2
+
+
+def test_positions_count_only_overlapping_waiters(app):
+    with app.app_context():
+        morning = _enqueue(2, time(8, 0), time(10, 0))
+        wide = _enqueue(3, time(9, 0), time(12, 0))
+        late = _enqueue(4, time(11, 0), time(12, 0))
+        notified = _enqueue(5, time(11, 0), time(13, 0))
+        notified.status = 'notified'
+        db.session.commit()
+
+        positions = waitlist.positions([morning, wide, late, notified])
+        assert positions == {morning.id: 1, wide.id: 2, late.id: 2, notified.id: None}
+
+
+def test_head_matches_by_overlap_and_skips_blocked_waiters(app):
+    with app.app_context():
+        first = _book(1, time(10, 0), time(12, 0))
+        _book(1, time(12, 0), time(14, 0))
+        blocked = _enqueue(2, time(11, 0), time(13, 0))
+        free = _enqueue(3, time(10, 30), time(11, 30))
+
+        # Ожидающий с 11 до 13 всё ещё упирается во второе бронирование
+        db.session.delete(first)
+        db.session.commit()
+        assert waitlist.head(1, DAY, time(10, 0), time(12, 0)).id == free.id
+        assert blocked.id < free.id
+
+        assert waitlist.head(1, DAY, time(14, 0), time(15, 0)) is None
+
+
+def test_cancel_booking_notifies_first_matching_waiter(app):
+    with app.app_context():
+        booking = _book(1, time(10, 0), time(12, 0))
+        booking_id = booking.id
+        first = _enqueue(2, time(11, 0), time(12, 0)).id
+        second = _enqueue(3, time(10, 0), time(12, 0)).id
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'teacher', 'password': 'secret'})
+    client.get(f'/cancel_booking/{booking_id}')
+
+    with app.app_context():
+        held = db.session.get(BookingQueue, first)
+        assert held.status == 'notified'
+        assert held.hold_expires_at > datetime.now() + timedelta(minutes=55)
+        assert db.session.get(BookingQueue, second).status == 'waiting'
+        assert waitlist.positions([db.session.get(BookingQueue, second)]) == {second: 1}
+
+
+def test_hold_blocks_others_until_confirmed(app):
+    with app.app_context():
+        hold_id = _hold(2, time(10, 0), time(12, 0), datetime.now() + timedelta(hours=1)).id
+
+        # Свободный по бронированиям слот удержан: остальные встают в очередь
+        result = admission.admit(_user('student1'), 1, DAY, time(11, 0), time(13, 0), 'study')
+        assert result.status == admission.QUEUED and result.conflict_id is None
+        assert admission.admit(_user('student2'), 1, DAY, time(12, 0), time(13, 0), 'study').status == admission.OK
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'student0', 'password': 'secret'})
+    client.get(f'/confirm_queue/{hold_id}')
+
+    with app.app_context():
+        assert db.session.get(BookingQueue, hold_id).status == 'booked'
+        booking = Booking.query.filter_by(user_id=2).one()
+        assert (booking.start_time, booking.end_time) == (time(10, 0), time(12, 0))
+        # Повторное подтверждение ничего не создаёт
+        assert admission.admit(_user('student0'), 1, DAY, time(10, 0), time(12, 0), 'x',
+                               hold=db.session.get(BookingQueue, hold_id)).status == admission.HOLD_EXPIRED
+
+
+def test_leaving_queue_with_hold_passes_slot_to_next_waiter(app):
+    with app.app_context():
+        hold_id = _hold(2, time(10, 0), time(12, 0), datetime.now() + timedelta(hours=1)).id
+        waiter_id = _enqueue(3, time(10, 30), time(11, 30)).id
+        assert db.session.get(BookingQueue, waiter_id).status == 'waiting'
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'student0', 'password': 'secret'})
+    client.get(f'/remove_from_queue/{hold_id}')
+
+    with app.app_context():
+        assert db.session.get(BookingQueue, hold_id) is None
+        waiter = db.session.get(BookingQueue, waiter_id)
+        assert waiter.status == 'notified'
+        assert waiter.hold_expires_at > datetime.now()
+
+
+def test_expired_holds_pass_to_next_waiters(app):
+    now = datetime.now()
+    with app.app_context():
+        hold = _hold(2, time(10, 0), time(12, 0), now - timedelta(minutes=1))
+        live = _hold(3, time(13, 0), time(14, 0), now + timedelta(minutes=30))
+        morning = _enqueue(4, time(10, 0), time(11, 0))
+        noon = _enqueue(5, time(11, 0), time(12, 0))
+        blocked = _enqueue(6, time(11, 30), time(13, 30))
+
+        assert expire_queue_holds(now=now) == 1
+        assert hold.status == 'expired'
+        assert live.status == 'notified'
+        assert (morning.status, noon.status, blocked.status) == ('notified', 'notified', 'waiting')
+        assert morning.hold_expires_at > now
+
+        result = admission.admit(_user('student0'), 1, DAY, time(10, 0), time(12, 0), 'late', hold=hold)
+        assert result.status == admission.HOLD_EXPIRED
+        assert expire_queue_holds(now=now) == 0
+
+
+def test_expiring_many_holds_is_batched(app):
+    now = datetime.now()
+    holds = 20000
+    with app.app_context():
+        db.session.execute(insert(BookingQueue), [{
+            'user_id': 2 + i % 5,
+            'classroom_id': 1,
+            'booking_date': DAY + timedelta(days=i % 100),
+            'start_time': time(8 + i % 12, 0),
+            'end_time': time(9 + i % 12, 0),
+            'order_key': i,
+            'status': 'notified',
+            'hold_expires_at': now - timedelta(seconds=i)
+        } for i in range(holds)])
+        waiter = _enqueue(2, time(8, 0), time(9, 0))
+        db.session.commit()
+
+        statements = _statements(lambda: expire_queue_holds(now=now))
+        assert BookingQueue.query.filter_by(status='expired').count() == holds
+        assert waiter.status == 'notified'
+        # Несколько запросов на пачку, а не на удержание
+        assert len(statements) < 10 * holds // 500 + 20, len(statements)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
@@ -0,0 +1,217 @@
+"""
+Режим webhook бота: обновления принимает aiohttp-сервер, обрабатывает пул
+воркеров с сохранением порядка в пределах чата, при остановке принятые
+обновления дорабатываются. Обновления шлются POST-запросами на локальный
+сервер; скорость сравнивается с long polling против поддельного Bot API
+(telegram_bot/fake_api.py). Нужен aiogram, иначе пропускается.
+Запустить: python -m pytest test_webhook.py -s
+"""
+
+import asyncio
+import random
+import time as timer
+
+import pytest
+
+pytest.importorskip('aiogram')
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message, Update
+from aiohttp import ClientSession, ClientConnectionError, web
+
+from telegram_bot import webhook
+from telegram_bot.fake_api import FakeBotAPI
+
+SECRET = 'test-secret'
+
+
+def _update(update_id, chat_id, text):
+    """Обновление с сообщением в форме Bot API"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(timer.time()), 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'student'},
+        },
+    }
+
+
+class _Recorder:
+    """Диспетчер, запоминающий порядок обработки и число одновременных обработчиков"""
+
+    def __init__(self, delay=0.0, answer=False):
+        self.dp = Dispatcher()
+        self.handled = []
+        self.active = 0
+        self.max_active = 0
+        self.done = asyncio.Event()
+        self.expected = None
+
+        @self.dp.message()
+        async def handle(message: Message):
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            try:
+                if delay:
+                    await asyncio.sleep(random.uniform(0, delay))
+                if answer:
+                    await message.answer('ok')
+                self.handled.append((message.chat.id, int(message.text)))
+            finally:
+                self.active -= 1
+            if len(self.handled) == self.expected:
+                self.done.set()
+
+
+async def _serve(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}{webhook.WEBHOOK_PATH}'
+
+
+def _bot(api=None):
+    if api is None:
+        return Bot('42:TEST')
+    return Bot('42:TEST', session=AiohttpSession(api=TelegramAPIServer.from_base(api.url)))
+
+
+async def _post_chats(url, chats, per_chat, secret=SECRET):
+    """Шлёт обновления чатов параллельно, а внутри чата - по одному, как Telegram"""
+    statuses = []
+    async with ClientSession() as client:
+        async def chat(chat_id):
+            for seq in range(per_chat):
+                update = _update(chat_id * per_chat + seq, chat_id, str(seq))
+                async with client.post(url, json=update, headers={webhook.SECRET_HEADER: secret}) as response:
+                    statuses.append(response.status)
+        await asyncio.gather(*(chat(chat_id) for chat_id in range(1, chats + 1)))
+    return statuses
+
+
+def test_updates_of_one_chat_are_handled_in_order():
+    chats, per_chat, workers = 50, 40, 8
+
+    async def run():
+        recorder = _Recorder(delay=0.002)
+        recorder.expected = chats * per_chat
+        bot = _bot()
+        runner, url = await _serve(webhook.create_app(recorder.dp, bot, secret=SECRET, workers=workers))
+        try:
+            statuses = await _post_chats(url, chats, per_chat)
+            await asyncio.wait_for(recorder.done.wait(), 30)
+        finally:
+            await runner.cleanup()
+            await bot.session.close()
+        return recorder, statuses
+
+    recorder, statuses = asyncio.run(run())
+    assert statuses == [200] * (chats * per_chat)
+    by_chat = {}
+    for chat_id, seq in recorder.handled:
+        by_chat.setdefault(chat_id, []).append(seq)
+    assert all(seqs == list(range(per_chat)) for seqs in by_chat.values())
+    assert len(by_chat) == chats
+    # Чаты обрабатываются параллельно, но не больше числа воркеров
+    assert 1 < recorder.max_active <= workers
+
+
+def test_bad_requests_are_rejected():
+    async def run():
+        recorder = _Recorder()
+        bot = _bot()
+        runner, url = await _serve(webhook.create_app(recorder.dp, bot, secret=SECRET))
+        try:
+            async with ClientSession() as client:
+                wrong = await client.post(url, json=_update(1, 1, '0'), headers={webhook.SECRET_HEADER: 'wrong'})
+                broken = await client.post(url, data=b'{', headers={webhook.SECRET_HEADER: SECRET})
+                return wrong.status, broken.status, recorder.handled
+        finally:
+            await runner.cleanup()
+            await bot.session.close()
+
+    assert asyncio.run(run()) == (401, 400, [])
+
+
+def test_shutdown_drains_accepted_updates():
+    chats, per_chat = 20, 10
+
+    async def run():
+        recorder = _Recorder(delay=0.05)
+        bot = _bot()
+        app = webhook.create_app(recorder.dp, bot, secret=SECRET, workers=4)
+        runner, url = await _serve(app)
+        try:
+            statuses = await _post_chats(url, chats, per_chat)
+            # Всё принято, но обработана лишь малая часть: 4 воркера по ~25 мс на обновление
+            assert len(recorder.handled) < chats * per_chat
+        finally:
+            await runner.cleanup()
+        pool = app[webhook.WORKERS_KEY]
+        late = await pool.submit(Update.model_validate(_update(10 ** 6, 1, '0')))
+        try:
+            async with ClientSession() as client:
+                await client.post(url, json=_update(10 ** 6, 1, '0'))
+            refused = False
+        except ClientConnectionError:
+            refused = True
+        await bot.session.close()
+        return recorder, statuses, late, refused
+
+    recorder, statuses, late, refused = asyncio.run(run())
+    assert statuses == [200] * (chats * per_chat)
+    assert len(recorder.handled) == chats * per_chat
+    assert late is False and refused
+
+
+def test_webhook_throughput_against_polling():
+    count, chats = 3000, 300
+
+    async def polling():
+        async with FakeBotAPI(global_rate=10 ** 6, chat_interval=0) as api:
+            recorder = _Recorder(answer=True)
+            recorder.expected = count
+            for i in range(count):
+                api.add_update(_update(i + 1, 1 + i % chats, str(i // chats)))
+            bot = _bot(api)
+            began = timer.perf_counter()
+            task = asyncio.create_task(recorder.dp.start_polling(bot, handle_signals=False, polling_timeout=1))
+            await asyncio.wait_for(recorder.done.wait(), 60)
+            elapsed = timer.perf_counter() - began
+            await recorder.dp.stop_polling()
+            await task
+            return count / elapsed
+
+    async def webhook_mode():
+        async with FakeBotAPI(global_rate=10 ** 6, chat_interval=0) as api:
+            recorder = _Recorder(answer=True)
+            recorder.expected = count
+            bot = _bot(api)
+            runner, url = await _serve(webhook.create_app(recorder.dp, bot, secret=SECRET))
+            try:
+                began = timer.perf_counter()
+                statuses = await _post_chats(url, chats, count // chats)
+                await asyncio.wait_for(recorder.done.wait(), 60)
+                elapsed = timer.perf_counter() - began
+            finally:
+                await runner.cleanup()
+                await bot.session.close()
+            assert statuses == [200] * count
+            assert len(api.sent) == count
+            return count / elapsed
+
+    polled = asyncio.run(polling())
+    pushed = asyncio.run(webhook_mode())
+    print(f'long polling: {polled:.0f} обновлений/с, webhook: {pushed:.0f} обновлений/с')
+    # Сервер и клиент делят один процессор, так что порядок величин одинаков; webhook не
+    # должен проигрывать из-за HTTP-запроса на каждое обновление и очередей по чатам
+    assert pushed > polled / 2
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))